@@ -8,9 +8,12 @@ Capture the Bug (CTB) - Instructor CLI
 Before the event:
 
   ctb validate            Validate ./ctb dependencies and configuration.
+    [-w|--watch]            -w  Live-refresh the microservices status.
   ctb setup [ess|gke]     Deploy ESS and GKE clusters, services, and agents.
     [-d|--dev]              -d  Deploy a smaller ESS cluster.
   ctb endpoints           List deployed endpoints and credentials.
+  ctb prebuild [SCENARIO...]  Build and push the images of every scenario
+                              (or of the given scenarios) ahead of time.
 
 During the event:
 
@@ -19,6 +22,8 @@ During the event:
     [-q|--quiet]            -q  Suppress "scenario start" message on Slack.
   ctb stabilize           Revert the services to the "stable" scenario.
     [-q|--quiet]            -q  Suppress "scenario done" message on Slack.
+  ctb status              Show the health of ESS, GKE, the frontend, and alerts.
+    [-w|--watch]            -w  Keep the dashboard open and refresh it live.
 
 After the event:
 
@@ -28,6 +33,11 @@ Dev usage:
 
   ctb diff SCENARIO [SCENARIO]  Compare the code of a scenario to the "stable"
                                 scenario or to another scenario.
+  ctb completion          Print the bash completion script of ctb, e.g.:
+                            eval "$(ctb completion)"
+
+Every command accepts --profile to print where its time went, and
+--profile=TRACE.json to also write a Chrome trace (chrome://tracing).
 
 Before using this tool, you must set the required variables in your .env file,
 which is located here:
@@ -39,132 +49,179 @@ which is located here:
 
 # Standard packages
 import os
-import re
 import sys
 
 # Proprietary packages
-from ctb.commands import destroy
-from ctb.commands import diff
-from ctb.commands import endpoints
-from ctb.commands import scenarios
-from ctb.commands import setup
-from ctb.commands import stabilize
-from ctb.commands import start
-from ctb.commands import stop
-from ctb.commands import validate
+from ctb import cli
+from ctb import config
+from ctb import trace
 from ctb.utils import env
 
-# Find and source the .env file before doing anything.
-#
-# Set BASEDIR as the directory of the current executing script, unless the user
-# overrides BASEDIR. If the user overrides BASEDIR with a relative path, assume
-# the parent directory is the current working directory of the user.
-if not os.environ.get("BASEDIR"):
-    os.environ["BASEDIR"] = os.path.dirname(os.path.realpath(__file__))
-elif not os.path.isabs(os.environ.get("BASEDIR")):
-    os.environ["BASEDIR"] = os.path.join(os.getcwd(), env("BASEDIR"))
-# Assume ENVFILE is .env on BASEDIR, unless the user overrides ENVFILE.
-# If the user overrides ENVFILE with a relative path, assume the path is the
-# current working directory of the user.
-if not os.environ.get("ENVFILE"):
-    os.environ["ENVFILE"] = os.path.join(env("BASEDIR"), ".env")
-elif not os.path.isabs(os.environ.get("ENVFILE")):
-    os.environ["ENVFILE"] = os.path.join(os.getcwd(), env("ENVFILE"))
-if not os.path.isfile(env("ENVFILE")):
-    print("Warning: .env file not found: {}".format(env("ENVFILE")))
-    sys.exit(1)
-with open(env("ENVFILE"), "r") as file:
-    for line in file:
-        matches = re.findall(patterns.ENV_VAR, line)
-        if len(matches) > 0:
-            variable, value = matches[0]
-            os.environ[variable] = value
+def scenarios():
+    """Return the names of the scenarios, from the cached manifest index."""
+    from ctb import manifests
+    return manifests.scenarios()
+
+def targets(values):
+    """Return whether to include ESS and GKE, given [ess|gke] arguments."""
+    if not values:
+        return True, True
+    return "ess" in values, "gke" in values
+
+# Commands, their arguments, and their handlers. The module of a command is
+# imported only when it is dispatched, after its arguments are validated, so
+# that light commands (e.g. endpoints) don't pay for the imports of heavy ones.
+COMMANDS = [
+    cli.Command(
+        "validate", "ctb.commands.validate",
+        lambda module, values: module.run(values["watch"]),
+        flags=[ cli.Flag("watch", "-w", "--watch") ]
+    ),
+    cli.Command(
+        "setup", "ctb.commands.setup",
+        lambda module, values: module.run(*targets(values["targets"]), dev=values["dev"]),
+        arguments=[ cli.Argument("targets", choices=( "ess", "gke" ), many=True) ],
+        flags=[ cli.Flag("dev", "-d", "--dev") ]
+    ),
+    cli.Command(
+        "endpoints", "ctb.commands.endpoints",
+        lambda module, values: module.run()
+    ),
+    cli.Command(
+        "prebuild", "ctb.commands.prebuild",
+        lambda module, values: module.run(values["scenarios"]),
+        arguments=[ cli.Argument("scenarios", choices=scenarios, many=True) ]
+    ),
+    cli.Command(
+        "scenarios", "ctb.commands.scenarios",
+        lambda module, values: module.run()
+    ),
+    cli.Command(
+        "start", "ctb.commands.start",
+        lambda module, values: module.run(values["scenario"], values["quiet"]),
+        arguments=[ cli.Argument("scenario", choices=scenarios, default="stable") ],
+        flags=[ cli.Flag("quiet", "-q", "--quiet") ]
+    ),
+    cli.Command(
+        "stabilize", "ctb.commands.stabilize",
+        lambda module, values: module.run(values["quiet"]),
+        flags=[ cli.Flag("quiet", "-q", "--quiet") ]
+    ),
+    cli.Command(
+        "status", "ctb.commands.status",
+        lambda module, values: module.run(values["watch"]),
+        flags=[ cli.Flag("watch", "-w", "--watch") ]
+    ),
+    cli.Command(
+        "stop", "ctb.commands.stop",
+        lambda module, values: module.run()
+    ),
+    cli.Command(
+        "destroy", "ctb.commands.destroy",
+        lambda module, values: module.run(*targets(values["targets"])),
+        arguments=[ cli.Argument("targets", choices=( "ess", "gke" ), many=True) ]
+    ),
+    cli.Command(
+        "diff", "ctb.commands.diff",
+        lambda module, values: module.run(values["scenario"], values["scenario_to"]),
+        arguments=[
+            cli.Argument("scenario", choices=scenarios, required=True),
+            cli.Argument("scenario_to", choices=scenarios, default="stable")
+        ]
+    ),
+]
+
+def set_paths():
+    """Set BASEDIR as the directory of the current executing script, unless the
+    user overrides BASEDIR. If the user overrides BASEDIR with a relative path,
+    assume the parent directory is the current working directory of the user.
+    """
+    if not os.environ.get("BASEDIR"):
+        os.environ["BASEDIR"] = os.path.dirname(os.path.realpath(__file__))
+    elif not os.path.isabs(os.environ.get("BASEDIR")):
+        os.environ["BASEDIR"] = os.path.join(os.getcwd(), env("BASEDIR"))
+    # Assume ENVFILE is .env on BASEDIR, unless the user overrides ENVFILE.
+    # If the user overrides ENVFILE with a relative path, assume the path is the
+    # current working directory of the user.
+    if not os.environ.get("ENVFILE"):
+        os.environ["ENVFILE"] = os.path.join(env("BASEDIR"), ".env")
+    elif not os.path.isabs(os.environ.get("ENVFILE")):
+        os.environ["ENVFILE"] = os.path.join(os.getcwd(), env("ENVFILE"))
+
+def load_env():
+    """Find and source the .env file before doing anything."""
+    set_paths()
+    if not os.path.isfile(env("ENVFILE")):
+        print("Warning: .env file not found: {}".format(env("ENVFILE")))
+        sys.exit(1)
+    for variable, value in config.envfile(env("ENVFILE")).items():
+        os.environ[variable] = value
 
 def help():
     """Print CLI usage."""
     print(__doc__.format(ENVFILE=env("ENVFILE")))
 
 
-####  Main  ####################################################################
+def report_profile(trace_file=None):
+    """Print the phase timings, and write them as a Chrome trace if asked."""
+    print("")
+    print("\n".join(trace.summary()))
+    if trace_file:
+        trace.write_chrome_trace(trace_file)
+        print("")
+        print("Trace written to: {}".format(trace_file))
 
-def run():
 
-    # Validate arguments
-    if len(sys.argv) < 2:
-        help()
-        sys.exit(1)
-
-    # Parse command
-    command = sys.argv[1]
-    args = []
-    flags = []
-    for arg in sys.argv[2:]:
-        if arg.startswith("-"):
-            flags.append(arg)
-        else:
-            args.append(arg)
-
-    # Run command
-    if command == "validate":
-        commands.validate.run()
-        sys.exit(0)
-
-    elif command == "setup":
-        ess = True
-        gke = True
-        if "ess" in args or "gke" in args:
-            ess = "ess" in args
-            gke = "gke" in args
-        dev = "-d" in flags or "--dev" in flags
-        commands.setup.run(ess, gke, dev)
-        sys.exit(0)
+####  Main  ####################################################################
 
-    elif command == "endpoints":
-        commands.endpoints.run()
-        sys.exit(0)
+def run():
 
-    elif command == "scenarios":
-        commands.scenarios.run()
+    # Shell completion runs on every keystroke: it only needs the paths.
+    if sys.argv[1:2] == [ "__complete" ]:
+        set_paths()
+        index = int(sys.argv[2]) if len(sys.argv) > 2 else 1
+        try:
+            print("\n".join(cli.complete(COMMANDS, sys.argv[3:], index)))
+        except Exception:
+            pass
         sys.exit(0)
-
-    elif command == "start":
-        scenario = "stable"
-        if len(args) > 0:
-            scenario = args[0]
-        quiet = "-q" in flags or "--quiet" in flags
-        commands.start.run(scenario, quiet)
+    if sys.argv[1:2] == [ "completion" ]:
+        print(cli.BASH_COMPLETION.strip())
         sys.exit(0)
 
-    elif command == "stabilize":
-        quiet = "-q" in flags or "--quiet" in flags
-        commands.stabilize.run(quiet)
-        sys.exit(0)
+    load_env()
 
-    elif command == "stop":
-        commands.stop.run()
-        sys.exit(0)
+    # --profile[=TRACE.json] applies to every command.
+    argv = [ arg for arg in sys.argv[1:] if not (arg == "--profile" or arg.startswith("--profile=")) ]
+    profile = [ arg for arg in sys.argv[1:] if arg not in argv ]
+    sys.argv = sys.argv[:1] + argv
+    if profile:
+        trace.enable()
 
-    elif command == "destroy":
-        ess = True
-        gke = True
-        if "ess" in args or "gke" in args:
-            ess = "ess" in args
-            gke = "gke" in args
-        commands.destroy.run(ess, gke)
-        sys.exit(0)
+    # Validate arguments
+    if len(sys.argv) < 2:
+        help()
+        sys.exit(1)
+    command = next(( command for command in COMMANDS if command.name == sys.argv[1] ), None)
+    if command is None:
+        help()
+        sys.exit(1)
+    try:
+        values = command.parse(sys.argv[2:])
+    except cli.UsageError as e:
+        print("")
+        print("Error: {}".format(e))
+        help()
+        sys.exit(1)
 
-    elif command == "diff":
-        scenario_from = ""
-        scenario_to = "stable"
-        if len(args) > 0:
-            scenario_from = args[0]
-            if len(args) > 1:
-                scenario_to = args[1]
-            commands.diff.run(scenario_from, scenario_to)
-            sys.exit(0)
-
-    help()
-    sys.exit(1)
+    # Run command
+    try:
+        with trace.phase("ctb {}".format(command.name), "command"):
+            command.run(values)
+    finally:
+        if profile:
+            report_profile(profile[-1].partition("=")[2])
+    sys.exit(0)
 
 
 if __name__ == "__main__":
@@ -7,7 +7,7 @@ Kibana alerts management utils.
 # Standard packages
 import base64
 import hashlib
-import os
+import json
 import traceback
 
 # Third-party packages
@@ -15,73 +15,188 @@ import requests
 
 # Proprietary packages
 from ctb import constants
+from ctb import http
+from ctb import templates
 from ctb import utils
+from ctb import wait
 from ctb.utils import env
 
 
+# Tag that records the content hash of the payload an alert was created from.
+HASH_TAG_PREFIX = "ctb.hash:"
+
+# Fields of a payload that are not compared with the live alert.
+UNCOMPARED_FIELDS = ( "alertTypeId", "consumer", "enabled" )
+
+# Seconds to retry a page of alerts that Kibana fails to return.
+FIND_TIMEOUT = 60
+
+
+def payload_hash(payload):
+    """Return a stable content hash of a rendered payload."""
+    return hashlib.sha1(json.dumps(payload, sort_keys=True).encode("utf-8")).hexdigest()[0:12]
+
+def saved_hash(saved_alert):
+    """Return the content hash recorded on a saved alert, if any."""
+    for tag in saved_alert.get("tags", []):
+        if tag.startswith(HASH_TAG_PREFIX):
+            return tag[len(HASH_TAG_PREFIX):]
+    return None
+
+def kibana_alert_id(alert_id, service_id):
+    """Return the ID of the Kibana alert of an alert for a given service.
+
+    The ID is derived from both, so each alert keeps the same ID across
+    deployments, whatever its name or tags are."""
+    return "7fdcfd30-9309-11eb-a1a7-{}".format(hashlib.sha1("{}-{}".format(alert_id, service_id).encode("utf-8")).hexdigest()[0:12])
+
+def find_page(page, per_page):
+    """Return a page of the Kibana alerts query. Network errors, 429 and 5xx
+    responses are retried with backoff for up to FIND_TIMEOUT seconds, and
+    other errors are raised."""
+    def check():
+        response = http.kibana().get("/api/alerts/_find", params={ "page": page, "per_page": per_page })
+        if response.status_code == 429 or response.status_code in range(500, 599):
+            raise requests.exceptions.HTTPError(response.content, response=response)
+        if response.status_code not in range(200, 299):
+            raise Exception(response.content)
+        return response.json()
+    name = "alerts page {}".format(page)
+    return wait.until(wait.Condition(name, check, timeout=FIND_TIMEOUT), stream=None)[name]
+
+def find_all():
+    """Fetch every Kibana alert with one paginated query."""
+    saved_alerts = []
+    page = 1
+    per_page = 100
+    while True:
+        body = find_page(page, per_page)
+        saved_alerts.extend(body.get("data", []))
+        if page * per_page >= body.get("total", 0):
+            break
+        page += 1
+    return saved_alerts
+
+def inventory(saved_alerts=None):
+    """Index the Kibana alerts (by default, every alert from find_all()) by
+    the (alert id, service id) pairs of constants.ALERTS and constants.SERVICES.
+
+    Alerts are matched by their ID, from kibana_alert_id(). Their names can
+    be edited in Kibana, and are not unique."""
+    ids = {}
+    for service_id, service in constants.SERVICES.items():
+        for alert_id in service["alerts"].keys():
+            ids[kibana_alert_id(alert_id, service_id)] = ( alert_id, service_id )
+    index = {}
+    for saved_alert in find_all() if saved_alerts is None else saved_alerts:
+        key = ids.get(saved_alert.get("id"))
+        if key:
+            index[key] = saved_alert
+    return index
+
+def matches(expected, live):
+    """Return whether a live value has every field of an expected one.
+
+    Kibana adds fields of its own (e.g. actionTypeId to actions) and may
+    coerce scalars (e.g. a threshold of "500" to 500), so neither counts as
+    a difference."""
+    if isinstance(expected, dict):
+        return isinstance(live, dict) and all(key in live and matches(value, live[key]) for key, value in expected.items())
+    if isinstance(expected, list):
+        return isinstance(live, list) and len(expected) == len(live) and all(matches(e, l) for e, l in zip(expected, live))
+    return expected == live or str(expected) == str(live)
+
+def drifted(payload, saved_alert):
+    """Return whether a saved alert differs from its rendered payload, e.g.
+    after an edit in Kibana. Fields that an update cannot change, and the
+    enabled state that start and stabilize toggle, are not compared."""
+    return not matches({ key: value for key, value in payload.items() if key not in UNCOMPARED_FIELDS }, saved_alert)
+
+def alert_context(alert, service):
+    """Return the template variables of an alert for a given service."""
+    context = {
+        "KIBANA_URL": env("KIBANA_URL"),
+        "SLACK_ACTION_ID": env("SLACK_ACTION_ID"),
+        "SLACK_WEBHOOK_URL": env("SLACK_WEBHOOK_URL"),
+        "SERVICE_NAME": service["name"],
+        "SERVICE_NAME_LOWERCASE": service["name"].lower(),
+        "THRESHOLD": service["alerts"][alert["id"]]["threshold"],
+        "SEVERITY": service["alerts"][alert["id"]]["severity"]
+    }
+    if alert["id"].startswith("synthetics"):
+        context["MONITOR_NAME"] = service["id"]
+        context["MONITOR_NAME_BASE64"] = base64.b64encode(service["id"].replace(" ", "").encode("utf-8")).decode("utf-8")
+    return context
+
+def render_message(name, context):
+    """Render an alert message with its header and footer, escaped to be
+    embedded in a JSON string."""
+    context = dict(context)
+    context["ALERT_MESSAGE_HEADER"] = templates.render("alert-message-header.md", context)
+    context["ALERT_MESSAGE_FOOTER"] = templates.render("alert-message-footer.md", context)
+    return templates.render(name, context).replace("\n", "\\n")
+
+def render_kibana_alert(alert, service):
+    """Render the payload that creates a Kibana alert for a given service."""
+    context = alert_context(alert, service)
+    context["ALERT_MESSAGE"] = render_message("alert-{}-message.md".format(alert["id"]), context)
+    payload = templates.render_json("alert-{}.json".format(alert["id"]), context)
+    # Handle typo in Metrics alerts prior to version 7.12.0
+    if env("ELASTICSEARCH_VERSION") < "7.12.0" and alert["id"].startswith("saturation-"):
+        payload["actions"][0]["group"] = "metrics.invenotry_threshold.fired"
+    return payload
+
+def render_watcher():
+    """Render the payload of the "No Purchases" Watcher alert."""
+    context = {
+        "KIBANA_URL": env("KIBANA_URL"),
+        "SLACK_WEBHOOK_URL": env("SLACK_WEBHOOK_URL"),
+        "SERVICE_NAME": "frontend",
+        "SERVICE_NAME_LOWERCASE": "frontend"
+    }
+    context["ALERT_MESSAGE"] = render_message("watcher-no-purchases-message.md", context)
+    return templates.render_json("watcher-no-purchases.json", context)
+
 def create_kibana_alert(task):
-    """Pickable function to create a Kibana alert.
-    Can be executed concurrently with a multiprocessing pool."""
-    alert, service = task
-    os.environ["SERVICE_NAME"] = service["name"]
-    os.environ["SERVICE_NAME_LOWERCASE"] = service["name"].lower()
-    alert_id = "7fdcfd30-9309-11eb-a1a7-{}".format(hashlib.sha1("{}-{}".format(alert["id"], service["id"])).hexdigest()[0:12])
-    url_get = "{}/.kibana/_search?q=(type:alert+AND+{}+AND+{})".format(env("ELASTICSEARCH_URL"), alert["type"], os.environ["SERVICE_NAME_LOWERCASE"])
-    url_post = "{}/api/alerts/alert/{}".format(env("KIBANA_URL"), alert_id)
+    """Create or update a Kibana alert.
+    Can be executed concurrently with utils.parallel_tasks().
+
+    The task carries the saved alert from inventory(), or None if the alert
+    does not exist yet, and the payload to apply."""
+    alert, service, saved_alert, payload = task
+    alert_id = kibana_alert_id(alert["id"], service["id"])
+    update = saved_alert is not None
+    url_post = "/api/alerts/alert/{}".format(alert_id)
     attempts = 0
     max_attempts = 4
     verified = False
     response_post = None
     while not verified and attempts < max_attempts:
         try:
-            response = requests.get(
-                url=url_get,
-                auth=(env("ELASTICSEARCH_USERNAME"), env("ELASTICSEARCH_PASSWORD")),
-                timeout=30
-            )
-            update = False
-            if response.json().get("hits", {}).get("total", {}).get("value") == 0:
+            if not update:
                 print("...creating alert: {} - {}".format(alert["name"], service["name"]))
             else:
-                update = True
                 print("...updating alert: {} - {}".format(alert["name"], service["name"]))
-            os.environ["THRESHOLD"] = service["alerts"][alert["id"]]["threshold"]
-            os.environ["SEVERITY"] = service["alerts"][alert["id"]]["severity"]
-            if alert["id"].startswith("synthetics"):
-                os.environ["MONITOR_NAME"] = service["id"]
-                os.environ["MONITOR_NAME_BASE64"] = base64.b64encode(service["id"].replace(" ", ""))
-            os.environ["ALERT_MESSAGE_HEADER"] = utils.load_template(os.path.join(env("BASEDIR"), "elasticsearch", "alert-message-header.md"))
-            os.environ["ALERT_MESSAGE_FOOTER"] = utils.load_template(os.path.join(env("BASEDIR"), "elasticsearch", "alert-message-footer.md"))
-            os.environ["ALERT_MESSAGE"] = utils.load_template(os.path.join(env("BASEDIR"), "elasticsearch", "alert-{}-message.md".format(alert["id"]))).replace("\n", "\\n")
-            filename = os.path.join(env("BASEDIR"), "elasticsearch", "alert-{}.json".format(alert["id"]))
-            payload = utils.load_template_json(filename)
             # Kibana does not want these fields when updating an alert
+            body = dict(payload)
             if update:
-                del payload["alertTypeId"]
-                del payload["enabled"]
-                del payload["consumer"]
-            # Handle typo in Metrics alerts prior to version 7.12.0
-            if env("ELASTICSEARCH_VERSION") < "7.12.0" and alert["id"].startswith("saturation-"):
-                payload["actions"][0]["group"] = "metrics.invenotry_threshold.fired"
-            response_post = requests.request(
+                del body["alertTypeId"]
+                del body["enabled"]
+                del body["consumer"]
+            response_post = http.kibana().request(
                 method="post" if not update else "put",
                 url=url_post,
-                auth=(env("ELASTICSEARCH_USERNAME"), env("ELASTICSEARCH_PASSWORD")),
-                headers=constants.kibana_api_headers(),
-                json=payload,
-                timeout=30
+                json=body
             )
-            response_get = requests.get(
-                url=url_get,
-                auth=(env("ELASTICSEARCH_USERNAME"), env("ELASTICSEARCH_PASSWORD")),
-                timeout=30
-            )
-            if response_post.status_code in range(200, 299) and response_get.json().get("hits", {}).get("total", {}).get("value") > 0:
+            if response_post.status_code in range(200, 299) and response_post.json().get("id") == alert_id:
                 if not update:
                     print("......created: {} - {}".format(alert["name"], service["name"]))
                 else:
                     print("......updated: {} - {}".format(alert["name"], service["name"]))
                 verified = True
+            elif response_post.status_code == 409:
+                # Created by a previous attempt; update it instead.
+                update = True
             else:
                 print(response_post.content)
         except requests.exceptions.ReadTimeout:
@@ -94,37 +209,66 @@ def create_kibana_alert(task):
     if attempts >= max_attempts:
         print("......failure: {}-{}".format(alert["name"], service["name"]))
 
+def delete_kibana_alert(saved_alert):
+    """Delete a Kibana alert that ctb no longer manages.
+    Can be executed concurrently with utils.parallel_tasks()."""
+    print("...deleting alert: {}".format(saved_alert["name"]))
+    response = http.kibana().delete("/api/alerts/alert/{}".format(saved_alert["id"]))
+    if response.status_code in range(200, 299) or response.status_code == 404:
+        print("......deleted: {}".format(saved_alert["name"]))
+    else:
+        print("......failure: {}".format(saved_alert["name"]))
+        print(response.content)
+
+def reconcile():
+    """Create, update, or delete Kibana alerts so that they match their
+    rendered payloads. Alerts whose live fields match their payload are left
+    untouched, and alerts that ctb created (they carry its hash tag) but no
+    longer renders are deleted."""
+    saved_alerts = find_all()
+    index = inventory(saved_alerts)
+    tasks = []
+    kept = set()
+    unchanged = 0
+    for service_id, service in constants.SERVICES.items():
+        for alert_id in service["alerts"].keys():
+            # TODO: There are duplicate monitors for downtime alerts.
+            # TODO: Wait for throttling to work in synthetics alerts.
+            if alert_id in ( "downtime", "synthetics-failures" ):
+                continue
+            alert = constants.ALERTS[alert_id]
+            payload = render_kibana_alert(alert, service)
+            payload["tags"] = payload.get("tags", []) + [ HASH_TAG_PREFIX + payload_hash(payload) ]
+            saved_alert = index.get(( alert_id, service_id ))
+            if saved_alert:
+                kept.add(saved_alert["id"])
+                if not drifted(payload, saved_alert):
+                    unchanged += 1
+                    continue
+            tasks.append(( alert, service, saved_alert, payload ))
+    stale = [ saved_alert for saved_alert in saved_alerts if saved_hash(saved_alert) and saved_alert["id"] not in kept ]
+    print("...unchanged: {} alerts".format(unchanged))
+    utils.parallel_tasks(create_kibana_alert, tasks)
+    utils.parallel_tasks(delete_kibana_alert, stale)
+
 def toggle_kibana_alert(task):
-    """Pickable function to enable or disable a Kibana alert.
-    Can be executed concurrently with a multiprocessing pool."""
-    alert, service, enable_or_disable = task
-    os.environ["SERVICE_NAME"] = service["name"]
-    os.environ["SERVICE_NAME_LOWERCASE"] = service["name"].lower()
+    """Enable or disable a Kibana alert.
+    Can be executed concurrently with utils.parallel_tasks().
+
+    The task carries the ID of the alert from inventory(), or None if the
+    alert does not exist."""
+    alert, service, enable_or_disable, alert_id = task
     attempts = 0
     max_attempts = 4
     verified = False
     response_post = None
     while not verified and attempts < max_attempts:
         try:
-            url_get = "{}/.kibana/_search?q=(type:alert+AND+{}+AND+{})".format(env("ELASTICSEARCH_URL"), alert["type"], os.environ["SERVICE_NAME_LOWERCASE"])
-            response_get = requests.get(
-                url=url_get,
-                auth=(env("ELASTICSEARCH_USERNAME"), env("ELASTICSEARCH_PASSWORD")),
-                timeout=30
-            )
-            hits = response_get.json().get("hits", {}).get("hits", [{}])
-            alert_id = hits[0].get("_id") if hits else None
             if alert_id:
-                alert_id = alert_id.split(":", 1)[1]
                 verb = "enabling" if enable_or_disable == "enable" else "disabling"
                 print("...{} alert: {} - {}".format(verb, alert["name"], service["name"]))
-                url_post = "{}/api/alerts/alert/{}/_{}".format(env("KIBANA_URL"), alert_id, enable_or_disable)
-                response_post = requests.post(
-                    url=url_post,
-                    auth=(env("ELASTICSEARCH_USERNAME"), env("ELASTICSEARCH_PASSWORD")),
-                    headers=constants.kibana_api_headers(),
-                    timeout=30
-                )
+                url_post = "/api/alerts/alert/{}/_{}".format(alert_id, enable_or_disable)
+                response_post = http.kibana().post(url_post)
                 if response_post.status_code in range(200, 299):
                     print("......success: {} - {}".format(alert["name"], service["name"]))
                     verified = True
@@ -146,17 +290,17 @@ def toggle_kibana_alert(task):
 def toggle_all(enable_or_disable):
 
     # Enable or diable Kibana alerts
+    saved_alerts = inventory()
     tasks = []
-    num_processes = 0
     for service_id, service in constants.SERVICES.items():
         for alert_id in service["alerts"].keys():
             # TODO: There are duplicate monitors for downtime alerts.
             # TODO: Wait for throttling to work in synthetics alerts.
             if alert_id in ( "downtime", "synthetics-failures" ):
                 continue
-            tasks.append(( constants.ALERTS[alert_id], service, enable_or_disable ))
-            num_processes += 1
-    utils.parallel_tasks(toggle_kibana_alert, tasks, num_processes)
+            saved_alert = saved_alerts.get(( alert_id, service_id ))
+            tasks.append(( constants.ALERTS[alert_id], service, enable_or_disable, saved_alert["id"] if saved_alert else None ))
+    utils.parallel_tasks(toggle_kibana_alert, tasks)
 
     # Enable or disable Watcher alerts
     attempts = 0
@@ -166,11 +310,7 @@ def toggle_all(enable_or_disable):
     while not verified and attempts < max_attempts:
         try:
             action = "_activate" if enable_or_disable == "enable" else "_deactivate"
-            response_put = requests.put(
-                url="{}/_watcher/watch/no-purchases/{}".format(env("ELASTICSEARCH_URL"), action),
-                auth=(env("ELASTICSEARCH_USERNAME"), env("ELASTICSEARCH_PASSWORD")),
-                timeout=30
-            )
+            response_put = http.elasticsearch().put("/_watcher/watch/no-purchases/{}".format(action))
             if response_put.status_code == 404:
                 print("...does not exist: No Purchases")
                 verified = True
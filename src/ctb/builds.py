@@ -0,0 +1,153 @@
+#!/usr/bin/python
+# coding: utf-8
+"""
+Content-addressed cache of the images built for each scenario.
+
+Every artifact of a skaffold profile is identified by a hash of its build
+context. A local manifest maps those hashes to the images that were already
+pushed, so only artifacts with new content are built again.
+"""
+
+# Standard packages
+import hashlib
+import json
+import os
+import re
+import tempfile
+import threading
+
+# Proprietary packages
+from ctb import manifests
+from ctb.utils import cmd, env, state_dir
+
+_lock = threading.Lock()
+
+
+####  Paths  ###################################################################
+
+def manifest_path():
+    return os.path.join(state_dir(), "builds.json")
+
+def artifacts_path(scenario):
+    """skaffold build artifacts file of a scenario, for skaffold deploy."""
+    return os.path.join(state_dir(), "artifacts-{}.json".format(scenario))
+
+def default_repo():
+    return "gcr.io/{}".format(env("GCP_PROJECT_NAME"))
+
+
+####  Artifacts  ###############################################################
+
+def profiles():
+    """Return the profiles of skaffold.yaml, keyed by name."""
+    return manifests.index().profiles
+
+def artifacts(scenario):
+    """Return the build artifacts of a scenario."""
+    profile = profiles().get(scenario)
+    if profile is None:
+        raise Exception("Unknown scenario: {}".format(scenario))
+    return profile.get("build", {}).get("artifacts", [])
+
+def context_hash(artifact):
+    """Return a hash of everything that goes into building an artifact: its
+    image name, the files of its build context, and its build arguments."""
+    digest = hashlib.sha256()
+    digest.update(artifact["image"].encode("utf-8"))
+    build_args = artifact.get("docker", {}).get("buildArgs", {})
+    for name in sorted(build_args.keys()):
+        value = re.sub(r"\{\{\s*\.(\w+)\s*\}\}", lambda match: env(match.group(1)) or "", str(build_args[name]))
+        digest.update("\0{}={}".format(name, value).encode("utf-8"))
+    context = os.path.join(env("BASEDIR"), artifact["context"])
+    for root, dirs, files in os.walk(context):
+        dirs[:] = sorted(d for d in dirs if d != ".git")
+        for filename in sorted(files):
+            filepath = os.path.join(root, filename)
+            digest.update("\0{}\0".format(os.path.relpath(filepath, context)).encode("utf-8"))
+            with open(filepath, "rb") as file:
+                for chunk in iter(lambda: file.read(1 << 16), b""):
+                    digest.update(chunk)
+    return digest.hexdigest()
+
+
+####  Manifest  ################################################################
+
+def load_manifest():
+    """Return the pushed images, keyed by repository, image, and hash."""
+    try:
+        with open(manifest_path(), "r") as file:
+            return json.load(file)
+    except (IOError, ValueError):
+        return {}
+
+def lookup(artifact, digest):
+    """Return the pushed image of an artifact with the given hash, if any."""
+    return load_manifest().get(default_repo(), {}).get(artifact["image"], {}).get(digest)
+
+def record(image, digest, tag):
+    """Record a pushed image in the manifest."""
+    with _lock:
+        manifest = load_manifest()
+        manifest.setdefault(default_repo(), {}).setdefault(image, {})[digest] = tag
+        fd, tmp = tempfile.mkstemp(prefix="builds.", dir=state_dir())
+        with os.fdopen(fd, "w") as file:
+            json.dump(manifest, file, indent=2, sort_keys=True)
+        os.replace(tmp, manifest_path())
+
+
+####  Build  ###################################################################
+
+def skaffold_build(scenario, images, stdout=True):
+    """Build and push the given images of a scenario with skaffold, and
+    return the resulting tags keyed by image name. Raise an exception if any
+    of the images was not built.
+
+    If stdout is False, the output of skaffold is only shown on failure."""
+    fd, output = tempfile.mkstemp(prefix="skaffold-build.", suffix=".json", dir=state_dir())
+    os.close(fd)
+    try:
+        command = "skaffold build --default-repo={} -p {} {} --file-output='{}'".format(
+            default_repo(), scenario, " ".join("-b {}".format(image) for image in images), output
+        )
+        if stdout:
+            exitcode = cmd(command)
+        else:
+            exitcode, out, err = cmd(command, stdout=False)
+            if exitcode != 0:
+                print(out.decode("utf-8", "replace"))
+                print(err.decode("utf-8", "replace"))
+        if exitcode != 0:
+            raise Exception("skaffold build failed for the '{}' profile".format(scenario))
+        with open(output, "r") as file:
+            tags = { build["imageName"]: build["tag"] for build in json.load(file).get("builds", []) }
+        # Deploying without a built tag would pull the unprefixed image name.
+        unbuilt = sorted(set(images) - set(tags))
+        if unbuilt:
+            raise Exception("skaffold build did not build {} for the '{}' profile".format(", ".join(unbuilt), scenario))
+        return tags
+    finally:
+        os.remove(output)
+
+def build(scenario):
+    """Build the artifacts of a scenario whose content is not pushed yet, and
+    write the artifacts file that skaffold deploy needs. Return its path."""
+    builds = []
+    missing = {}
+    for artifact in artifacts(scenario):
+        digest = context_hash(artifact)
+        tag = lookup(artifact, digest)
+        if tag:
+            print("...reusing: {}".format(tag))
+            builds.append({ "imageName": artifact["image"], "tag": tag })
+        else:
+            missing[artifact["image"]] = digest
+    if missing:
+        print("...building: {}".format(", ".join(sorted(missing.keys()))))
+        for image, tag in skaffold_build(scenario, sorted(missing.keys())).items():
+            if image in missing:
+                record(image, missing[image], tag)
+                builds.append({ "imageName": image, "tag": tag })
+    path = artifacts_path(scenario)
+    with open(path, "w") as file:
+        json.dump({ "builds": builds }, file, indent=2, sort_keys=True)
+    return path
@@ -0,0 +1,116 @@
+#!/usr/bin/python
+# coding: utf-8
+"""
+Time-to-live cache of probe results.
+
+Probes are memoised in-process for a few seconds, so repeated status checks
+(e.g. in setup, and then in validate) don't hit the network again. Results
+are keyed by the probe arguments and by the environment variables the probe
+depends on, so a new deployment ID or URL is a cache miss.
+
+Negative results (falsy values) and exceptions are not cached by default,
+since callers usually poll until a probe turns positive. When the
+CTB_PROBE_CACHE environment variable is "disk", JSON-serialisable results are
+also kept in .ctb/probes.json, and shared across invocations.
+
+Call invalidate() on a probe (or on the cache as a whole) after any change
+that it reports on.
+"""
+
+# Standard packages
+import functools
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+
+# Proprietary packages
+from ctb.utils import env, state_dir
+
+_entries = {}
+_lock = threading.RLock()
+
+
+def disk_enabled():
+    return (env("CTB_PROBE_CACHE") or "").lower() == "disk"
+
+def disk_path():
+    return os.path.join(state_dir(), "probes.json")
+
+def load_disk():
+    try:
+        with open(disk_path(), "r") as file:
+            return json.load(file)
+    except (IOError, ValueError):
+        return {}
+
+def save_disk(entries):
+    now = time.time()
+    entries = { key: entry for key, entry in entries.items() if entry[0] > now }
+    fd, tmp = tempfile.mkstemp(prefix="probes.", dir=state_dir())
+    with os.fdopen(fd, "w") as file:
+        json.dump(entries, file)
+    os.replace(tmp, disk_path())
+
+def serialisable(value):
+    try:
+        json.dumps(value)
+        return True
+    except (TypeError, ValueError):
+        return False
+
+def cache_key(name, args, kwargs, scope):
+    # The scope holds credentials, so the key keeps only a hash of it.
+    digest = hashlib.sha256(json.dumps([ env(variable) for variable in scope ]).encode("utf-8")).hexdigest()
+    return json.dumps([ name, [ repr(arg) for arg in args ], sorted((k, repr(v)) for k, v in kwargs.items()), digest ])
+
+def cached(ttl, scope=(), negative=False, disk=True):
+    """Cache the results of a probe for ttl seconds.
+
+    scope names the environment variables that the probe depends on. With
+    negative=True, falsy results are cached too. With disk=False, results
+    are never written to the disk cache (e.g. for response objects)."""
+    def decorator(function):
+        name = "{}.{}".format(function.__module__, function.__name__)
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            key = cache_key(name, args, kwargs, scope)
+            now = time.time()
+            with _lock:
+                entry = _entries.get(key)
+                if entry is None and disk and disk_enabled():
+                    entry = load_disk().get(key)
+                if entry is not None and entry[0] > now:
+                    _entries[key] = entry
+                    return entry[1]
+            value = function(*args, **kwargs)
+            if value or negative:
+                with _lock:
+                    _entries[key] = ( now + ttl, value )
+                    if disk and disk_enabled() and serialisable(value):
+                        entries = load_disk()
+                        entries[key] = [ now + ttl, value ]
+                        save_disk(entries)
+            return value
+
+        def invalidate_probe():
+            """Forget the cached results of this probe."""
+            invalidate(name)
+
+        wrapper.invalidate = invalidate_probe
+        wrapper.uncached = function
+        return wrapper
+    return decorator
+
+def invalidate(*names):
+    """Forget the cached results of the named probes, or of every probe."""
+    def matches(key):
+        return not names or json.loads(key)[0] in names
+    with _lock:
+        for key in [ key for key in _entries if matches(key) ]:
+            del _entries[key]
+        if disk_enabled() and os.path.isfile(disk_path()):
+            save_disk({ key: entry for key, entry in load_disk().items() if not matches(key) })
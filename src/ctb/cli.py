@@ -0,0 +1,122 @@
+#!/usr/bin/python
+# coding: utf-8
+"""
+Declarative command-line parsing.
+
+Every command declares its positional arguments, flags, and handler. The
+command line is checked against that schema before the module of the command
+is imported, and the same schema drives shell completion.
+"""
+
+# Standard packages
+import importlib
+
+BASH_COMPLETION = """
+_ctb() {
+    local IFS=$'\\n'
+    COMPREPLY=( $(compgen -W "$(ctb __complete "$COMP_CWORD" "${COMP_WORDS[@]:1}" 2>/dev/null)" -- "${COMP_WORDS[COMP_CWORD]}") )
+}
+complete -F _ctb ctb
+"""
+
+
+class UsageError(Exception):
+    """Raised when the command line does not match the schema of a command."""
+
+
+class Argument(object):
+    """A positional argument.
+
+    choices is a tuple of allowed values or a function that returns them. An
+    argument with many=True takes all remaining values, as a list."""
+
+    def __init__(self, name, choices=None, default=None, required=False, many=False):
+        self.name = name
+        self.choices = choices
+        self.default = default
+        self.required = required
+        self.many = many
+
+    def allowed(self):
+        if callable(self.choices):
+            return self.choices()
+        return self.choices
+
+
+class Flag(object):
+    """A boolean option, e.g. Flag("quiet", "-q", "--quiet")."""
+
+    def __init__(self, name, *options):
+        self.name = name
+        self.options = options
+
+
+class Command(object):
+    """A command, its arguments and flags, and the handler that runs it.
+
+    The handler receives the module of the command and the parsed values."""
+
+    def __init__(self, name, module, handler, arguments=(), flags=()):
+        self.name = name
+        self.module = module
+        self.handler = handler
+        self.arguments = tuple(arguments)
+        self.flags = tuple(flags)
+
+    def parse(self, argv):
+        """Return the values of the arguments and flags, keyed by name."""
+        values = { flag.name: False for flag in self.flags }
+        positional = []
+        for arg in argv:
+            if arg.startswith("-"):
+                flag = next(( flag for flag in self.flags if arg in flag.options ), None)
+                if flag is None:
+                    raise UsageError("Unknown option for '{}': {}".format(self.name, arg))
+                values[flag.name] = True
+            else:
+                positional.append(arg)
+        for argument in self.arguments:
+            if argument.many:
+                taken, positional = positional, []
+            elif positional:
+                taken, positional = positional[:1], positional[1:]
+            else:
+                taken = []
+            if not taken and argument.required:
+                raise UsageError("Missing argument for '{}': {}".format(self.name, argument.name.upper()))
+            allowed = argument.allowed() if taken and argument.choices else None
+            for value in taken:
+                if allowed is not None and value not in allowed:
+                    raise UsageError("Invalid {} for '{}': {} (choose from: {})".format(argument.name, self.name, value, ", ".join(allowed)))
+            if argument.many:
+                values[argument.name] = taken
+            else:
+                values[argument.name] = taken[0] if taken else argument.default
+        if positional:
+            raise UsageError("Unexpected arguments for '{}': {}".format(self.name, " ".join(positional)))
+        return values
+
+    def run(self, values):
+        """Import the module of the command and run its handler."""
+        return self.handler(importlib.import_module(self.module), values)
+
+
+def complete(commands, words, index):
+    """Return the completions of the word at the given index of a command
+    line, where words[0] is the first word after the program name."""
+    by_name = { command.name: command for command in commands }
+    if index <= 1:
+        return sorted(by_name.keys())
+    command = by_name.get(words[0])
+    if command is None:
+        return []
+    current = words[index - 1] if index - 1 < len(words) else ""
+    if current.startswith("-"):
+        return sorted(option for flag in command.flags for option in flag.options)
+    # Find the argument at the position of the word being completed.
+    position = len([ word for word in words[1:index - 1] if not word.startswith("-") ])
+    for argument in command.arguments:
+        if argument.many or position == 0:
+            return sorted(argument.allowed() or []) if argument.choices else []
+        position -= 1
+    return []
@@ -8,11 +8,9 @@ Destroy ESS deployment and/or GKE cluster.
 import os
 import sys
 
-# Third-party packages
-import requests
-
 # Proprietary packages
-import ctb.constants as constants
+import ctb.cache as cache
+import ctb.http as http
 import ctb.utils as utils
 import ctb.validate as validate
 from ctb.utils import cmd, env
@@ -62,16 +60,12 @@ def run_destroy_ess():
     validate_destroy_ess()
     print("")
     print("Removing ESS deployment...")
-    response = requests.post(
-        url="https://api.elastic-cloud.com/api/v1/deployments/{}/_shutdown".format(env("ELASTIC_CLOUD_DEPLOYMENT_ID")),
-        headers=constants.ess_api_headers(env("ELASTIC_CLOUD_API_KEY")),
-        timeout=30
-    )
+    response = http.ess(env("ELASTIC_CLOUD_API_KEY")).post("/deployments/{}/_shutdown".format(env("ELASTIC_CLOUD_DEPLOYMENT_ID")))
+    cache.invalidate()
     if response.json().get("orphaned"):
         print("")
         print("Updating .env file...")
-        os.environ["ELASTIC_CLOUD_DEPLOYMENT_ID"] = "{}-deleted".format(env("ELASTIC_CLOUD_DEPLOYMENT_ID"))
-        utils.update_envfile()
+        utils.setenv("ELASTIC_CLOUD_DEPLOYMENT_ID", "{}-deleted".format(env("ELASTIC_CLOUD_DEPLOYMENT_ID")))
     else:
         print(response.content)
 
@@ -85,6 +79,7 @@ def run_destroy_gke():
     --region "$GCP_REGION_NAME" \
     --quiet
     """)
+    cache.invalidate()
 
 def run(ess=True, gke=True):
     if ess:
@@ -1,7 +1,12 @@
 #!/usr/bin/python
 # coding: utf-8
 
+# Standard packages
+import sys
+
 # Proprietary packages
+import ctb.deploy as deploy
+import ctb.manifests as manifests
 from ctb.utils import cmd, env
 
 def run(scenario_from, scenario_to="stable"):
@@ -9,6 +14,19 @@ def run(scenario_from, scenario_to="stable"):
     if scenario_to == "stable":
         scenario_to = scenario_from
         scenario_from = "stable"
+    scenarios = manifests.index().scenarios()
+    for scenario in ( scenario_from, scenario_to ):
+        if scenario not in scenarios:
+            print("Unknown scenario: {}".format(scenario))
+            sys.exit(1)
+
+    # The objects that 'ctb start' would apply to go from one scenario to the
+    # other, by the same comparison.
+    changed = deploy.changes(deploy.hashes(deploy.objects(scenario_to)), deploy.hashes(deploy.objects(scenario_from)))
+    print("Objects that differ: {}".format(len(changed)))
+    for name in changed:
+        print("  - {}".format(name))
+    print("")
 
     cmd("""
     git diff -w --diff-filter=M --no-index -- "{dir}/hipstershop/scenarios/{a}" "{dir}/hipstershop/scenarios/{b}"
@@ -0,0 +1,75 @@
+#!/usr/bin/python
+# coding: utf-8
+"""
+Build and push the images of every scenario ahead of the event.
+"""
+
+# Standard packages
+import sys
+import time
+
+# Proprietary packages
+import ctb.builds as builds
+import ctb.utils as utils
+from ctb.utils import env
+
+
+def build_artifact(task):
+    """Build and push one artifact, and return its timing.
+    Can be executed concurrently with utils.parallel_tasks()."""
+    scenario, artifact, digest = task
+    start = time.time()
+    try:
+        tag = builds.skaffold_build(scenario, [ artifact["image"] ], stdout=False).get(artifact["image"])
+        if tag:
+            builds.record(artifact["image"], digest, tag)
+            print("...built: {} ({})".format(artifact["image"], scenario))
+        else:
+            print("...failure: {} ({})".format(artifact["image"], scenario))
+    except Exception as e:
+        tag = None
+        print("...failure: {} ({}): {}".format(artifact["image"], scenario, e))
+    return scenario, artifact["image"], tag, time.time() - start
+
+def run(scenarios=None):
+    profiles = builds.profiles()
+    scenarios = scenarios or sorted(profiles.keys())
+    for scenario in scenarios:
+        if scenario not in profiles:
+            print("Unknown scenario: {}".format(scenario))
+            sys.exit(1)
+
+    # Identical artifacts are shared by many scenarios (e.g. the "stable"
+    # loadgenerator), so build each (image, content) pair only once.
+    print("")
+    print("Hashing build contexts...")
+    tasks = []
+    seen = set()
+    cached = 0
+    for scenario in scenarios:
+        for artifact in builds.artifacts(scenario):
+            digest = builds.context_hash(artifact)
+            if ( artifact["image"], digest ) in seen:
+                continue
+            seen.add(( artifact["image"], digest ))
+            if builds.lookup(artifact, digest):
+                cached += 1
+                continue
+            tasks.append(( scenario, artifact, digest ))
+    print("...{} unique artifacts, {} already pushed, {} to build.".format(len(seen), cached, len(tasks)))
+
+    if tasks:
+        print("")
+        print("Building images...")
+        start = time.time()
+        results = utils.parallel_tasks(build_artifact, tasks, max_workers=int(env("CTB_BUILD_CONCURRENCY") or 4))
+        print("")
+        print("Build times:")
+        for scenario, image, tag, duration in sorted(results, key=lambda result: -result[3]):
+            print("  {:>7.1f}s  {} ({}){}".format(duration, image, scenario, "" if tag else "  FAILED"))
+        print("  {:>7.1f}s  total".format(time.time() - start))
+        if not all(result[2] for result in results):
+            sys.exit(1)
+
+    print("")
+    print("Done.")
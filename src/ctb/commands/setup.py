@@ -5,11 +5,11 @@ Setup the ESS deployment and/or GKE cluster and microservices.
 """
 
 # Standard packages
+import concurrent.futures
 import hashlib
 import json
 import os
 import sys
-import time
 import traceback
 
 # Third-party packages
@@ -17,13 +17,24 @@ import requests
 
 # Proprietary packages
 import ctb.alerts as alerts
+import ctb.cache as cache
+import ctb.ess as ess
+import ctb.commands.endpoints
 import ctb.commands.start
-import ctb.constants as constants
+import ctb.http as http
+import ctb.k8s as k8s
 import ctb.probe as probe
+import ctb.scheduler as scheduler
+import ctb.templates as templates
 import ctb.utils as utils
+import ctb.wait as wait
 from ctb.utils import cmd, env
 
 
+class SetupError(Exception):
+    """Raised when a setup stage fails."""
+
+
 ####  Validation  ##############################################################
 
 def validate_setup():
@@ -68,8 +79,31 @@ def validate_setup_ess():
             print("")
             sys.exit(1)
 
+####  Readiness  ###############################################################
+
+def wait_for(*conditions):
+    """Wait for readiness conditions, or fail the stage if they are not ready
+    in time."""
+    try:
+        return wait.until(*conditions)
+    except wait.Timeout as e:
+        raise SetupError(e)
+
+def get_es_ads_ip():
+    """Return the external IP of the Elasticsearch ads cluster, once assigned."""
+    service = k8s.get("Service", "elasticsearch-es-http", "default")
+    return service.ingress_ip() if service else None
+
+def get_ess_endpoints():
+    """Return the URLs of every ESS deployment component, once all are assigned."""
+    ess.deployment.invalidate()
+    deployment = ess.deployment()
+    return deployment.endpoints() if deployment else None
+
+
+####  Execution  ###############################################################
+
 def run_setup_gke(dev=False):
-    validate_setup_gke()
     print("")
     print("Creating GKE cluster...")
     cmd("""
@@ -101,22 +135,10 @@ def run_setup_gke(dev=False):
     # Verify that the GKE cluster was created
     print("")
     print("Waiting for GKE cluster to be available...")
-    sys.stdout.write("...")
-    sys.stdout.flush()
-    verified = False
-    ready = False
-    while not verified:
-        if probe.status_gke():
-            sys.stdout.write("ready.\n")
-            sys.stdout.flush()
-            ready = True
-            verified = True
-        else:
-            time.sleep(4)
-            sys.stdout.write(".")
-            sys.stdout.flush()
-    if not ready:
-        sys.exit(1)
+    wait_for(wait.Condition("gke", probe.status_gke, timeout=1200))
+
+    # gcloud switched the kubeconfig to the new cluster.
+    k8s.reset()
 
     # Install ECK
     print("")
@@ -131,84 +153,28 @@ def run_setup_gke(dev=False):
     # Wait for Elasticsearch to be available...
     print("")
     print("Waiting for Elasticsearch ads cluster external IP...")
-    sys.stdout.write("...")
-    sys.stdout.flush()
-    ready = False
-    es_ads_ip = ""
-    while not ready:
-        exitcode, out, err = cmd("kubectl get service elasticsearch-es-http -o json", stdout=False)
-        if (err):
-            # This error message is expected and will appear until the service is ready.
-            if "NotFound" in err:
-                time.sleep(4)
-                sys.stdout.write(".")
-                sys.stdout.flush()
-                continue
-            raise Exception(err)
-        try:
-            response = json.loads(out)
-        except ValueError:
-            time.sleep(4)
-            sys.stdout.write(".")
-            sys.stdout.flush()
-            continue
-        ingress = response.get("status", {}).get("loadBalancer", {}).get("ingress", [{}])
-        ip = ingress[0].get("ip") if ingress else None
-        if not ip:
-            time.sleep(4)
-            sys.stdout.write(".")
-            sys.stdout.flush()
-        else:
-            es_ads_ip = ip
-            sys.stdout.write("ready: {}\n".format(es_ads_ip))
-            sys.stdout.flush()
-            ready = True
+    es_ads_ip = wait_for(wait.Condition("ip", get_es_ads_ip, timeout=600))["ip"]
     print("")
     print("Waiting for Elasticsearch ads cluster to be available in ~3 minutes...")
-    sys.stdout.write("...")
-    sys.stdout.flush()
     es_ads_url = "http://{}:9200".format(es_ads_ip)
-    ready = False
-    while not ready:
-        try:
-            response = requests.get(
-                url="{}/_cat/health".format(es_ads_url),
-                auth=("advertservice", "advertservice"),
-                timeout=30
-            )
-            if "green 3" in response.content:
-                print("ready.")
-                ready = True
-            else:
-                time.sleep(4)
-                sys.stdout.write(".")
-                sys.stdout.flush()
-        except Exception as e:
-            time.sleep(4)
-            sys.stdout.write(".")
-            sys.stdout.flush()
+    es_ads = http.client(es_ads_url, auth=("advertservice", "advertservice"))
+    wait_for(wait.Condition("health", lambda: "green 3" in es_ads.get("/_cat/health").text, timeout=900))
 
     # Ensure ad data is indexed in Elasticsearch
     print("")
     print("Checking if data exists in Elasticsearch ads cluster...")
-    response = requests.get(
-        url="{}/ads/_search".format(es_ads_url),
-        auth=("advertservice", "advertservice"),
-        timeout=30
-    )
+    response = es_ads.get("/ads/_search")
     if response.json().get("hits", {}).get("total", {}).get("value") != 7:
         # Load ad data into Elasticsearch
         print("...ad data does not exist.")
         print("")
         print("Indexing ad data...")
         payload = utils.load_file(os.path.join(env("BASEDIR"), "elasticsearch", "bulk-ads.ndjson"))
-        response = requests.post(
-            url="{}/_bulk".format(es_ads_url),
+        response = es_ads.post(
+            "/_bulk",
             params={ "refresh": "true" },
-            auth=("advertservice", "advertservice"),
             headers={ "Content-Type": "application/json" },
-            data=payload,
-            timeout=30
+            data=payload
         )
         if response.json().get("errors") is False:
             print("...success.")
@@ -221,17 +187,16 @@ def run_setup_gke(dev=False):
     else:
         print("...exists.")
 
-    # Start the stable scenario
     print("")
-    print("Deploying the stable scenario on GKE.")
-    ctb.commands.start.run("stable", quiet=True)
+    print("Finished setting up GKE.")
 
+def run_setup_stable():
     print("")
-    print("Finished setting up GKE.")
+    print("Deploying the stable scenario on GKE.")
+    ctb.commands.start.run("stable", quiet=True)
 
 
 def run_setup_ess(dev=False):
-    validate_setup_ess()
 
     # Check if deployment in .env file exists on ESS
     deployment_exists = False
@@ -250,56 +215,33 @@ def run_setup_ess(dev=False):
     if not deployment_exists:
         print("")
         print("Creating ESS deployment...")
-        filepath = os.path.join(env("BASEDIR"), "elasticsearch", "ess_template_create_deployment{}.json".format("_dev" if dev else ""))
-        deployment_template = utils.load_template_json(filepath)
-        response = requests.post(
-            url="https://api.elastic-cloud.com/api/v1/deployments",
-            headers=constants.ess_api_headers(),
-            json=deployment_template,
-            timeout=30
-        )
+        deployment_template = templates.render_json("ess_template_create_deployment{}.json".format("_dev" if dev else ""), os.environ)
+        response = http.ess().post("/deployments", json=deployment_template)
 
         # Get deployment info
         if response.json().get("created") is True:
             print("...created: 'ctb-{}' [id={}]".format(env("DEPLOYMENT_NAME"), response.json().get("id")))
-
-            # Get deployment info and update .env file
-            os.environ["ELASTIC_CLOUD_DEPLOYMENT_ID"] = response.json().get("id")
-            for resource in response.json().get("resources"):
-                if resource.get("kind") == "elasticsearch":
-                    os.environ["ELASTIC_CLOUD_ID"] = resource.get("cloud_id")
-                    os.environ["ELASTICSEARCH_USERNAME"] = resource.get("credentials").get("username")
-                    os.environ["ELASTICSEARCH_PASSWORD"] = resource.get("credentials").get("password")
-                if resource.get("kind") == "apm":
-                    os.environ["ELASTIC_APM_SECRET_TOKEN"] = resource.get("secret_token")
-            utils.update_envfile()
-
-            # Get endpoints and update .env file
-            for component in ( "elasticsearch", "kibana", "apm" ):
+            cache.invalidate()
+
+            # Get deployment info and endpoints, and update the .env file once
+            with utils.envfile_transaction():
+                utils.setenv("ELASTIC_CLOUD_DEPLOYMENT_ID", response.json().get("id"))
+                for resource in response.json().get("resources"):
+                    if resource.get("kind") == "elasticsearch":
+                        utils.setenv("ELASTIC_CLOUD_ID", resource.get("cloud_id"))
+                        utils.setenv("ELASTICSEARCH_USERNAME", resource.get("credentials").get("username"))
+                        utils.setenv("ELASTICSEARCH_PASSWORD", resource.get("credentials").get("password"))
+                    if resource.get("kind") == "apm":
+                        utils.setenv("ELASTIC_APM_SECRET_TOKEN", resource.get("secret_token"))
                 print("")
-                print("Finding endpoint for {}...".format(component))
-                found = False
-                while not found:
-                    response = requests.get(
-                        url="https://api.elastic-cloud.com/api/v1/deployments/{}/{}/main-{}".format(env("ELASTIC_CLOUD_DEPLOYMENT_ID"), component, component),
-                        headers=constants.ess_api_headers(),
-                        timeout=30
-                    )
-                    url = response.json().get("info", {}).get("metadata", {}).get("service_url")
-                    if url:
-                        if component == "elasticsearch":
-                            if not url[-1].isdigit():
-                                url = url + ":443"
-                            os.environ["ELASTICSEARCH_URL"] = url
-                        elif component == "kibana":
-                            os.environ["KIBANA_URL"] = url
-                        elif component == "apm":
-                            os.environ["ELASTIC_APM_SERVER_URL"] = url
-                        print("...found: {}".format(url))
-                        utils.update_envfile()
-                        found = True
-                    else:
-                        time.sleep(1)
+                print("Finding endpoints for elasticsearch, kibana, and apm...")
+                endpoints = wait_for(wait.Condition("endpoints", get_ess_endpoints, timeout=300))["endpoints"]
+                url = endpoints["elasticsearch"]
+                if not url[-1].isdigit():
+                    url = url + ":443"
+                utils.setenv("ELASTICSEARCH_URL", url)
+                utils.setenv("KIBANA_URL", endpoints["kibana"])
+                utils.setenv("ELASTIC_APM_SERVER_URL", endpoints["apm"])
 
             print("")
             print("Your Elastic deployment will be ready in ~3 minutes.")
@@ -311,26 +253,16 @@ def run_setup_ess(dev=False):
         else:
             print("...failure:")
             print(json.dumps(response.json(), indent=2, sort_keys=True))
-            sys.exit(1)
+            raise SetupError("Failed to create the ESS deployment.")
 
     # Wait for Elasticsearch and Kibana to be available before
     # loading assets into Elasticsearch via Kibana.
-    for component in ( "elasticsearch", "kibana" ):
-        print("")
-        print("Waiting for {} to be available...".format(component))
-        sys.stdout.write("...")
-        sys.stdout.flush()
-        ready = False
-        while not ready:
-            is_available = probe.status_ess_component(component)
-            if is_available:
-                sys.stdout.write("ready.\n")
-                sys.stdout.flush()
-                ready = True
-            else:
-                time.sleep(4)
-                sys.stdout.write(".")
-                sys.stdout.flush()
+    print("")
+    print("Waiting for elasticsearch and kibana to be available...")
+    wait_for(*[
+        wait.Condition(component, lambda component=component: probe.status_ess_component(component), timeout=1200)
+        for component in ( "elasticsearch", "kibana" )
+    ])
 
     # Ensure operator role is indexed in Elasticsearch
     print("")
@@ -339,26 +271,19 @@ def run_setup_ess(dev=False):
         print("...does not exist.")
         print("")
         print("Creating operator role...")
-        payload = utils.load_template_json(os.path.join(env("BASEDIR"), "elasticsearch", "role-operator.json"))
-        response_put = requests.put(
-            url="{}/api/security/role/operator".format(env("KIBANA_URL")),
-            headers=constants.kibana_api_headers(),
-            json=payload,
-            timeout=30
-        )
-        response_get = requests.get(
-            url="{}/api/security/role/operator".format(env("KIBANA_URL")),
-            headers=constants.kibana_api_headers(),
-            timeout=30
-        )
+        payload = templates.render_json("role-operator.json", os.environ)
+        response_put = http.kibana().put("/api/security/role/operator", json=payload)
+        probe.get_ess_operator_role.invalidate()
+        probe.status_ess_operator_role.invalidate()
+        response_get = probe.get_ess_operator_role()
         if response_get.status_code == 200:
             print("...success.")
         else:
             print("...failure.")
             if response_put.status_code in range(400, 499):
-                raise Exception(response_post.content)
+                raise Exception(response_put.content)
             else:
-                print(response_post.content)
+                print(response_put.content)
     else:
         print("...exists.")
 
@@ -369,18 +294,11 @@ def run_setup_ess(dev=False):
         print("...does not exist.")
         print("")
         print("Creating operator user...")
-        payload = utils.load_template_json(os.path.join(env("BASEDIR"), "elasticsearch", "user-operator.json"))
-        response_post = requests.post(
-            url="{}/internal/security/users/operator".format(env("KIBANA_URL")),
-            headers=constants.kibana_api_headers(),
-            json=payload,
-            timeout=30
-        )
-        response_get = requests.get(
-            url="{}/internal/security/users/operator".format(env("KIBANA_URL")),
-            headers=constants.kibana_api_headers(),
-            timeout=30
-        )
+        payload = templates.render_json("user-operator.json", os.environ)
+        response_post = http.kibana().post("/internal/security/users/operator", json=payload)
+        probe.get_ess_operator_user.invalidate()
+        probe.status_ess_operator_user.invalidate()
+        response_get = probe.get_ess_operator_user()
         if response_get.status_code == 200:
             print("...success.")
         else:
@@ -407,17 +325,17 @@ def run_setup_ess(dev=False):
         print("...exists.")
         print("")
         print("Updating Slack connector...")
-    payload = utils.load_template_json(os.path.join(env("BASEDIR"), "elasticsearch", "action-slack.json"))
+    payload = templates.render_json("action-slack.json", os.environ)
     # Kibana does not want these fields when updating an alert
     if update:
         del payload["actionTypeId"]
-    response_post = requests.request(
+    response_post = http.kibana().request(
         method="post" if not update else "put",
-        url="{}/api/actions/action{}".format(env("KIBANA_URL"), "" if not update else "/{}".format(os.environ["SLACK_ACTION_ID"])),
-        headers=constants.kibana_api_headers(),
-        json=payload,
-        timeout=30
+        url="/api/actions/action{}".format("" if not update else "/{}".format(os.environ["SLACK_ACTION_ID"])),
+        json=payload
     )
+    probe.get_ess_slack_connector.invalidate()
+    probe.status_ess_slack_connector.invalidate()
     response_get = probe.get_ess_slack_connector()
     if response_post.status_code in range(200, 299) and response_get.json().get("hits", {}).get("total", {}).get("value") > 0:
         if not update:
@@ -436,17 +354,7 @@ def run_setup_ess(dev=False):
     # Ensure Kibana alerts are indexed in Elasticsearch
     print("")
     print("Checking if Kibana alerts exist in Elasticsearch...")
-    tasks = []
-    num_processes = 0
-    for service_id, service in constants.SERVICES.items():
-        for alert_id in service["alerts"].keys():
-            # TODO: There are duplicate monitors for downtime alerts.
-            # TODO: Wait for throttling to work in synthetics alerts.
-            if alert_id in ( "downtime", "synthetics-failures" ):
-                continue
-            tasks.append(( constants.ALERTS[alert_id], service ))
-            num_processes += 1
-    utils.parallel_tasks(alerts.create_kibana_alert, tasks, num_processes)
+    alerts.reconcile()
 
     # Ensure Watcher alerts are indexed in Elasticsearch
     print("")
@@ -457,44 +365,33 @@ def run_setup_ess(dev=False):
     response_put = None
     while not verified and attempts < max_attempts:
         try:
-            response = requests.get(
-                url="{}/_watcher/watch/no-purchases".format(env("ELASTICSEARCH_URL")),
-                auth=(env("ELASTICSEARCH_USERNAME"), env("ELASTICSEARCH_PASSWORD")),
-                timeout=30
-            )
+            response = http.elasticsearch().get("/_watcher/watch/no-purchases")
+            payload = alerts.render_watcher()
+            digest = alerts.payload_hash(payload)
+            payload["metadata"] = { "ctb_hash": digest }
             update = False
             if response.json().get("found") is False:
                 print("...creating alert: No Purchases")
+            elif response.json().get("watch", {}).get("metadata", {}).get("ctb_hash") == digest:
+                print("...unchanged: No Purchases")
+                verified = True
+                continue
             else:
                 update = True
                 print("...updating alert: No Purchases")
-            os.environ["SERVICE_NAME"] = "frontend"
-            os.environ["SERVICE_NAME_LOWERCASE"] = "frontend"
-            os.environ["ALERT_MESSAGE_HEADER"] = utils.load_template(os.path.join(env("BASEDIR"), "elasticsearch", "alert-message-header.md"))
-            os.environ["ALERT_MESSAGE_FOOTER"] = utils.load_template(os.path.join(env("BASEDIR"), "elasticsearch", "alert-message-footer.md"))
-            os.environ["ALERT_MESSAGE"] = utils.load_template(os.path.join(env("BASEDIR"), "elasticsearch", "watcher-no-purchases-message.md")).replace("\n", "\\n")
-            filename = os.path.join(env("BASEDIR"), "elasticsearch", "watcher-no-purchases.json")
-            payload = utils.load_template_json(filename)
-            response_put = requests.put(
-                url="{}/_watcher/watch/no-purchases".format(env("ELASTICSEARCH_URL")),
+            response_put = http.elasticsearch().put(
+                "/_watcher/watch/no-purchases",
                 params={ "active": "false" },
-                auth=(env("ELASTICSEARCH_USERNAME"), env("ELASTICSEARCH_PASSWORD")),
-                json=payload,
-                timeout=30
+                json=payload
             )
-            response_get = requests.get(
-                url="{}/_watcher/watch/no-purchases".format(env("ELASTICSEARCH_URL")),
-                auth=(env("ELASTICSEARCH_USERNAME"), env("ELASTICSEARCH_PASSWORD")),
-                timeout=30
-            )
-            if response_put.status_code in range(200, 299) and response_get.json().get("found"):
+            if response_put.status_code in range(200, 299) and response_put.json().get("_id") == "no-purchases":
                 if not update:
                     print("......created: No Purchases")
                 else:
                     print("......updated: No Purchases")
                 verified = True
             else:
-                print(response_post.content)
+                print(response_put.content)
         except requests.exceptions.ReadTimeout:
             pass
         except Exception as e:
@@ -502,7 +399,7 @@ def run_setup_ess(dev=False):
             traceback.print_exc()
         finally:
             attempts += 1
-    if attempts >= max_attempts:
+    if not verified:
         print("......failure: No Purchases")
         if response_put and response_put.status_code in range(400, 499):
             print(response_put.content)
@@ -510,9 +407,51 @@ def run_setup_ess(dev=False):
     print("")
     print("Finished setting up ESS.")
 
+def stage(name, function, depends=()):
+    """Return a scheduler task that runs a setup stage, with its output
+    prefixed by its name."""
+    def run_stage(*ready):
+        with utils.output_prefix("[{}] ".format(name)):
+            try:
+                return function()
+            except SystemExit as e:
+                raise SetupError("Exited with status {}.".format(e.code))
+    return scheduler.Task(name, run_stage, depends)
+
 def run(ess=True, gke=True, dev=False):
+    """Provision ESS and GKE in parallel, and deploy the stable scenario once
+    both are ready, since its secrets come from the ESS deployment.
+
+    A failed stage does not interrupt the others: failures are reported once
+    every stage has settled."""
+    if ess:
+        validate_setup_ess()
+    if gke:
+        validate_setup_gke()
+    stages = []
     if ess:
-        run_setup_ess(dev)
+        stages.append(stage("ess", lambda: run_setup_ess(dev)))
     if gke:
-        run_setup_gke(dev)
+        stages.append(stage("gke", lambda: run_setup_gke(dev)))
+        stages.append(stage("stable", run_setup_stable, depends=[ task.name for task in stages ]))
+    futures = scheduler.run(stages, max_workers=len(stages) or 1)
+    concurrent.futures.wait(list(futures.values()))
+    print("")
+    print("Timeline:")
+    for line in scheduler.timeline(stages):
+        print("  {}".format(line))
+    # A stage that depends on a failed stage fails with the same error, which
+    # is reported once, for the stage that raised it.
+    errors = {}
+    for task in stages:
+        error = futures[task.name].exception()
+        if error is not None and all(futures[name].exception() is not error for name in task.depends):
+            errors[task.name] = error
+    if errors:
+        print("")
+        for name, error in errors.items():
+            print("Error: the '{}' stage failed: {}".format(name, error))
+            if not isinstance(error, SetupError):
+                traceback.print_exception(type(error), error, error.__traceback__)
+        sys.exit(1)
     ctb.commands.endpoints.run()
@@ -5,30 +5,27 @@ Deploy updates to the microservices for a given scenario.
 """
 
 # Standard packages
-import json
-import os
+import time
 import uuid
 
-# Third-party packages
-import requests
-
 # Proprietary packages
 import ctb.alerts as alerts
+import ctb.builds as builds
 import ctb.constants as constants
+import ctb.deploy as deploy
+import ctb.k8s as k8s
+import ctb.notify as notify
+import ctb.probe as probe
+import ctb.rollout as rollout
+import ctb.secrets as secrets
+import ctb.trace as trace
 import ctb.utils as utils
 import ctb.validate as validate
-from ctb.utils import cmd, env
 
 def run(scenario="stable", quiet=False):
     # Ensure that this action is done on your cluster and not someone else's.
     validate.kubectl_context()
 
-    # Set the APM service version to a random hash value.
-    # This new version will only apply to the services that have changed since
-    # the prior scenario.
-    os.environ["ELASTIC_APM_SERVICE_VERSION"] = str(uuid.uuid4())[:7]
-    utils.update_envfile()
-
     print("")
     print("Starting the '{}' scenario...".format(scenario))
 
@@ -36,60 +33,77 @@ def run(scenario="stable", quiet=False):
     if scenario == "stable":
         print("")
         print("Disabling alerts...")
-        alerts.toggle_all("disable")
+        with trace.phase("disable-alerts"):
+            alerts.toggle_all("disable")
 
     if scenario == "stable" and not quiet:
         print("")
         print("Sending notification to Slack...")
-        requests.post(
-            url=env("SLACK_WEBHOOK_URL"),
-            json={ "text": "Great work, SREs! We're resolving the issue, and we'll be done in a moment.\n    _— Hipster Shop Dev Team_ :coffee:" },
-            timeout=30
-        )
+        notify.slack("Great work, SREs! We're resolving the issue, and we'll be done in a moment.\n    _— Hipster Shop Dev Team_ :coffee:")
+
+    print("")
+    print("Building images for the '{}' profile...".format(scenario))
+    with trace.phase("build"):
+        artifacts = builds.build(scenario)
+
+    print("")
+    print("Comparing the objects of the '{}' profile with the cluster...".format(scenario))
+    with trace.phase("plan"):
+        changed = deploy.plan(scenario, artifacts)
+
+    # Set the APM service version to a random hash value, when services are
+    # about to change. This new version will only apply to the services that
+    # have changed since the prior scenario. Otherwise the secrets are left
+    # as they are.
+    if changed:
+        utils.setenv("ELASTIC_APM_SERVICE_VERSION", str(uuid.uuid4())[:7])
 
     print("")
-    print("Recreating secrets...")
-    cmd("kubectl delete secret ctb-secrets --namespace=default")
-    cmd("kubectl delete secret ctb-secrets --namespace=kube-system")
-    cmd("kubectl create secret generic ctb-secrets --from-env-file='{}' --namespace=default".format(env("ENVFILE")))
-    cmd("kubectl create secret generic ctb-secrets --from-env-file='{}' --namespace=kube-system".format(env("ENVFILE")))
+    print("Updating secrets...")
+    with trace.phase("update-secrets"):
+        secrets.ensure()
 
+    if changed:
+        print("")
+        print("Deploying the objects of the '{}' profile that changed...".format(scenario))
+        with trace.phase("deploy"):
+            deploy.apply(changed, scenario)
+
+    # Wait until the new pods are serving, so that the scenario clock and the
+    # alerts start when the changes are live.
     print("")
-    print("Running skaffold using the '{}' profile...".format(scenario))
-    cmd("skaffold run --default-repo=gcr.io/$GCP_PROJECT_NAME -l skaffold.dev/run-id=ctb-$DEPLOYMENT_NAME -p {}".format(scenario))
+    print("Waiting for the rollout...")
+    started = time.time()
+    with trace.phase("rollout"):
+        ready = rollout.track(changed)
+    if ready:
+        print("")
+        print("Time to ready:")
+        for line in rollout.table(ready, started):
+            print("  {}".format(line))
 
     # Store the frontend external IP
-    exitcode, out, err = cmd("kubectl get service frontend-external -o json", stdout=False)
-    if err:
-        raise Exception(err)
-    ingress = json.loads(out).get("status", {}).get("loadBalancer", {}).get("ingress", [{}])
-    frontend_ip = ingress[0].get("ip") if ingress else ""
-    os.environ["FRONTEND_URL"] = "http://{}".format(frontend_ip)
-    utils.update_envfile()
+    service = k8s.get("Service", "frontend-external", "default")
+    frontend_ip = (service.ingress_ip() if service else None) or ""
+    utils.setenv("FRONTEND_URL", "http://{}".format(frontend_ip))
+    probe.status_frontend.invalidate()
 
     if scenario != "stable" and not quiet:
         print("")
         print("Sending notification to Slack...")
-        response = requests.post(
-            url=env("SLACK_WEBHOOK_URL"),
-            json={ "text": constants.SLACK_SCENARIO_START_MESSAGE },
-            timeout=30
-        )
+        notify.slack(constants.SLACK_SCENARIO_START_MESSAGE)
 
     # Enable alerts when starting any scenario that is not "stable"
     if scenario != "stable":
         print("")
         print("Enabling alerts...")
-        alerts.toggle_all("enable")
+        with trace.phase("enable-alerts"):
+            alerts.toggle_all("enable")
 
     if scenario == "stable" and not quiet:
         print("")
         print("Sending confirmation message to Slack...")
-        response = requests.post(
-            url=env("SLACK_WEBHOOK_URL"),
-            json={ "text": constants.SLACK_SCENARIO_END_MESSAGE },
-            timeout=30
-        )
+        notify.slack(constants.SLACK_SCENARIO_END_MESSAGE)
 
     print("")
     print("Done.")
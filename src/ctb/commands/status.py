@@ -0,0 +1,137 @@
+#!/usr/bin/python
+# coding: utf-8
+"""
+Show the health of the ESS deployment, the microservices, the frontend, and
+the alerts, once or as a live dashboard.
+"""
+
+# Standard packages
+import sys
+import time
+
+# Third-party packages
+from termcolor import colored
+
+# Proprietary packages
+import ctb.alerts as alerts
+import ctb.commands.validate
+import ctb.ess as ess
+import ctb.monitor as monitor
+import ctb.probe as probe
+from ctb.utils import env
+
+
+####  Sources  #################################################################
+
+def poll_ess():
+    if not env("ELASTIC_CLOUD_DEPLOYMENT_ID") or not env("ELASTIC_CLOUD_API_KEY"):
+        return None
+    deployment = ess.deployment.uncached()
+    if deployment is None:
+        return { "deployment": False }
+    status = { "deployment": deployment.status("elasticsearch") != "stopped" }
+    for component in ess.COMPONENTS:
+        status[component] = deployment.healthy(component)
+    return status
+
+def poll_gke():
+    return ctb.commands.validate.run_validate_microservices()
+
+def poll_frontend():
+    return probe.status_frontend.uncached()
+
+def poll_alerts():
+    if not env("KIBANA_URL"):
+        return None
+    saved_alerts = alerts.inventory()
+    return {
+        "enabled": len([ saved_alert for saved_alert in saved_alerts.values() if saved_alert.get("enabled") ]),
+        "total": len(saved_alerts)
+    }
+
+def sources():
+    return [
+        monitor.Source("ess", poll_ess, min_interval=5, max_interval=60),
+        monitor.Source("gke", poll_gke, min_interval=2, max_interval=30),
+        monitor.Source("frontend", poll_frontend, min_interval=2, max_interval=30),
+        monitor.Source("alerts", poll_alerts, min_interval=10, max_interval=120),
+    ]
+
+
+####  Rendering  ###############################################################
+
+def answer(value):
+    answer, color = "n/a", "yellow"
+    if value:
+        answer, color = "yes", "green"
+    elif value is False:
+        answer, color = "no", "red"
+    return colored(answer, color, attrs=["bold",])
+
+def render(snapshot):
+    """Return the lines of the dashboard."""
+    lines = []
+    value, error = snapshot["ess"]
+    lines.append("ESS deployment:")
+    if error:
+        lines.append("  {}".format(colored("error: {}".format(error), "red")))
+    else:
+        value = value or {}
+        lines.append("  Deployment available: {}".format(answer(value.get("deployment"))))
+        for component, label in ( ("elasticsearch", "Elasticsearch"), ("kibana", "Kibana"), ("apm", "APM server") ):
+            lines.append("  {} available: {}".format(label, answer(value.get(component))))
+    lines.append("")
+    value, error = snapshot["gke"]
+    lines.append("GKE deployment:")
+    if error:
+        lines.append("  {}".format(colored("error: {}".format(error), "red")))
+    else:
+        lines.extend(ctb.commands.validate.microservices_lines(value or {}))
+    lines.append("")
+    value, error = snapshot["frontend"]
+    lines.append("Hipster Shop:")
+    lines.append("  Frontend available: {}".format(answer(False if error else value)))
+    lines.append("")
+    value, error = snapshot["alerts"]
+    lines.append("Alerts:")
+    if error:
+        lines.append("  {}".format(colored("error: {}".format(error), "red")))
+    elif value is None:
+        lines.append("  Enabled: {}".format(answer(None)))
+    else:
+        lines.append("  Enabled: {}".format(colored("{}/{}".format(value["enabled"], value["total"]), "white", attrs=["bold",])))
+    return lines
+
+
+####  Execution  ###############################################################
+
+def run(watch=False):
+    engine = monitor.Engine(sources())
+    if not watch:
+        engine.refresh()
+        engine.stop()
+        print("")
+        print("\n".join(render(engine.snapshot())))
+        print("")
+        return
+
+    engine.start()
+    shown = None
+    try:
+        while True:
+            engine.changed.wait(1)
+            engine.changed.clear()
+            text = "\n".join(render(engine.snapshot()))
+            # Re-render only when something changed.
+            if text != shown:
+                if sys.stdout.isatty():
+                    sys.stdout.write("\033[H\033[2J")
+                print("ctb status ({})".format(time.strftime("%H:%M:%S")))
+                print("")
+                print(text)
+                sys.stdout.flush()
+                shown = text
+    except KeyboardInterrupt:
+        print("")
+    finally:
+        engine.stop()
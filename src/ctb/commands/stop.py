@@ -5,9 +5,9 @@ Remove microservices from GKE cluster.
 """
 
 # Proprietary packages
-import ctb.utils as utils
+import ctb.secrets as secrets
 import ctb.validate as validate
-from ctb.utils import cmd, env
+from ctb.utils import cmd
 
 def run():
     # Ensure that this action is done on your cluster and not someone else's.
@@ -17,11 +17,8 @@ def run():
     print("Removing microservices and monitoring agents from GKE...")
     print("")
 
-    print("Recreating secrets...")
-    cmd("kubectl delete secret ctb-secrets --namespace=default")
-    cmd("kubectl delete secret ctb-secrets --namespace=kube-system")
-    cmd("kubectl create secret generic ctb-secrets --from-env-file='{}' --namespace=default".format(env("ENVFILE")))
-    cmd("kubectl create secret generic ctb-secrets --from-env-file='{}' --namespace=kube-system".format(env("ENVFILE")))
+    print("Updating secrets...")
+    secrets.ensure()
 
     print("")
     print("Running skaffold...")
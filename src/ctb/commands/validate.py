@@ -5,46 +5,59 @@ Validate dependencies, configurations, and deployments.
 """
 
 # Standard packages
+import concurrent.futures
 import os
+import queue
 import re
 import sys
-import yaml
+import threading
+import time
 
 # Third-party packages
 import requests
 from termcolor import colored
 
 # Proprietary packages
-import ctb.constants as constants
-import ctb.patterns as patterns
+import ctb.config as config
+import ctb.deploy as deploy
+import ctb.http as http
+import ctb.k8s as k8s
+import ctb.manifests as manifests
 import ctb.probe as probe
+import ctb.scheduler as scheduler
+import ctb.utils as utils
 from ctb.utils import cmd, env
 
+ENV_FIELDS_REQUIRED = (
+    "DEPLOYMENT_NAME",
+    "ELASTIC_CLOUD_API_KEY",
+    "ELASTIC_CLOUD_REGION",
+    "ELASTICSEARCH_VERSION",
+    "GCP_PROJECT_NAME",
+    "GCP_REGION_NAME",
+    "GCP_NETWORK_NAME",
+    "GCP_SUBNETWORK_NAME",
+    "GCP_SERVICE_ACCOUNT_NAME",
+    "SLACK_WEBHOOK_URL"
+)
+
 def run_validate_slack_webhook_url_valid():
     if not env("SLACK_WEBHOOK_URL"):
         return None
-    response = requests.get(url=env("SLACK_WEBHOOK_URL"), timeout=30)
+    response = http.client().get(env("SLACK_WEBHOOK_URL"))
     return response.status_code == 400
 
 def run_validate_ess_api_key_valid():
     if not env("ELASTIC_CLOUD_API_KEY"):
         return None
-    response = requests.get(
-        url="https://api.elastic-cloud.com/api/v1/deployments",
-        headers=constants.ess_api_headers(env("ELASTIC_CLOUD_API_KEY")),
-        timeout=30
-    )
+    response = http.ess(env("ELASTIC_CLOUD_API_KEY")).get("/deployments")
     return response.status_code in range(200, 299)
 
 def run_validate_env_field_set(field, envfile=env("ENVFILE")):
-    with open(env("ENVFILE"), "r") as file:
-        for line in file:
-            matches = re.findall(patterns.ENV_VAR, line)
-            if len(matches) > 0:
-                variable, value = matches[0]
-                if variable == field and value != "":
-                    return True
-    return False
+    try:
+        return config.envfile(envfile).is_set(field)
+    except IOError:
+        return False
 
 def run_validate_env_exists(envfile=env("ENVFILE")):
     try:
@@ -118,13 +131,170 @@ def run_validate_docker_installed():
     except:
         return False
 
-def run():
+def run_validate_kubectl_context():
+    """Return the current and the required kubectl contexts."""
+    try:
+        current_context = k8s.current_context()
+    except Exception:
+        current_context = ""
+    required_context = "gke_{}_{}_ctb-{}".format(env("GCP_PROJECT_NAME"), env("GCP_REGION_NAME"), env("DEPLOYMENT_NAME"))
+    return current_context, required_context
+
+def run_validate_gke_available():
+    try:
+        return probe.status_gke()
+    except:
+        return False
+
+def expected_services():
+    """Return the names of the deployments and daemonsets from the "stable"
+    scenario."""
+    return sorted(set(
+        obj["name"] for obj in manifests.index().objects(scenario="stable")
+        if obj["name"] and obj["kind"] in ( "Deployment", "DaemonSet" )
+    ))
+
+def run_validate_microservices():
+    """Return the desired and ready replicas of the deployments and daemonsets
+    from the "stable" scenario.
+
+    If the cluster can't be queried, the replicas of every microservice are
+    unknown (None), and the error is returned with them."""
+    services = { name: { "desired": 0, "ready": 0 } for name in expected_services() }
+    selector = deploy.run_id_selector()
+    kinds = ( "Deployment", "DaemonSet" )
+    try:
+        for objects in utils.parallel_tasks(lambda kind: k8s.objects(kind, label_selector=selector), kinds):
+            for obj in objects:
+                if obj.name in services:
+                    services[obj.name]["desired"] = obj.desired
+                    services[obj.name]["ready"] = obj.ready
+    except (k8s.ApiError, requests.exceptions.RequestException) as e:
+        return { name: { "desired": None, "ready": None, "error": str(e) } for name in services }
+    return services
+
+def print_microservices(services):
+    """Print the statuses of the microservices."""
+    print("\n".join(microservices_lines(services)))
+
+def microservices_lines(services):
+    """Return the lines of the statuses of the microservices."""
+    lines = [ "  Microservices status:" ]
+    for error in sorted(set(service["error"] for service in services.values() if service.get("error"))):
+        lines.append("  {}".format(colored("error: {}".format(error), "red")))
+    for name in sorted(services.keys()):
+        desired = services[name]["desired"]
+        ready = services[name]["ready"]
+        if desired is None or ready is None:
+            lines.append("  - {} {}".format(name, colored("n/a", "yellow", attrs=["bold",])))
+            continue
+        color = "white"
+        if desired != ready and ready == 0:
+            color = "red"
+        elif desired != ready:
+            color = "yellow"
+        elif desired == ready and ready == 0:
+            color = "yellow"
+        elif desired == ready:
+            color = "green"
+        lines.append("  - {} {}".format(name, colored("{}/{}".format(ready, desired), color, attrs=["bold",])))
+    return lines
+
+def watch_microservices():
+    """Print the statuses of the microservices whenever they change, until
+    interrupted."""
+    services = { name: { "desired": 0, "ready": 0 } for name in expected_services() }
+    selector = deploy.run_id_selector()
+    changes = queue.Queue()
+
+    def handle(event, obj):
+        if obj.name in services:
+            changes.put(( obj.name, (0, 0) if event == "DELETED" else (obj.desired, obj.ready) ))
+
+    def follow(kind):
+        # Errors that the watch does not retry (e.g. 403) end the dashboard,
+        # rather than leave it stale.
+        try:
+            k8s.follow(kind, handle, label_selector=selector)
+        except Exception as e:
+            changes.put(( None, e ))
+
+    for kind in ( "Deployment", "DaemonSet" ):
+        threading.Thread(target=follow, args=( kind, ), daemon=True).start()
+    dirty = True
+    try:
+        while True:
+            try:
+                name, change = changes.get(timeout=0.5)
+                if name is None:
+                    print("")
+                    print("Error: {}".format(change))
+                    sys.exit(1)
+                desired, ready = change
+                if ( services[name]["desired"], services[name]["ready"] ) != ( desired, ready ):
+                    services[name] = { "desired": desired, "ready": ready }
+                    dirty = True
+                continue
+            except queue.Empty:
+                pass
+            # Render once the burst of changes is drained.
+            if dirty:
+                if sys.stdout.isatty():
+                    sys.stdout.write("\033[H\033[2J")
+                print("GKE deployment ({}):".format(time.strftime("%H:%M:%S")))
+                print_microservices(services)
+                sys.stdout.flush()
+                dirty = False
+    except KeyboardInterrupt:
+        print("")
+
+def checks():
+    """Declare every validation as a task of the check graph."""
+    Task = scheduler.Task
+    def ess_component(component):
+        return lambda status_ess: probe.status_ess_component(component) if status_ess else None
+    def ess_asset(probe_function):
+        return lambda elasticsearch, kibana: probe_function() if elasticsearch and kibana else None
+    def when_gke(function):
+        return lambda status_gke: function() if status_gke else None
+    tasks = [
+        Task("docker-installed", run_validate_docker_installed),
+        Task("docker-running", run_validate_docker_running),
+        Task("kubectl-installed", run_validate_kubectl_installed),
+        Task("kubectl-context", run_validate_kubectl_context),
+        Task("gcloud-installed", run_validate_gcloud_installed),
+        Task("skaffold-installed", run_validate_skaffold_installed),
+        Task("env-exists", lambda: run_validate_env_exists(env("ENVFILE"))),
+        Task("ess-api-key", run_validate_ess_api_key_valid),
+        Task("slack-webhook-url", run_validate_slack_webhook_url_valid),
+        Task("ess", probe.status_ess),
+        Task("ess-elasticsearch", ess_component("elasticsearch"), depends=( "ess", )),
+        Task("ess-kibana", ess_component("kibana"), depends=( "ess", )),
+        Task("ess-apm", ess_component("apm"), depends=( "ess", )),
+        Task("ess-operator-role", ess_asset(probe.status_ess_operator_role), depends=( "ess-elasticsearch", "ess-kibana" )),
+        Task("ess-operator-user", ess_asset(probe.status_ess_operator_user), depends=( "ess-elasticsearch", "ess-kibana" )),
+        Task("ess-slack-connector", ess_asset(probe.status_ess_slack_connector), depends=( "ess-elasticsearch", "ess-kibana" )),
+        Task("gke", run_validate_gke_available),
+        Task("gke-microservices", when_gke(run_validate_microservices), depends=( "gke", )),
+        Task("frontend", when_gke(probe.status_frontend), depends=( "gke", ))
+    ]
+    for field in ENV_FIELDS_REQUIRED:
+        tasks.append(Task("env-{}".format(field), lambda field=field: run_validate_env_field_set(field, env("ENVFILE"))))
+    return tasks
+
+def run(watch=False):
+
+    if watch:
+        watch_microservices()
+        return
 
     def report(message, validation, *validation_args, **validation_kwargs):
         sys.stdout.write("  {}: ".format(message))
         sys.stdout.flush()
         is_valid = validation
-        if callable(validation):
+        if isinstance(validation, concurrent.futures.Future):
+            is_valid = validation.result()
+        elif callable(validation):
             is_valid = validation(*validation_args, **validation_kwargs)
         answer, color = "n/a", "yellow"
         if is_valid:
@@ -135,18 +305,17 @@ def run():
         sys.stdout.write("\n")
         sys.stdout.flush()
 
+    # Run all checks concurrently, and report them in a stable order.
+    results = scheduler.run(checks(), max_workers=int(env("CTB_VALIDATE_WORKERS") or 8))
+
     print("")
     print("Dependencies:")
-    report("docker installed", run_validate_docker_installed)
-    report("docker running", run_validate_docker_running)
-    report("kubectl installed", run_validate_kubectl_installed)
-    exitcode, out, err = cmd("kubectl config current-context", False)
-    current_context = out.strip()
-    required_context = "gke_{}_{}_ctb-{}".format(env("GCP_PROJECT_NAME"), env("GCP_REGION_NAME"), env("DEPLOYMENT_NAME"))
+    report("docker installed", results["docker-installed"])
+    report("docker running", results["docker-running"])
+    report("kubectl installed", results["kubectl-installed"])
+    current_context, required_context = results["kubectl-context"].result()
     sys.stdout.write("  kubectl context: ")
     sys.stdout.flush()
-    if isinstance(current_context, bytes):
-        current_context = current_context.decode("utf-8")
     if current_context == required_context:
         sys.stdout.write(colored(current_context, "green", attrs=["bold"]))
         sys.stdout.write("\n")
@@ -160,138 +329,39 @@ def run():
         sys.stdout.write(" (expected: {})".format(colored(required_context, "white", attrs=["bold"])))
         sys.stdout.write("\n")
         sys.stdout.flush()
-    report("gcloud installed", run_validate_gcloud_installed)
-    report("skaffold installed", run_validate_skaffold_installed)
+    report("gcloud installed", results["gcloud-installed"])
+    report("skaffold installed", results["skaffold-installed"])
 
     print("")
     print(".env configuration:")
-    report(".env file exists", run_validate_env_exists, env("ENVFILE"))
-    env_fields_required = (
-        "DEPLOYMENT_NAME",
-        "ELASTIC_CLOUD_API_KEY",
-        "ELASTIC_CLOUD_REGION",
-        "ELASTICSEARCH_VERSION",
-        "GCP_PROJECT_NAME",
-        "GCP_REGION_NAME",
-        "GCP_NETWORK_NAME",
-        "GCP_SUBNETWORK_NAME",
-        "GCP_SERVICE_ACCOUNT_NAME",
-        "SLACK_WEBHOOK_URL"
-    )
-    for field in env_fields_required:
-        report("{} set".format(field), run_validate_env_field_set, field, env("ENVFILE"))
+    report(".env file exists", results["env-exists"])
+    for field in ENV_FIELDS_REQUIRED:
+        report("{} set".format(field), results["env-{}".format(field)])
 
     print("")
     print("Deployment configuration:")
-    report("ELASTIC_CLOUD_API_KEY valid", run_validate_ess_api_key_valid)
-    report("SLACK_WEBHOOK_URL valid", run_validate_slack_webhook_url_valid)
+    report("ELASTIC_CLOUD_API_KEY valid", results["ess-api-key"])
+    report("SLACK_WEBHOOK_URL valid", results["slack-webhook-url"])
 
     print("")
     print("ESS deployment:")
-    status_ess = probe.status_ess()
-    report("Deployment available", status_ess)
-    status_ess_elasticsearch = probe.status_ess_component("elasticsearch") if status_ess else None
-    report("Elasticsearch available", status_ess_elasticsearch)
-    status_ess_kibana = probe.status_ess_component("kibana") if status_ess else None
-    report("Kibana available", status_ess_kibana)
-    status_ess_apm = probe.status_ess_component("apm") if status_ess else None
-    report("APM server available", status_ess_apm)
-    status_ess_operator_role = probe.status_ess_operator_role() if status_ess_elasticsearch and status_ess_kibana else None
-    report("Operator role exists", status_ess_operator_role)
-    status_ess_operator_user  = probe.status_ess_operator_user() if status_ess_elasticsearch and status_ess_kibana else None
-    report("Operator user exists", status_ess_operator_user)
-    status_ess_slack_connector = probe.status_ess_slack_connector() if status_ess_elasticsearch and status_ess_kibana else None
-    report("Slack connector exists", status_ess_slack_connector)
+    report("Deployment available", results["ess"])
+    report("Elasticsearch available", results["ess-elasticsearch"])
+    report("Kibana available", results["ess-kibana"])
+    report("APM server available", results["ess-apm"])
+    report("Operator role exists", results["ess-operator-role"])
+    report("Operator user exists", results["ess-operator-user"])
+    report("Slack connector exists", results["ess-slack-connector"])
 
     print("")
     print("GKE deployment:")
-    status_gke = False
-    try:
-        status_gke = probe.status_gke()
-    except:
-        status_gke = False
-    report("Cluster available", status_gke)
-    if status_gke:
-        print("  Microservices status:")
-        services = {}
-
-        # Find all deployments and daemonsets from the "stable" scenario
-        specs = []
-        k8s_manifests_dir = os.path.join(env("BASEDIR"), "hipstershop", "scenarios", "stable", "kubernetes-manifests")
-        filenames = os.listdir(k8s_manifests_dir)
-        for filename in filenames:
-            filepath = os.path.join(k8s_manifests_dir, filename)
-            if filename.endswith(".yaml") and os.path.isfile(filepath):
-                with open(filepath, "r") as file:
-                  lines = []
-                  for line in file:
-                    line = re.sub(patterns.NEWLINE, "", line)
-                    if line == "---":
-                        if lines:
-                            spec = yaml.load("\n".join(lines), Loader=yaml.FullLoader)
-                            specs.append(spec)
-                        lines = []
-                        continue
-                    if not line:
-                      continue
-                    lines.append(line)
-        for spec in specs:
-            name = spec.get("metadata", {}).get("name")
-            if name and spec.get("kind") in ( "Deployment", "DaemonSet" ):
-                services[name] = {
-                    "desired": 0,
-                    "ready": 0
-                }
-
-        # Get statuses of deployments and daemonsets
-        lines = []
-        exitcode, out, err = cmd("""kubectl get deployments --all-namespaces -o=go-template='{{range .items}}{{.metadata.name}}\t{{.status.replicas}}/{{.status.readyReplicas}}{{printf "\\n"}}{{end}}'""", False)
-        for line in out.split("\n"):
-            if not line:
-                continue
-            try:
-                name, status = line.split("\t")
-                desired, ready = status.split("/")
-                if name in services:
-                    services[name]["desired"] = desired
-                    services[name]["ready"] = ready
-            except:
-                continue
-        exitcode, out, err = cmd("""kubectl get daemonsets --all-namespaces -o=go-template='{{range .items}}{{.metadata.name}}\t{{.status.desiredNumberScheduled}}/{{.status.numberReady}}{{printf "\\n"}}{{end}}'""", False)
-        for line in out.split("\n"):
-            if not line:
-                continue
-            try:
-                name, status = line.split("\t")
-                desired, ready = status.split("/")
-                if name in services:
-                    services[name]["desired"] = desired
-                    services[name]["ready"] = ready
-            except:
-                continue
-
-        # Display statuses
-        names = services.keys()
-        names.sort()
-        for name in names:
-            desired = services[name]["desired"]
-            ready = services[name]["ready"]
-            color = "white"
-            if desired != ready and ready == 0:
-                color = "red"
-            elif desired != ready:
-                color = "yellow"
-            elif desired == ready and ready == 0:
-                color = "yellow"
-            elif desired == ready:
-                color = "green"
-            print("  - {} {}".format(name, colored("{}/{}".format(ready, desired), color, attrs=["bold",])))
+    report("Cluster available", results["gke"])
+    services = results["gke-microservices"].result()
+    if services is not None:
+        print_microservices(services)
 
     print("")
     print("Hipster Shop:")
-    if status_gke:
-        report("Frontend available", probe.status_frontend)
-    else:
-        report("Frontend available", None)
+    report("Frontend available", results["frontend"])
 
     print("")
@@ -0,0 +1,115 @@
+#!/usr/bin/python
+# coding: utf-8
+"""
+In-memory view of the .env file.
+"""
+
+# Standard packages
+import io
+import os
+import re
+import tempfile
+
+# Proprietary packages
+from ctb import patterns
+
+
+class EnvFile(object):
+    """The variables of a .env file, parsed once and indexed by name.
+
+    Lookups and updates are served from memory. Comments, blank lines and the
+    order of variables are preserved when the file is written back."""
+
+    def __init__(self, path):
+        self.path = path
+        self.lines = []
+        self.values = {}
+        self.positions = {}
+        self.changed = False
+        self.load()
+
+    def load(self):
+        """(Re)read the file."""
+        self.lines = []
+        self.values = {}
+        self.positions = {}
+        self.changed = False
+        with io.open(self.path, mode="r", encoding="utf-8", newline="") as file:
+            for line in file:
+                self.lines.append(line)
+                matches = re.findall(patterns.ENV_VAR, re.sub(patterns.NEWLINE, "", line))
+                if len(matches) > 0:
+                    variable, value = matches[0]
+                    self.values[variable] = value
+                    self.positions[variable] = len(self.lines) - 1
+
+    def __contains__(self, variable):
+        return variable in self.values
+
+    def items(self):
+        return self.values.items()
+
+    def get(self, variable, default=None):
+        return self.values.get(variable, default)
+
+    def is_set(self, variable):
+        """Check if a variable is defined with a non-empty value."""
+        return self.values.get(variable, "") != ""
+
+    def set(self, variable, value):
+        """Update a variable, or append it if the file does not define it.
+        Return True if the value changed."""
+        value = "" if value is None else str(value)
+        if self.values.get(variable) == value:
+            return False
+        if variable in self.positions:
+            line = self.lines[self.positions[variable]]
+            newline = line[len(re.sub(patterns.NEWLINE, "", line)):]
+            self.lines[self.positions[variable]] = "{}={}{}".format(variable, value, newline)
+        else:
+            if self.lines and not self.lines[-1].endswith("\n"):
+                self.lines[-1] += "\n"
+            self.lines.append("{}={}\n".format(variable, value))
+            self.positions[variable] = len(self.lines) - 1
+        self.values[variable] = value
+        self.changed = True
+        return True
+
+    def sync(self, environ=os.environ):
+        """Copy the values of the variables defined in the file from the
+        environment. Return True if any value changed."""
+        changed = False
+        for variable in list(self.positions.keys()):
+            changed = self.set(variable, environ.get(variable)) or changed
+        return changed
+
+    def flush(self):
+        """Atomically write the file, if any value changed."""
+        if not self.changed:
+            return False
+        directory = os.path.dirname(os.path.abspath(self.path))
+        fd, tmp = tempfile.mkstemp(prefix=".env.", dir=directory)
+        try:
+            with io.open(fd, mode="w", encoding="utf-8", newline="") as file:
+                file.write("".join(self.lines))
+                file.flush()
+                os.fsync(file.fileno())
+            if os.path.exists(self.path):
+                os.chmod(tmp, os.stat(self.path).st_mode & 0o777)
+            os.replace(tmp, self.path)
+        except BaseException:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+        self.changed = False
+        return True
+
+
+_envfiles = {}
+
+def envfile(path=None):
+    """Return the parsed .env file at the given path, or at $ENVFILE."""
+    path = path or os.environ.get("ENVFILE")
+    if path not in _envfiles:
+        _envfiles[path] = EnvFile(path)
+    return _envfiles[path]
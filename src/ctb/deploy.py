@@ -0,0 +1,113 @@
+#!/usr/bin/python
+# coding: utf-8
+"""
+Differential deployment of scenarios.
+
+The Kubernetes objects of a scenario are rendered with the images of its
+build artifacts, and each carries a hash of its contents in an annotation.
+Only objects whose hash differs from the live object in the cluster are
+applied, with server-side apply through the Kubernetes API, so services that
+a scenario does not touch are not restarted. Since the comparison is made
+against the cluster, it holds for a new cluster and across instructors.
+
+This replaces the kubectl deployer of skaffold run, which applied every
+object of a profile with client-side apply. skaffold still builds the images
+(ctb.builds) and removes the objects of the stable profile (ctb stop), which
+it does by name. Objects that skaffold created are adopted by the ctb field
+manager before they are applied again, so that the fields removed from their
+manifests are removed from the cluster too (see k8s.adopt()).
+"""
+
+# Standard packages
+import copy
+import hashlib
+import json
+
+# Proprietary packages
+from ctb import k8s
+from ctb import manifests
+from ctb.utils import env
+
+RUN_ID_LABEL = "skaffold.dev/run-id"
+HASH_ANNOTATION = "ctb.elastic.co/content-hash"
+
+
+def run_id_selector():
+    """Return the label selector of the objects that ctb deployed."""
+    return "{}=ctb-{}".format(RUN_ID_LABEL, env("DEPLOYMENT_NAME"))
+
+def key(obj):
+    """Return the identity of an object, e.g. "Deployment/default/frontend"."""
+    metadata = obj.get("metadata", {})
+    return "{}/{}/{}".format(obj.get("kind"), metadata.get("namespace", ""), metadata.get("name"))
+
+def object_hash(obj):
+    return hashlib.sha1(json.dumps(obj, sort_keys=True).encode("utf-8")).hexdigest()
+
+def hashes(objects):
+    """Return the content hash of each object, keyed by key()."""
+    return { key(obj): object_hash(obj) for obj in objects }
+
+def objects(scenario):
+    """Return the objects of the manifests that a scenario deploys."""
+    return [ obj["doc"] for obj in manifests.index().profile_objects(scenario) ]
+
+def render(scenario, artifacts_file):
+    """Return the objects of a scenario as they will be deployed: with the
+    images of its build artifacts, the ctb run-id label, their namespace, and
+    their content hash, keyed by key()."""
+    with open(artifacts_file, "r") as file:
+        images = { build["imageName"]: build["tag"] for build in json.load(file).get("builds", []) }
+    rendered = {}
+    for obj in objects(scenario):
+        obj = copy.deepcopy(obj)
+        metadata = obj.setdefault("metadata", {})
+        metadata.setdefault("labels", {})[RUN_ID_LABEL] = "ctb-{}".format(env("DEPLOYMENT_NAME"))
+        if k8s.resource(obj.get("kind"), obj.get("apiVersion"))[2]:
+            metadata.setdefault("namespace", k8s.config().namespace)
+        pod = manifests.pod_spec(obj)
+        for container in (pod.get("containers") or []) + (pod.get("initContainers") or []):
+            if container.get("image") in images:
+                container["image"] = images[container["image"]]
+        metadata.setdefault("annotations", {})[HASH_ANNOTATION] = object_hash(obj)
+        rendered[key(obj)] = obj
+    return rendered
+
+def live_objects(rendered):
+    """Return the live objects that ctb deployed, for the kinds of the
+    rendered objects, keyed by key()."""
+    kinds = sorted({ ( obj.get("kind"), obj.get("apiVersion") ) for obj in rendered.values() })
+    live = {}
+    for kind, api_version in kinds:
+        for obj in k8s.objects(kind, label_selector=run_id_selector(), api_version=api_version):
+            live[key(obj.raw)] = obj
+    return live
+
+def changes(target, current):
+    """Return the keys of the target objects whose hash differs from the
+    current ones. Both are hashes keyed by key()."""
+    return [ name for name, digest in sorted(target.items()) if current.get(name) != digest ]
+
+def plan(scenario, artifacts_file):
+    """Return the rendered objects of a scenario that differ from the live
+    ones."""
+    rendered = render(scenario, artifacts_file)
+    target = { name: obj["metadata"]["annotations"][HASH_ANNOTATION] for name, obj in rendered.items() }
+    live = { name: obj.annotations.get(HASH_ANNOTATION) for name, obj in live_objects(rendered).items() }
+    changed = changes(target, live)
+    print("...unchanged: {} objects".format(len(rendered) - len(changed)))
+    return [ rendered[name] for name in changed ]
+
+def apply(objects, scenario):
+    """Apply the rendered objects of a scenario, from plan(). Objects that
+    client-side apply created are adopted first."""
+    live = live_objects({ key(obj): obj for obj in objects }) if objects else {}
+    for obj in objects:
+        print("...applying: {}".format(key(obj)))
+        try:
+            if key(obj) in live and k8s.adopt(live[key(obj)], obj.get("apiVersion")):
+                print("...adopted from client-side apply: {}".format(key(obj)))
+            k8s.apply(obj)
+        except k8s.ApiError as e:
+            raise Exception("Failed to apply {} for the '{}' scenario: {}".format(key(obj), scenario, e))
+    return objects
@@ -0,0 +1,89 @@
+#!/usr/bin/python
+# coding: utf-8
+"""
+State of an ESS deployment.
+
+A single GET /deployments/{id} with plans and metadata describes every
+resource of the deployment. The Deployment model parses that response once,
+and answers questions about the health, current plan, endpoints, and
+credentials of each component (elasticsearch, kibana, apm).
+"""
+
+# Proprietary packages
+from ctb import http
+from ctb.cache import cached
+from ctb.utils import env
+
+COMPONENTS = ( "elasticsearch", "kibana", "apm" )
+
+
+class Deployment(object):
+    """An ESS deployment, as described by the deployments API."""
+
+    def __init__(self, raw):
+        self.raw = raw
+        self.id = raw.get("id")
+        self.name = raw.get("name")
+
+    def resource(self, component):
+        """Return the main resource of a component, e.g. "main-kibana"."""
+        resources = (self.raw.get("resources") or {}).get(component) or []
+        for resource in resources:
+            if resource.get("ref_id") == "main-{}".format(component):
+                return resource
+        return resources[0] if resources else {}
+
+    def info(self, component):
+        return self.resource(component).get("info") or {}
+
+    def status(self, component="elasticsearch"):
+        """Return the status of a component, e.g. "started" or "stopped"."""
+        return self.info(component).get("status")
+
+    def plan(self, component):
+        """Return the current plan of a component, if any."""
+        return (self.info(component).get("plan_info") or {}).get("current")
+
+    def healthy(self, component):
+        """True once the current plan of a component is applied and healthy."""
+        plan_info = self.info(component).get("plan_info") or {}
+        return bool(plan_info.get("healthy") and plan_info.get("current"))
+
+    def endpoint(self, component):
+        """Return the URL of a component, once assigned."""
+        return (self.info(component).get("metadata") or {}).get("service_url")
+
+    def endpoints(self):
+        """Return the URLs of every component, or None until all are assigned."""
+        urls = { component: self.endpoint(component) for component in COMPONENTS }
+        return urls if all(urls.values()) else None
+
+    def cloud_id(self):
+        return (self.info("elasticsearch").get("metadata") or {}).get("cloud_id")
+
+    def credentials(self):
+        """Return the elastic user credentials. The API returns them only when
+        the deployment is created."""
+        credentials = self.resource("elasticsearch").get("credentials") or {}
+        return credentials.get("username"), credentials.get("password")
+
+
+@cached(ttl=3, scope=( "ELASTIC_CLOUD_DEPLOYMENT_ID", "ELASTIC_CLOUD_API_KEY" ), disk=False)
+def deployment(deployment_id=None):
+    """Return the deployment (by default, the one in the .env file), or None
+    if it does not exist."""
+    deployment_id = deployment_id or env("ELASTIC_CLOUD_DEPLOYMENT_ID")
+    response = http.ess().get("/deployments/{}".format(deployment_id), params={
+        "show_plans": "true",
+        "show_metadata": "true",
+        "show_plan_logs": "false",
+        "show_settings": "false"
+    })
+    if response.status_code in [404, 410]:
+        return None
+    if response.status_code in range(500, 599):
+        # Transient, e.g. while the deployment is being created.
+        response.raise_for_status()
+    if response.status_code in range(400, 499):
+        raise Exception(response)
+    return Deployment(response.json())
@@ -0,0 +1,109 @@
+#!/usr/bin/python
+# coding: utf-8
+"""
+Pooled HTTP clients for the ESS, Kibana, and Elasticsearch APIs.
+
+Each client is a long-lived requests session bound to a base URL, with the
+authentication headers of its API baked in. Sessions are shared per base URL
+and credentials, so repeated calls reuse kept-alive TCP and TLS connections.
+"""
+
+# Standard packages
+import os
+import threading
+import urllib.parse
+
+# Third-party packages
+import requests
+import requests.adapters
+
+# Proprietary packages
+from ctb import constants
+from ctb import patterns
+from ctb import trace
+from ctb.utils import env
+
+ESS_API_URL = "https://api.elastic-cloud.com/api/v1"
+
+# Default timeout of every request, in seconds.
+TIMEOUT = 30
+
+_sessions = {}
+_lock = threading.Lock()
+
+
+def pool_size():
+    """Number of kept-alive connections per host (CTB_HTTP_POOL_SIZE)."""
+    return int(env("CTB_HTTP_POOL_SIZE") or 16)
+
+
+class Session(requests.Session):
+    """A requests session bound to a base URL.
+
+    Relative URLs are resolved against the base URL, and every request
+    defaults to the standard timeout."""
+
+    def __init__(self, base_url="", headers=None, auth=None, size=None):
+        super().__init__()
+        self.base_url = (base_url or "").rstrip("/")
+        if headers:
+            self.headers.update(headers)
+        self.auth = auth
+        size = size or pool_size()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=size, pool_maxsize=size)
+        self.mount("https://", adapter)
+        self.mount("http://", adapter)
+
+    def request(self, method, url, *args, **kwargs):
+        relative = not patterns.ABSOLUTE_URL.match(url)
+        if relative:
+            url = "{}/{}".format(self.base_url, url.lstrip("/"))
+        kwargs.setdefault("timeout", TIMEOUT)
+        if not trace.enabled():
+            return super().request(method, url, *args, **kwargs)
+        # The path of an absolute URL can be a secret (e.g. a Slack webhook),
+        # so only the paths of requests relative to a base URL are traced.
+        parsed = urllib.parse.urlsplit(url)
+        path = parsed.path if relative else "/..."
+        with trace.phase("{} {}".format(method.upper(), parsed.netloc), "http", url="{}://{}{}".format(parsed.scheme, parsed.netloc, path)):
+            return super().request(method, url, *args, **kwargs)
+
+
+def session(base_url="", headers=None, auth=None):
+    """Return the shared session for a base URL and set of credentials."""
+    key = (
+        (base_url or "").rstrip("/"),
+        tuple(sorted((headers or {}).items())),
+        tuple(auth) if auth else None
+    )
+    with _lock:
+        if key not in _sessions:
+            _sessions[key] = Session(base_url, headers, auth)
+        return _sessions[key]
+
+def ess(api_key=None):
+    """Client for the Elastic Cloud (ESS) API."""
+    return session(ESS_API_URL, constants.ess_api_headers(api_key))
+
+def kibana():
+    """Client for the Kibana API of the current deployment."""
+    return session(env("KIBANA_URL"), constants.kibana_api_headers())
+
+def elasticsearch():
+    """Client for the Elasticsearch API of the current deployment."""
+    return session(env("ELASTICSEARCH_URL"), auth=(env("ELASTICSEARCH_USERNAME"), env("ELASTICSEARCH_PASSWORD")))
+
+def client(base_url="", auth=None):
+    """Client for any other endpoint (e.g. Slack, the frontend, the ads cluster)."""
+    return session(base_url, auth=auth)
+
+def close():
+    """Close every pooled connection."""
+    with _lock:
+        for s in _sessions.values():
+            s.close()
+        _sessions.clear()
+
+# Connections must never be shared with forked worker processes.
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_sessions.clear)
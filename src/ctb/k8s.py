@@ -0,0 +1,553 @@
+#!/usr/bin/python
+# coding: utf-8
+"""
+Native client for the Kubernetes API.
+
+The kubeconfig is read once, and requests go straight to the API server of
+its current context over a pooled HTTPS session, so no kubectl process has to
+start for every query. Credentials come from the kubeconfig user: a static
+token, client certificates, an exec plugin (e.g. gke-gcloud-auth-plugin), or
+the legacy gcp auth-provider.
+"""
+
+# Standard packages
+import atexit
+import base64
+import copy
+import datetime
+import json
+import os
+import re
+import shlex
+import subprocess
+import tempfile
+import threading
+import time
+
+# Third-party packages
+import requests
+import requests.auth
+import yaml
+
+# Proprietary packages
+from ctb import http
+
+# Refresh credentials this many seconds before they expire.
+EXPIRY_MARGIN = 60
+
+# Longest delay between attempts to list objects again, in seconds.
+MAX_RETRY_DELAY = 30
+
+# Field managers of client-side apply, i.e. of kubectl apply as skaffold ran
+# it before ctb deployed with server-side apply.
+CLIENT_SIDE_APPLY_MANAGERS = ( "kubectl-client-side-apply", "before-first-apply" )
+
+RESOURCES = {
+    "ClusterRole": ( "rbac.authorization.k8s.io/v1", "clusterroles", False ),
+    "ClusterRoleBinding": ( "rbac.authorization.k8s.io/v1", "clusterrolebindings", False ),
+    "ConfigMap": ( "v1", "configmaps", True ),
+    "DaemonSet": ( "apps/v1", "daemonsets", True ),
+    "Deployment": ( "apps/v1", "deployments", True ),
+    "Namespace": ( "v1", "namespaces", False ),
+    "Pod": ( "v1", "pods", True ),
+    "Secret": ( "v1", "secrets", True ),
+    "Service": ( "v1", "services", True ),
+    "ServiceAccount": ( "v1", "serviceaccounts", True ),
+    "StatefulSet": ( "apps/v1", "statefulsets", True ),
+}
+
+_config = None
+_client = None
+_discovered = {}
+_tempfiles = []
+_lock = threading.RLock()
+
+
+class ApiError(Exception):
+    """Raised when the API server rejects a request."""
+
+    def __init__(self, status, message):
+        super().__init__("{} {}".format(status, message))
+        self.status = status
+        self.message = message
+
+
+####  Configuration  ###########################################################
+
+def kubeconfig_paths():
+    """Return the kubeconfig files, as kubectl finds them."""
+    if os.environ.get("KUBECONFIG"):
+        return [ path for path in os.environ["KUBECONFIG"].split(os.pathsep) if path ]
+    return [ os.path.join(os.path.expanduser("~"), ".kube", "config") ]
+
+def _tempfile(data):
+    """Write base64-encoded kubeconfig data to a private file, for requests."""
+    fd, path = tempfile.mkstemp(prefix="ctb-k8s.")
+    with os.fdopen(fd, "wb") as file:
+        file.write(base64.b64decode(data) if isinstance(data, str) else data)
+    _tempfiles.append(path)
+    return path
+
+@atexit.register
+def _remove_tempfiles():
+    while _tempfiles:
+        try:
+            os.remove(_tempfiles.pop())
+        except OSError:
+            pass
+
+def _parse_time(value):
+    """Return an RFC 3339 timestamp as seconds since the epoch."""
+    try:
+        value = re.sub(r"(\.\d{6})\d+", r"\1", value.strip()).replace("Z", "+00:00")
+        return datetime.datetime.fromisoformat(value).timestamp()
+    except (AttributeError, ValueError):
+        return time.time() + 300
+
+def _jsonpath(document, path):
+    """Resolve a simple kubeconfig JSONPath such as "{.credential.access_token}"."""
+    for key in path.strip("{}").strip(".").split("."):
+        document = (document or {}).get(key)
+    return document
+
+
+class KubeConfig(object):
+    """The cluster and user of the current context of the kubeconfig."""
+
+    def __init__(self, paths=None):
+        self.clusters = {}
+        self.users = {}
+        self.contexts = {}
+        self.current_context = None
+        for path in paths or kubeconfig_paths():
+            if not os.path.isfile(path):
+                continue
+            with open(path, "r") as file:
+                conf = yaml.safe_load(file) or {}
+            # As with kubectl, the first file to define a value wins.
+            self.current_context = self.current_context or conf.get("current-context")
+            for section, entries in ( ("clusters", self.clusters), ("users", self.users), ("contexts", self.contexts) ):
+                for entry in conf.get(section) or []:
+                    entries.setdefault(entry["name"], entry.get(section[:-1]) or {})
+        if not self.current_context:
+            raise Exception("No current context in kubeconfig: {}".format(", ".join(paths or kubeconfig_paths())))
+        context = self.contexts.get(self.current_context, {})
+        self.cluster = self.clusters.get(context.get("cluster"), {})
+        self.user = self.users.get(context.get("user"), {})
+        self.namespace = context.get("namespace") or "default"
+        self.server = self.cluster.get("server", "").rstrip("/")
+        self.token = None
+        self.expiry = None
+        self.cert = None
+
+    def verify(self):
+        """Return the CA bundle to verify the API server with, or False."""
+        if self.cluster.get("insecure-skip-tls-verify"):
+            return False
+        if self.cluster.get("certificate-authority-data"):
+            return _tempfile(self.cluster["certificate-authority-data"])
+        return self.cluster.get("certificate-authority") or True
+
+    def client_cert(self):
+        """Return the client certificate and key files of the user, if any."""
+        cert = self.user.get("client-certificate")
+        key = self.user.get("client-key")
+        if self.user.get("client-certificate-data"):
+            cert = _tempfile(self.user["client-certificate-data"])
+        if self.user.get("client-key-data"):
+            key = _tempfile(self.user["client-key-data"])
+        return ( cert, key ) if cert and key else None
+
+    def credentials(self):
+        """Return a bearer token for the user, refreshing it once it expires."""
+        with _lock:
+            if self.token and (self.expiry is None or self.expiry - EXPIRY_MARGIN > time.time()):
+                return self.token
+            if self.user.get("token"):
+                self.token = self.user["token"]
+            elif self.user.get("tokenFile"):
+                with open(self.user["tokenFile"], "r") as file:
+                    self.token = file.read().strip()
+            elif self.user.get("exec"):
+                self._exec_plugin(self.user["exec"])
+            elif (self.user.get("auth-provider") or {}).get("name") == "gcp":
+                self._gcp_auth_provider(self.user["auth-provider"].get("config") or {})
+            return self.token
+
+    def _exec_plugin(self, plugin):
+        environ = dict(os.environ)
+        for variable in plugin.get("env") or []:
+            environ[variable["name"]] = variable["value"]
+        environ["KUBERNETES_EXEC_INFO"] = json.dumps({
+            "apiVersion": plugin.get("apiVersion", "client.authentication.k8s.io/v1beta1"),
+            "kind": "ExecCredential",
+            "spec": { "interactive": False }
+        })
+        process = subprocess.run([ plugin["command"] ] + (plugin.get("args") or []), env=environ, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        if process.returncode != 0:
+            raise Exception("kubeconfig exec plugin failed: {}".format(process.stderr.decode("utf-8", "replace")))
+        status = json.loads(process.stdout).get("status", {})
+        self.token = status.get("token")
+        self.expiry = _parse_time(status["expirationTimestamp"]) if status.get("expirationTimestamp") else None
+        if status.get("clientCertificateData") and status.get("clientKeyData"):
+            self.cert = ( _tempfile(status["clientCertificateData"].encode("utf-8")), _tempfile(status["clientKeyData"].encode("utf-8")) )
+
+    def _gcp_auth_provider(self, conf):
+        if conf.get("access-token") and conf.get("expiry") and _parse_time(conf["expiry"]) - EXPIRY_MARGIN > time.time():
+            self.token = conf["access-token"]
+            self.expiry = _parse_time(conf["expiry"])
+            return
+        command = [ conf.get("cmd-path", "gcloud") ] + shlex.split(conf.get("cmd-args", "config config-helper --format=json"))
+        process = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        if process.returncode != 0:
+            raise Exception("gcloud credentials failed: {}".format(process.stderr.decode("utf-8", "replace")))
+        output = json.loads(process.stdout)
+        self.token = _jsonpath(output, conf.get("token-key", "{.credential.access_token}"))
+        expiry = _jsonpath(output, conf.get("expiry-key", "{.credential.token_expiry}"))
+        self.expiry = _parse_time(expiry) if expiry else None
+
+
+class BearerAuth(requests.auth.AuthBase):
+    """Attach the current token of the kubeconfig user to every request."""
+
+    def __init__(self, kubeconfig):
+        self.kubeconfig = kubeconfig
+
+    def __call__(self, request):
+        token = self.kubeconfig.credentials()
+        if token:
+            request.headers["Authorization"] = "Bearer {}".format(token)
+        return request
+
+
+def config():
+    """Return the kubeconfig, read once."""
+    global _config
+    with _lock:
+        if _config is None:
+            _config = KubeConfig()
+        return _config
+
+def current_context():
+    """Return the name of the current kubeconfig context."""
+    return config().current_context
+
+def client():
+    """Return the pooled session to the API server of the current context."""
+    global _client
+    with _lock:
+        if _client is None:
+            conf = config()
+            session = http.Session(conf.server)
+            session.verify = conf.verify()
+            conf.credentials()
+            session.cert = conf.cert or conf.client_cert()
+            session.auth = BearerAuth(conf)
+            _client = session
+        return _client
+
+def reset():
+    """Forget the kubeconfig and close the session, e.g. after switching context."""
+    global _config, _client
+    with _lock:
+        if _client is not None:
+            _client.close()
+        _config = None
+        _client = None
+        _discovered.clear()
+
+def _forget_client():
+    global _client
+    _client = None
+
+# Connections must never be shared with forked worker processes.
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_forget_client)
+
+
+####  Objects  #################################################################
+
+class Object(object):
+    """A Kubernetes object, as returned by the API server."""
+
+    def __init__(self, raw):
+        self.raw = raw
+        self.metadata = raw.get("metadata", {})
+        self.spec = raw.get("spec") or {}
+        self.status = raw.get("status") or {}
+
+    @property
+    def kind(self):
+        return self.raw.get("kind")
+
+    @property
+    def name(self):
+        return self.metadata.get("name")
+
+    @property
+    def namespace(self):
+        return self.metadata.get("namespace")
+
+    @property
+    def labels(self):
+        return self.metadata.get("labels") or {}
+
+    @property
+    def annotations(self):
+        return self.metadata.get("annotations") or {}
+
+    def __repr__(self):
+        return "<{} {}/{}>".format(self.kind, self.namespace or "", self.name)
+
+
+class Deployment(Object):
+
+    @property
+    def desired(self):
+        return self.spec.get("replicas", 1)
+
+    @property
+    def ready(self):
+        return self.status.get("readyReplicas", 0)
+
+    def is_available(self):
+        """True once the latest generation is rolled out and all replicas are available.
+
+        As with kubectl rollout status, the rollout is not done while old
+        replicas remain (e.g. during a surge), or while updated replicas are
+        not available yet."""
+        updated = self.status.get("updatedReplicas", 0)
+        return (
+            self.status.get("observedGeneration", 0) >= self.metadata.get("generation", 0)
+            and updated >= self.desired
+            and self.status.get("replicas", 0) <= updated
+            and self.status.get("availableReplicas", 0) >= updated
+        )
+
+
+class DaemonSet(Object):
+
+    @property
+    def desired(self):
+        return self.status.get("desiredNumberScheduled", 0)
+
+    @property
+    def ready(self):
+        return self.status.get("numberReady", 0)
+
+    def is_available(self):
+        """True once the latest generation is rolled out on every scheduled node."""
+        return (
+            self.status.get("observedGeneration", 0) >= self.metadata.get("generation", 0)
+            and self.status.get("updatedNumberScheduled", 0) >= self.desired
+            and self.status.get("numberAvailable", 0) >= self.desired
+        )
+
+
+class Service(Object):
+
+    def ingress_ip(self):
+        """Return the external IP of a LoadBalancer service, once assigned."""
+        ingress = self.status.get("loadBalancer", {}).get("ingress") or [{}]
+        return ingress[0].get("ip")
+
+
+class Secret(Object):
+
+    @property
+    def data(self):
+        return { key: base64.b64decode(value).decode("utf-8") for key, value in (self.raw.get("data") or {}).items() }
+
+
+TYPES = {
+    "Deployment": Deployment,
+    "DaemonSet": DaemonSet,
+    "Service": Service,
+    "Secret": Secret,
+}
+
+def typed(raw, kind=None):
+    """Wrap a raw object in the class of its kind."""
+    kind = raw.get("kind") or kind
+    if kind and not raw.get("kind"):
+        raw = dict(raw, kind=kind)
+    return TYPES.get(kind, Object)(raw)
+
+
+####  Requests  ################################################################
+
+def _check(response):
+    if response.status_code >= 400:
+        try:
+            message = response.json().get("message", response.text)
+        except ValueError:
+            message = response.text
+        raise ApiError(response.status_code, message)
+    return response
+
+def resource(kind, api_version=None):
+    """Return the API version, plural name, and scope of a kind.
+
+    Kinds that are not built in are looked up with the discovery API."""
+    if kind in RESOURCES and (api_version is None or api_version == RESOURCES[kind][0]):
+        return RESOURCES[kind]
+    if api_version is None:
+        raise Exception("Unknown kind without apiVersion: {}".format(kind))
+    with _lock:
+        if api_version not in _discovered:
+            prefix = "api" if "/" not in api_version else "apis"
+            response = _check(client().get("/{}/{}".format(prefix, api_version)))
+            _discovered[api_version] = {
+                entry["kind"]: ( api_version, entry["name"], entry["namespaced"] )
+                for entry in response.json().get("resources", []) if "/" not in entry["name"]
+            }
+    if kind not in _discovered[api_version]:
+        raise Exception("Unknown kind: {} {}".format(api_version, kind))
+    return _discovered[api_version][kind]
+
+def path(kind, namespace=None, name=None, api_version=None):
+    """Return the API path of a kind, optionally within a namespace and for
+    a single object."""
+    api_version, plural, namespaced = resource(kind, api_version)
+    parts = [ "api" if "/" not in api_version else "apis", api_version ]
+    if namespaced and namespace:
+        parts += [ "namespaces", namespace ]
+    parts.append(plural)
+    if name:
+        parts.append(name)
+    return "/" + "/".join(parts)
+
+def query(kind, namespace=None, label_selector=None, field_selector=None, api_version=None):
+    """Return the raw list of objects of a kind, across all namespaces unless
+    one is given."""
+    params = {}
+    if label_selector:
+        params["labelSelector"] = label_selector
+    if field_selector:
+        params["fieldSelector"] = field_selector
+    return _check(client().get(path(kind, namespace, api_version=api_version), params=params)).json()
+
+def objects(kind, namespace=None, label_selector=None, field_selector=None, api_version=None):
+    """Return the typed objects of a kind."""
+    return [ typed(item, kind) for item in query(kind, namespace, label_selector, field_selector, api_version).get("items", []) ]
+
+def get(kind, name, namespace=None):
+    """Return a typed object, or None if it does not exist."""
+    response = client().get(path(kind, namespace or config().namespace, name))
+    if response.status_code == 404:
+        return None
+    return typed(_check(response).json(), kind)
+
+def watch(kind, namespace=None, label_selector=None, resource_version=None, timeout=300):
+    """Yield the (event type, typed object) changes of a kind, starting after
+    the given resource version, until the server ends the watch."""
+    params = { "watch": "1", "timeoutSeconds": str(int(timeout)), "allowWatchBookmarks": "false" }
+    if label_selector:
+        params["labelSelector"] = label_selector
+    if resource_version:
+        params["resourceVersion"] = resource_version
+    response = _check(client().get(path(kind, namespace), params=params, stream=True, timeout=(http.TIMEOUT, timeout + http.TIMEOUT)))
+    try:
+        for line in response.iter_lines():
+            if not line:
+                continue
+            event = json.loads(line)
+            if event.get("type") == "ERROR":
+                status = event.get("object", {})
+                raise ApiError(status.get("code", 500), status.get("message", ""))
+            yield event.get("type"), typed(event.get("object", {}), kind)
+    finally:
+        response.close()
+
+def follow(kind, handle, label_selector=None, done=None, deadline=None):
+    """List the objects of a kind, then watch them, and call handle(event
+    type, typed object) for each one ("ADDED" for listed objects). Stop when
+    done() is true or the deadline (a timestamp) passes.
+
+    When a watch expires (410 Gone) or its connection drops, the objects are
+    listed again, with exponential backoff while that fails, and the watch
+    resumes from the new resource version. Server errors (5xx) and 429 are
+    retried the same way. Other client errors, such as 401, 403 or 404, are
+    raised, since retrying does not fix them."""
+    done = done or (lambda: False)
+    resource_version = None
+    delay = 1
+    while not done() and (deadline is None or time.time() < deadline):
+        try:
+            if resource_version is None:
+                listing = query(kind, label_selector=label_selector)
+                resource_version = listing.get("metadata", {}).get("resourceVersion")
+                delay = 1
+                for item in listing.get("items", []):
+                    handle("ADDED", typed(item, kind))
+                continue
+            remaining = 300 if deadline is None else max(1, min(300, deadline - time.time()))
+            for event, obj in watch(kind, label_selector=label_selector, resource_version=resource_version, timeout=remaining):
+                resource_version = obj.metadata.get("resourceVersion") or resource_version
+                handle(event, obj)
+                if done():
+                    break
+        except (ApiError, requests.exceptions.RequestException, ValueError) as e:
+            if isinstance(e, ApiError) and e.status in range(400, 500) and e.status not in ( 410, 429 ):
+                raise
+            resource_version = None
+            if deadline is not None:
+                delay = min(delay, max(0, deadline - time.time()))
+            time.sleep(delay)
+            delay = min(delay * 2, MAX_RETRY_DELAY)
+
+def apply(obj, field_manager="ctb", force=True):
+    """Create or update an object with server-side apply, and return it."""
+    metadata = obj.get("metadata", {})
+    api_version, plural, namespaced = resource(obj.get("kind"), obj.get("apiVersion"))
+    namespace = (metadata.get("namespace") or config().namespace) if namespaced else None
+    response = client().patch(
+        path(obj.get("kind"), namespace, metadata.get("name"), api_version),
+        params={ "fieldManager": field_manager, "force": "true" if force else "false" },
+        headers={ "Content-Type": "application/apply-patch+yaml" },
+        data=json.dumps(obj)
+    )
+    return typed(_check(response).json())
+
+def _merge_fields(fields, other):
+    """Return the union of two sets of fields, in the FieldsV1 format."""
+    merged = dict(fields)
+    for name, value in other.items():
+        merged[name] = _merge_fields(merged.get(name) or {}, value or {})
+    return merged
+
+def adopt(obj, api_version=None, field_manager="ctb"):
+    """Transfer the fields that client-side apply set on a live object to a
+    server-side apply field manager, and return whether the object changed.
+
+    A server-side apply leaves the fields of the client-side apply manager in
+    place, so the fields removed from a manifest would never be removed from
+    the object. Once the field manager owns them, its next apply removes the
+    fields it no longer sets, including the last-applied-configuration
+    annotation of kubectl."""
+    entries = copy.deepcopy(obj.metadata.get("managedFields") or [])
+    adopted = [ entry for entry in entries if entry.get("manager") in CLIENT_SIDE_APPLY_MANAGERS and not entry.get("subresource") ]
+    if not adopted:
+        return False
+    api_version = resource(obj.kind, api_version)[0]
+    kept = [ entry for entry in entries if entry not in adopted ]
+    owner = next((
+        entry for entry in kept
+        if entry.get("manager") == field_manager and entry.get("operation") == "Apply" and not entry.get("subresource")
+    ), None)
+    if owner is None:
+        owner = { "manager": field_manager, "operation": "Apply", "apiVersion": api_version, "fieldsType": "FieldsV1", "fieldsV1": {} }
+        kept.append(owner)
+    for entry in adopted:
+        owner["fieldsV1"] = _merge_fields(owner.get("fieldsV1") or {}, entry.get("fieldsV1") or {})
+    # The test operation fails the patch if the object changed since it was read.
+    response = client().patch(
+        path(obj.kind, obj.namespace, obj.name, api_version),
+        headers={ "Content-Type": "application/json-patch+json" },
+        data=json.dumps([
+            { "op": "test", "path": "/metadata/resourceVersion", "value": obj.metadata.get("resourceVersion") },
+            { "op": "replace", "path": "/metadata/managedFields", "value": kept }
+        ])
+    )
+    _check(response)
+    return True
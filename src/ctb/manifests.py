@@ -0,0 +1,193 @@
+#!/usr/bin/python
+# coding: utf-8
+"""
+Index of the skaffold profiles and Kubernetes manifests of the scenarios.
+
+skaffold.yaml and the manifests under hipstershop/scenarios/*/kubernetes-manifests
+are parsed once, with the C YAML loader when it is available. The index
+records the kind, name, namespace, images, and owning scenario of every
+object, and is cached in .ctb/manifests.json. A file is parsed again only
+when its mtime or size changes.
+"""
+
+# Standard packages
+import glob
+import json
+import os
+import tempfile
+import threading
+
+# Proprietary packages
+from ctb.utils import env, state_dir
+
+SKAFFOLD_FILE = "skaffold.yaml"
+SCENARIO_MANIFESTS = os.path.join("hipstershop", "scenarios", "*", "kubernetes-manifests", "*.yaml")
+POD_TEMPLATE_KINDS = ( "Deployment", "DaemonSet", "StatefulSet", "ReplicaSet", "Job" )
+VERSION = 1
+
+_index = None
+_lock = threading.Lock()
+
+
+def load_all(file):
+    """Return the documents of a YAML file, parsed with the C loader when it
+    is available. yaml is imported here, so that reading the cached index
+    (e.g. for shell completion) doesn't load it."""
+    import yaml
+    return list(yaml.load_all(file, Loader=getattr(yaml, "CSafeLoader", yaml.SafeLoader)))
+
+def cache_path():
+    return os.path.join(state_dir(), "manifests.json")
+
+def stamp(relpath):
+    """Return what identifies the version of a file: its mtime and size."""
+    stat = os.stat(os.path.join(env("BASEDIR"), relpath))
+    return [ stat.st_mtime_ns, stat.st_size ]
+
+def relative(pattern):
+    """Return the matching files of a glob pattern, relative to BASEDIR."""
+    basedir = env("BASEDIR")
+    return sorted(os.path.relpath(path, basedir) for path in glob.glob(os.path.join(basedir, pattern)) if os.path.isfile(path))
+
+def pod_spec(obj):
+    """Return the pod spec of an object, if it has one."""
+    if obj.get("kind") == "Pod":
+        return obj.get("spec") or {}
+    if obj.get("kind") in POD_TEMPLATE_KINDS:
+        return ((obj.get("spec") or {}).get("template") or {}).get("spec") or {}
+    return {}
+
+def images(obj):
+    pod = pod_spec(obj)
+    return [ container.get("image") for container in (pod.get("containers") or []) + (pod.get("initContainers") or []) if container.get("image") ]
+
+def scenario_of(relpath):
+    """Return the scenario that owns a manifest file, if any."""
+    parts = relpath.split(os.sep)
+    if len(parts) > 3 and parts[:2] == [ "hipstershop", "scenarios" ]:
+        return parts[2]
+    return None
+
+def parse(relpath):
+    """Return the objects of a manifest file."""
+    with open(os.path.join(env("BASEDIR"), relpath), "r") as file:
+        documents = [ doc for doc in load_all(file) if doc ]
+    objects = []
+    for doc in documents:
+        metadata = doc.get("metadata") or {}
+        objects.append({
+            "kind": doc.get("kind"),
+            "name": metadata.get("name"),
+            "namespace": metadata.get("namespace"),
+            "images": images(doc),
+            "scenario": scenario_of(relpath),
+            "file": relpath,
+            "doc": doc
+        })
+    return objects
+
+def parse_profiles(relpath):
+    """Return the profiles of a skaffold configuration file."""
+    with open(os.path.join(env("BASEDIR"), relpath), "r") as file:
+        conf = (load_all(file) or [ None ])[0] or {}
+    return conf.get("profiles") or []
+
+
+class Index(object):
+    """The profiles of skaffold.yaml and the objects of every manifest."""
+
+    def __init__(self, entries):
+        self.entries = entries
+        self.profiles = { profile["name"]: profile for profile in entries[SKAFFOLD_FILE].get("profiles", []) }
+
+    def scenarios(self):
+        """Return the names of the skaffold profiles."""
+        return sorted(self.profiles.keys())
+
+    def objects(self, scenario=None, kind=None):
+        """Return the objects of every manifest, optionally only those of a
+        scenario directory and of a kind."""
+        return [
+            obj for relpath in sorted(self.entries) for obj in self.entries[relpath].get("objects", [])
+            if (scenario is None or obj["scenario"] == scenario) and (kind is None or obj["kind"] == kind)
+        ]
+
+    def profile_objects(self, profile):
+        """Return the objects that a skaffold profile deploys, in the order of
+        its manifests."""
+        if profile not in self.profiles:
+            raise Exception("Unknown scenario: {}".format(profile))
+        objects = []
+        for pattern in manifest_patterns(self.profiles[profile]):
+            for relpath in relative(pattern):
+                objects.extend(self.entries.get(relpath, {}).get("objects", []))
+        return objects
+
+
+def manifest_patterns(profile):
+    return ((profile.get("deploy") or {}).get("kubectl") or {}).get("manifests") or []
+
+def load_cache():
+    try:
+        with open(cache_path(), "r") as file:
+            cache = json.load(file)
+        return cache["entries"] if cache.get("version") == VERSION else {}
+    except (IOError, ValueError, KeyError):
+        return {}
+
+def save_cache(entries):
+    """Write the cache. Objects are applied from it, so a value that JSON
+    can't represent (e.g. an unquoted YAML date) is an error rather than
+    being turned into a string that the manifest doesn't contain."""
+    try:
+        data = json.dumps({ "version": VERSION, "entries": entries })
+    except (TypeError, ValueError) as e:
+        for relpath in sorted(entries):
+            try:
+                json.dumps(entries[relpath])
+            except (TypeError, ValueError):
+                raise Exception("{} has a value that JSON can't represent, quote it: {}".format(relpath, e))
+        raise
+    fd, tmp = tempfile.mkstemp(prefix="manifests.", dir=state_dir())
+    with os.fdopen(fd, "w") as file:
+        file.write(data)
+    os.replace(tmp, cache_path())
+
+def scenarios():
+    """Return the names of the skaffold profiles, from the cache alone when
+    skaffold.yaml did not change."""
+    entry = load_cache().get(SKAFFOLD_FILE)
+    if entry and entry.get("stamp") == stamp(SKAFFOLD_FILE):
+        return sorted(profile["name"] for profile in entry.get("profiles", []))
+    return index().scenarios()
+
+def index():
+    """Return the index, parsing only the files that changed since it was
+    cached."""
+    global _index
+    with _lock:
+        entries = dict(_index.entries) if _index else load_cache()
+        changed = False
+
+        def refresh(relpath, parser):
+            nonlocal changed
+            current = stamp(relpath)
+            if entries.get(relpath, {}).get("stamp") != current:
+                entries[relpath] = dict(parser(relpath), stamp=current)
+                changed = True
+
+        refresh(SKAFFOLD_FILE, lambda relpath: { "profiles": parse_profiles(relpath) })
+        files = set(relative(SCENARIO_MANIFESTS))
+        for profile in entries[SKAFFOLD_FILE]["profiles"]:
+            for pattern in manifest_patterns(profile):
+                files.update(relative(pattern))
+        for relpath in sorted(files):
+            refresh(relpath, lambda relpath: { "objects": parse(relpath) })
+        for relpath in [ relpath for relpath in entries if relpath != SKAFFOLD_FILE and relpath not in files ]:
+            del entries[relpath]
+            changed = True
+        if changed:
+            save_cache(entries)
+        if changed or _index is None:
+            _index = Index(entries)
+        return _index
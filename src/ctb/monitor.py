@@ -0,0 +1,112 @@
+#!/usr/bin/python
+# coding: utf-8
+"""
+Background polling of status sources.
+
+Each source is polled on its own adaptive interval: the interval resets to
+its minimum when the value changes, and grows up to its maximum while the
+value stays the same or the poll fails. Polls run on a small, fixed pool of
+workers, and a source is never polled twice at once, so the load on the
+network stays bounded however long the engine runs.
+"""
+
+# Standard packages
+import concurrent.futures
+import threading
+import time
+
+
+class Source(object):
+    """A named status source, and how often to poll it."""
+
+    def __init__(self, name, poll, min_interval=2, max_interval=60, factor=1.5):
+        self.name = name
+        self.poll = poll
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.factor = factor
+        self.interval = min_interval
+        self.value = None
+        self.error = None
+        self.updated = None
+        self.polling = False
+        self.due = 0
+
+    def settle(self, value, error):
+        """Record the result of a poll, adapt the interval, and return whether
+        the result changed."""
+        changed = (value, str(error) if error else None) != (self.value, str(self.error) if self.error else None) or self.updated is None
+        self.value = value
+        self.error = error
+        self.updated = time.time()
+        if changed and error is None:
+            self.interval = self.min_interval
+        else:
+            self.interval = min(self.interval * self.factor, self.max_interval)
+        self.due = self.updated + self.interval
+        return changed
+
+
+class Engine(object):
+    """Poll sources in the background until stopped.
+
+    The changed event is set whenever the result of a source changes."""
+
+    def __init__(self, sources, max_workers=4):
+        self.sources = { source.name: source for source in sources }
+        self.changed = threading.Event()
+        self.stopped = threading.Event()
+        self.wake = threading.Event()
+        self.lock = threading.Lock()
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers)
+        self.thread = threading.Thread(target=self.loop, daemon=True)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        # Under the lock, so that the loop never submits to a shut executor.
+        with self.lock:
+            self.stopped.set()
+            self.executor.shutdown(wait=False)
+        self.wake.set()
+
+    def poll(self, source):
+        try:
+            value, error = source.poll(), None
+        except Exception as e:
+            value, error = None, e
+        with self.lock:
+            source.polling = False
+            if source.settle(value, error):
+                self.changed.set()
+        self.wake.set()
+
+    def loop(self):
+        while not self.stopped.is_set():
+            now = time.time()
+            with self.lock:
+                if self.stopped.is_set():
+                    break
+                due = [ source for source in self.sources.values() if not source.polling and source.due <= now ]
+                for source in due:
+                    source.polling = True
+                    self.executor.submit(self.poll, source)
+            with self.lock:
+                waiting = [ source.due for source in self.sources.values() if not source.polling ]
+            # Sleep until the next source is due, or a poll settles.
+            self.wake.wait(max(0.1, min(waiting) - time.time()) if waiting else None)
+            self.wake.clear()
+
+    def refresh(self):
+        """Poll every source once, and wait for the results."""
+        with self.lock:
+            for source in self.sources.values():
+                source.polling = True
+        list(self.executor.map(self.poll, self.sources.values()))
+
+    def snapshot(self):
+        """Return the latest value and error of every source, keyed by name."""
+        with self.lock:
+            return { name: ( source.value, source.error ) for name, source in self.sources.items() }
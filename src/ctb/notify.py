@@ -0,0 +1,117 @@
+#!/usr/bin/python
+# coding: utf-8
+"""
+Asynchronous Slack notifications.
+
+Messages are queued and delivered in order by a background worker, with
+retries, so that a slow Slack endpoint never delays a deployment. Pending
+messages are flushed at exit, for a bounded time (CTB_NOTIFY_FLUSH_TIMEOUT).
+"""
+
+# Standard packages
+import atexit
+import collections
+import sys
+import threading
+import time
+
+# Third-party packages
+import requests
+
+# Proprietary packages
+from ctb import http
+from ctb.utils import env
+
+# Timeout of each delivery attempt, in seconds.
+TIMEOUT = 10
+MAX_ATTEMPTS = 4
+
+_pending = collections.deque()
+_condition = threading.Condition()
+_worker = None
+
+
+def flush_timeout():
+    """Seconds to wait for pending messages at exit (CTB_NOTIFY_FLUSH_TIMEOUT)."""
+    return float(env("CTB_NOTIFY_FLUSH_TIMEOUT") or 30)
+
+def slack(text, url=None):
+    """Queue a message to the Slack webhook, unless no webhook is set."""
+    url = url or env("SLACK_WEBHOOK_URL")
+    if not url:
+        sys.stderr.write("Warning: SLACK_WEBHOOK_URL is not set. The Slack notification was not sent.\n")
+        return
+    enqueue(url, { "text": text })
+
+def enqueue(url, payload):
+    """Queue a JSON payload to post to a URL, after the messages already queued."""
+    global _worker
+    with _condition:
+        _pending.append(( url, payload ))
+        if _worker is None or not _worker.is_alive():
+            _worker = threading.Thread(target=work, name="ctb-notify", daemon=True)
+            _worker.start()
+        _condition.notify_all()
+
+def deliver(url, payload):
+    """Post a payload, retrying with backoff on errors, and return whether it
+    was delivered.
+
+    Webhook posts are not idempotent, so a post is retried only when Slack
+    surely did not act on it: on connection errors, and on 429 and 5xx
+    responses. A read timeout is not retried, so a slow Slack never gets the
+    same message twice."""
+    error = None
+    delay = 1
+    for attempt in range(MAX_ATTEMPTS):
+        if attempt:
+            time.sleep(delay)
+        delay = 2 ** attempt
+        try:
+            response = http.client().post(url=url, json=payload, timeout=TIMEOUT)
+        except requests.exceptions.ConnectionError as e:
+            error = e
+            continue
+        except requests.exceptions.RequestException as e:
+            error = e
+            break
+        if response.status_code in range(200, 299):
+            return True
+        error = "{} {}".format(response.status_code, response.text)
+        if response.status_code == 429:
+            delay = float(response.headers.get("Retry-After") or delay)
+        elif response.status_code not in range(500, 599):
+            break
+    sys.stderr.write("Warning: Slack notification failed: {}\n".format(error))
+    return False
+
+def work():
+    """Deliver queued messages, one at a time and in order."""
+    while True:
+        with _condition:
+            while not _pending:
+                _condition.wait()
+            url, payload = _pending[0]
+        # An unexpected error must not kill the worker before the message is
+        # dequeued, or flush() would wait for it until its timeout.
+        try:
+            deliver(url, payload)
+        except Exception as e:
+            sys.stderr.write("Warning: Slack notification failed: {}\n".format(e))
+        finally:
+            with _condition:
+                _pending.popleft()
+                _condition.notify_all()
+
+def flush(timeout=None):
+    """Wait until every queued message is delivered or the timeout passes, and
+    return whether the queue is empty."""
+    deadline = time.time() + (flush_timeout() if timeout is None else timeout)
+    with _condition:
+        while _pending and time.time() < deadline:
+            _condition.wait(deadline - time.time())
+        if _pending:
+            sys.stderr.write("Warning: {} Slack notifications were not delivered.\n".format(len(_pending)))
+        return not _pending
+
+atexit.register(flush)
@@ -5,7 +5,9 @@ Pre-compiled regular expressions.
 """
 import re
 
+ABSOLUTE_URL = re.compile(r"^https?://", re.IGNORECASE)
 ENV_VAR = re.compile(r"^\s*([^\#\=][^\=]*)=(.*)\s*\r?\n?")
 EXPAND_VARS = re.compile(r"(?<!\\)\$[A-Za-z_][A-Za-z0-9_]*")
 NEWLINE = re.compile(r"\r?\n$")
 STATUS = re.compile(r"^status: (.*)", re.MULTILINE)
+VARIABLE = re.compile(r"\$(?:([A-Za-z_][A-Za-z0-9_]*)|\{([^}]*)\})")
@@ -6,68 +6,60 @@ Check the status of various resources.
 
 # Standard packages
 import re
+import subprocess
 
 # Third-party packages
 import requests
 
 # Proprietary packages
-from ctb import constants
+from ctb import ess
+from ctb import http
 from ctb import patterns
+from ctb.cache import cached
 from ctb.utils import cmd, env
 
+# Environment variables that identify what each group of probes checks.
+GKE_SCOPE = ( "GCP_PROJECT_NAME", "GCP_REGION_NAME", "DEPLOYMENT_NAME" )
+ESS_SCOPE = ( "ELASTIC_CLOUD_DEPLOYMENT_ID", "ELASTIC_CLOUD_API_KEY" )
+STACK_SCOPE = ESS_SCOPE + ( "ELASTICSEARCH_URL", "KIBANA_URL", "ELASTICSEARCH_USERNAME", "ELASTICSEARCH_PASSWORD" )
+
+@cached(ttl=5, scope=STACK_SCOPE, disk=False)
 def get_ess_operator_role():
-    return requests.get(
-        url="{}/api/security/role/operator".format(env("KIBANA_URL")),
-        headers=constants.kibana_api_headers(),
-        timeout=30
-    )
+    return http.kibana().get("/api/security/role/operator")
 
+@cached(ttl=5, scope=STACK_SCOPE, disk=False)
 def get_ess_operator_user():
-    return requests.get(
-        url="{}/internal/security/users/operator".format(env("KIBANA_URL")),
-        headers=constants.kibana_api_headers(),
-        timeout=30
-    )
+    return http.kibana().get("/internal/security/users/operator")
 
+@cached(ttl=5, scope=STACK_SCOPE, disk=False)
 def get_ess_slack_connector():
-    return requests.get(
-        url="{}/.kibana/_search?q=(type:action+AND+slack)".format(env("ELASTICSEARCH_URL")),
-        auth=(env("ELASTICSEARCH_USERNAME"), env("ELASTICSEARCH_PASSWORD")),
-        timeout=30
-    )
+    return http.elasticsearch().get("/.kibana/_search?q=(type:action+AND+slack)")
 
+@cached(ttl=30, scope=GKE_SCOPE)
 def status_gke():
     if not env("GCP_PROJECT_NAME") or not env("GCP_REGION_NAME") or not env("DEPLOYMENT_NAME"):
         return None
     exitcode, out, err = cmd("""
     gcloud beta container clusters describe "projects/$GCP_PROJECT_NAME/zones/$GCP_REGION_NAME/clusters/ctb-$DEPLOYMENT_NAME" --region=$GCP_REGION_NAME
     """, stdout=False)
-    if err:
-        raise Exception(err)
-    status = re.findall(patterns.STATUS, out)
+    if exitcode:
+        raise subprocess.CalledProcessError(exitcode, "gcloud", out, err)
+    status = re.findall(patterns.STATUS, out.decode("utf-8"))
     if status:
         return status[0] == "RUNNING"
     return False
 
+@cached(ttl=10, scope=ESS_SCOPE)
 def status_ess():
     if not env("ELASTIC_CLOUD_DEPLOYMENT_ID") or not env("ELASTIC_CLOUD_API_KEY"):
         return None
     try:
-        response = requests.get(
-            url="https://api.elastic-cloud.com/api/v1/deployments/{}".format(env("ELASTIC_CLOUD_DEPLOYMENT_ID")),
-            headers=constants.ess_api_headers(),
-            timeout=30
-        )
-        resources = response.json().get("resources", {}).get("elasticsearch", [{}])
-        status = resources[0].get("info", {}).get("status") if resources else None
-        if response.status_code in range(200, 299) and status != "stopped":
-            return True
-        if response.status_code in range(400, 599) and response.status_code not in [404, 410]:
-            raise Exception(response)
+        deployment = ess.deployment()
+        return deployment is not None and deployment.status("elasticsearch") != "stopped"
     except requests.exceptions.ReadTimeout:
         return False
-    return False
 
+@cached(ttl=10, scope=STACK_SCOPE + ( "ELASTIC_APM_SERVER_URL", "ELASTIC_APM_SECRET_TOKEN" ))
 def status_ess_component(component):
     if not env("ELASTIC_CLOUD_DEPLOYMENT_ID") or not env("ELASTIC_CLOUD_API_KEY"):
         return None
@@ -78,19 +70,12 @@ def status_ess_component(component):
     elif component == "apm" and (not env("ELASTIC_APM_SERVER_URL") or not env("ELASTIC_APM_SECRET_TOKEN")):
         return None
     try:
-        response = requests.get(
-            url="https://api.elastic-cloud.com/api/v1/deployments/{}/{}/main-{}".format(env("ELASTIC_CLOUD_DEPLOYMENT_ID"), component, component),
-            headers=constants.ess_api_headers(),
-            timeout=30
-        )
-        if response.status_code in range(400, 599) and response.status_code not in [404, 410]:
-            raise Exception(response)
-        healthy = response.json().get("info", {}).get("plan_info", {}).get("healthy")
-        current = response.json().get("info", {}).get("plan_info", {}).get("current")
-        return healthy and current
+        deployment = ess.deployment()
+        return deployment is not None and deployment.healthy(component)
     except requests.exceptions.ReadTimeout:
         return False
 
+@cached(ttl=30, scope=STACK_SCOPE)
 def status_ess_operator_role():
     if not env("ELASTIC_CLOUD_DEPLOYMENT_ID") or not env("ELASTIC_CLOUD_API_KEY") or not env("ELASTICSEARCH_URL") or not env("KIBANA_URL") or not env("ELASTICSEARCH_USERNAME") or not env("ELASTICSEARCH_PASSWORD"):
         return None
@@ -99,6 +84,7 @@ def status_ess_operator_role():
         raise Exception(response)
     return response.status_code == 200
 
+@cached(ttl=30, scope=STACK_SCOPE)
 def status_ess_operator_user():
     if not env("ELASTIC_CLOUD_DEPLOYMENT_ID") or not env("ELASTIC_CLOUD_API_KEY") or not env("ELASTICSEARCH_URL") or not env("KIBANA_URL") or not env("ELASTICSEARCH_USERNAME") or not env("ELASTICSEARCH_PASSWORD"):
         return None
@@ -107,6 +93,7 @@ def status_ess_operator_user():
         raise Exception(response)
     return response.status_code == 200
 
+@cached(ttl=30, scope=STACK_SCOPE)
 def status_ess_slack_connector():
     if not env("ELASTIC_CLOUD_DEPLOYMENT_ID") or not env("ELASTIC_CLOUD_API_KEY") or not env("ELASTICSEARCH_URL") or not env("KIBANA_URL") or not env("ELASTICSEARCH_USERNAME") or not env("ELASTICSEARCH_PASSWORD"):
         return None
@@ -115,11 +102,12 @@ def status_ess_slack_connector():
         raise Exception(response)
     return response.json().get("hits", {}).get("total", {}).get("value") > 0
 
+@cached(ttl=10, scope=( "FRONTEND_URL", ))
 def status_frontend():
     if not env("FRONTEND_URL"):
         return None
     try:
-        response = requests.get(url=env("FRONTEND_URL"), timeout=30)
+        response = http.client().get(env("FRONTEND_URL"))
         if response.status_code in range(400, 599) and response.status_code not in [404, 410]:
             raise Exception(response)
         return response.status_code in range(200, 299)
@@ -0,0 +1,77 @@
+#!/usr/bin/python
+# coding: utf-8
+"""
+Track the rollout of the workloads that a scenario changed.
+
+The status streams of Deployments and DaemonSets are watched until each
+changed workload is available, i.e. its new pods are ready and serving, or
+until a deadline passes.
+"""
+
+# Standard packages
+import threading
+import time
+
+# Proprietary packages
+from ctb import deploy
+from ctb import k8s
+from ctb import utils
+from ctb.utils import env
+
+TRACKED_KINDS = ( "Deployment", "DaemonSet" )
+
+
+def timeout():
+    """Seconds to wait for a rollout (CTB_ROLLOUT_TIMEOUT)."""
+    return int(env("CTB_ROLLOUT_TIMEOUT") or 600)
+
+def track(objects, deadline=None):
+    """Wait until the workloads among the given objects are available, and
+    return the time when each one became available (None if it did not),
+    keyed by "Kind/namespace/name"."""
+    started = time.time()
+    deadline = started + (deadline or timeout())
+    waiting = {}
+    for obj in objects:
+        if obj.get("kind") in TRACKED_KINDS:
+            metadata = obj.get("metadata", {})
+            namespace = metadata.get("namespace") or k8s.config().namespace
+            waiting.setdefault(obj["kind"], set()).add("{}/{}/{}".format(obj["kind"], namespace, metadata.get("name")))
+    ready = { name: None for names in waiting.values() for name in names }
+    lock = threading.Lock()
+
+    def check(obj):
+        name = "{}/{}/{}".format(obj.kind, obj.namespace, obj.name)
+        if name in waiting[obj.kind] and obj.is_available():
+            with lock:
+                waiting[obj.kind].discard(name)
+                ready[name] = time.time()
+            print("...ready: {} ({:.0f}s)".format(name, ready[name] - started))
+
+    def follow(kind):
+        k8s.follow(
+            kind,
+            lambda event, obj: check(obj) if event in ( "ADDED", "MODIFIED" ) else None,
+            label_selector=deploy.run_id_selector(),
+            done=lambda: not waiting[kind],
+            deadline=deadline
+        )
+
+    utils.parallel_tasks(follow, sorted(waiting.keys()))
+    return ready
+
+def table(ready, started):
+    """Return the lines of a time-to-ready table of a rollout that began at
+    the given time."""
+    if not ready:
+        return []
+    label = max(len(name) for name in ready)
+    def clock(seconds):
+        return "{}:{:02d}".format(int(seconds) // 60, int(seconds) % 60)
+    lines = []
+    for name in sorted(ready, key=lambda name: (ready[name] is None, ready[name] or 0, name)):
+        if ready[name] is None:
+            lines.append("{}  not ready".format(name.ljust(label)))
+        else:
+            lines.append("{}  {}  {}".format(name.ljust(label), clock(ready[name] - started), time.strftime("%H:%M:%S", time.localtime(ready[name]))))
+    return lines
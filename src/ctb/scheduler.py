@@ -0,0 +1,125 @@
+#!/usr/bin/python
+# coding: utf-8
+"""
+Run a graph of dependent tasks on a thread pool.
+
+Every task starts as soon as the tasks it depends on are done, and receives
+their results as positional arguments.
+"""
+
+# Standard packages
+import concurrent.futures
+import threading
+import time
+
+# Proprietary packages
+from ctb import trace
+
+
+class Task(object):
+    """A named unit of work and the names of the tasks it depends on.
+
+    The scheduler records when the task started and finished running."""
+
+    def __init__(self, name, function, depends=()):
+        self.name = name
+        self.function = function
+        self.depends = tuple(depends)
+        self.started = None
+        self.finished = None
+
+
+def order(tasks):
+    """Return the tasks sorted so that each one follows its dependencies."""
+    by_name = {}
+    for task in tasks:
+        if task.name in by_name:
+            raise ValueError("Duplicate task: {}".format(task.name))
+        by_name[task.name] = task
+    ordered = []
+    visiting = set()
+    visited = set()
+    def visit(task):
+        if task.name in visited:
+            return
+        if task.name in visiting:
+            raise ValueError("Dependency cycle at task: {}".format(task.name))
+        visiting.add(task.name)
+        for name in task.depends:
+            if name not in by_name:
+                raise ValueError("Task '{}' depends on unknown task '{}'".format(task.name, name))
+            visit(by_name[name])
+        visiting.discard(task.name)
+        visited.add(task.name)
+        ordered.append(task)
+    for task in tasks:
+        visit(task)
+    return ordered
+
+def run(tasks, max_workers=8):
+    """Start the tasks and return a future for each one, keyed by name.
+
+    A task whose dependency raised an exception raises the same exception."""
+    tasks = order(tasks)
+    futures = { task.name: concurrent.futures.Future() for task in tasks }
+    waiting = { task.name: set(task.depends) for task in tasks }
+    remaining = [ len(tasks) ]
+    lock = threading.Lock()
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers)
+    # Tasks are traced as phases nested in the phases open on this thread.
+    call = trace.inherit(lambda function: function())
+
+    def start(task):
+        futures[task.name].set_running_or_notify_cancel()
+        def work():
+            task.started = time.time()
+            with trace.phase(task.name, "task"):
+                return task.function(*[ futures[name].result() for name in task.depends ])
+        executor.submit(call, work).add_done_callback(lambda inner: settle(task, inner))
+
+    def settle(task, inner):
+        task.finished = time.time()
+        if inner.exception() is not None:
+            futures[task.name].set_exception(inner.exception())
+        else:
+            futures[task.name].set_result(inner.result())
+        ready = []
+        with lock:
+            for other in tasks:
+                if task.name in waiting[other.name]:
+                    waiting[other.name].discard(task.name)
+                    if not waiting[other.name]:
+                        ready.append(other)
+            remaining[0] -= 1
+            finished = remaining[0] == 0
+        for other in ready:
+            start(other)
+        if finished:
+            executor.shutdown(wait=False)
+
+    if not tasks:
+        executor.shutdown(wait=False)
+    for task in [ task for task in tasks if not task.depends ]:
+        start(task)
+    return futures
+
+def timeline(tasks, width=40):
+    """Return the lines of a text timeline of the tasks that ran."""
+    tasks = [ task for task in tasks if task.started and task.finished ]
+    if not tasks:
+        return []
+    origin = min(task.started for task in tasks)
+    span = max(max(task.finished for task in tasks) - origin, 0.001)
+    label = max(len(task.name) for task in tasks)
+    def clock(seconds):
+        return "{}:{:02d}".format(int(seconds) // 60, int(seconds) % 60)
+    lines = []
+    for task in sorted(tasks, key=lambda task: task.started):
+        start = task.started - origin
+        end = task.finished - origin
+        offset = int(round(start / span * width))
+        length = max(1, int(round((end - start) / span * width)))
+        lines.append("{}  {} - {}  {}{}".format(
+            task.name.ljust(label), clock(start), clock(end), " " * offset, "#" * length
+        ))
+    return lines
@@ -0,0 +1,66 @@
+#!/usr/bin/python
+# coding: utf-8
+"""
+Keep the ctb-secrets Secret in sync with the .env file.
+
+The Secret carries a hash of its contents in an annotation. It is only
+updated, in place, when that hash differs from the .env file, so pods never
+see a window where the Secret is missing.
+"""
+
+# Standard packages
+import base64
+import hashlib
+import json
+
+# Proprietary packages
+from ctb import config
+from ctb import k8s
+from ctb.utils import env
+
+NAME = "ctb-secrets"
+NAMESPACES = ( "default", "kube-system" )
+HASH_ANNOTATION = "ctb.elastic.co/content-hash"
+
+
+def data():
+    """Return the contents of the Secret: the variables of the .env file."""
+    return dict(config.envfile(env("ENVFILE")).items())
+
+def content_hash(values):
+    return hashlib.sha256(json.dumps(values, sort_keys=True).encode("utf-8")).hexdigest()
+
+def manifest(namespace, values, digest):
+    return {
+        "apiVersion": "v1",
+        "kind": "Secret",
+        "type": "Opaque",
+        "metadata": {
+            "name": NAME,
+            "namespace": namespace,
+            "annotations": { HASH_ANNOTATION: digest }
+        },
+        "data": { variable: base64.b64encode(value.encode("utf-8")).decode("utf-8") for variable, value in values.items() }
+    }
+
+def live_hashes():
+    """Return the content hash of the live Secret in each namespace."""
+    return {
+        secret.namespace: secret.annotations.get(HASH_ANNOTATION)
+        for secret in k8s.objects("Secret", field_selector="metadata.name={}".format(NAME))
+    }
+
+def ensure():
+    """Update the Secret in the namespaces where it is missing or stale, and
+    return those namespaces."""
+    values = data()
+    digest = content_hash(values)
+    live = live_hashes()
+    stale = [ namespace for namespace in NAMESPACES if live.get(namespace) != digest ]
+    if not stale:
+        print("...unchanged.")
+        return []
+    for namespace in stale:
+        k8s.apply(manifest(namespace, values, digest))
+    print("...updated: {}".format(", ".join(stale)))
+    return stale
@@ -0,0 +1,94 @@
+#!/usr/bin/python
+# coding: utf-8
+"""
+Compiled, cached templates of the files under the elasticsearch directory.
+
+Each file is read once and compiled into literal text and the variables it
+refers to (e.g. $SERVICE_NAME). Templates are rendered from an explicit
+context instead of the process environment, and rendered results are
+memoised by template and by the values of its variables.
+"""
+
+# Standard packages
+import copy
+import json
+import os
+import threading
+
+# Proprietary packages
+from ctb import patterns
+from ctb import utils
+from ctb.utils import env
+
+_compiled = {}
+_rendered = {}
+_lock = threading.Lock()
+
+
+class Template(object):
+    """A template compiled into a sequence of literal text and variables.
+
+    Follows the rules of utils.expandvars(): an undefined $VARIABLE renders
+    as an empty string, while an undefined ${VARIABLE} or an escaped
+    \\$VARIABLE is left as is."""
+
+    def __init__(self, name, text):
+        self.name = name
+        self.segments = []
+        position = 0
+        for match in patterns.VARIABLE.finditer(text):
+            escaped = match.start() > 0 and text[match.start() - 1] == "\\"
+            fallback = match.group(0) if escaped or match.group(2) is not None else ""
+            self.segments.append(( text[position:match.start()], match.group(1) or match.group(2), fallback ))
+            position = match.end()
+        self.segments.append(( text[position:], None, "" ))
+        self.variables = tuple(sorted(set(name for literal, name, fallback in self.segments if name)))
+
+    def render(self, context):
+        parts = []
+        for literal, name, fallback in self.segments:
+            parts.append(literal)
+            if name:
+                value = context.get(name)
+                parts.append(fallback if value is None else value)
+        return "".join(parts)
+
+
+def path(name):
+    """Return the path of a template file."""
+    return os.path.join(env("BASEDIR"), "elasticsearch", name)
+
+def get(name):
+    """Return the compiled template of a file, reading it only once."""
+    filepath = path(name)
+    with _lock:
+        if filepath not in _compiled:
+            _compiled[filepath] = Template(name, utils.load_file(filepath).strip())
+        return _compiled[filepath]
+
+def render(name, context):
+    """Render a template with the variables of the given context."""
+    template = get(name)
+    key = ( path(name), tuple(context.get(variable) for variable in template.variables) )
+    with _lock:
+        if key not in _rendered:
+            _rendered[key] = template.render(context)
+        return _rendered[key]
+
+def render_json(name, context):
+    """Render a JSON template and return a new JSON object."""
+    template = get(name)
+    key = ( path(name), "json", tuple(context.get(variable) for variable in template.variables) )
+    with _lock:
+        cached = _rendered.get(key)
+    if cached is None:
+        cached = json.loads(render(name, context))
+        with _lock:
+            _rendered[key] = cached
+    return copy.deepcopy(cached)
+
+def clear():
+    """Forget every compiled template and rendered result."""
+    with _lock:
+        _compiled.clear()
+        _rendered.clear()
@@ -0,0 +1,136 @@
+#!/usr/bin/python
+# coding: utf-8
+"""
+Lightweight timing of the phases of a command.
+
+    with trace.phase("update-secrets"):
+        ...
+
+Phases nest per thread. Subprocesses, HTTP requests, and wait loops are
+traced as phases too. Tracing is off unless enabled (ctb --profile), and then
+a disabled phase costs one check. The spans can be summarised as a
+flame-style tree, or written as a Chrome trace (chrome://tracing, Perfetto).
+"""
+
+# Standard packages
+import contextlib
+import json
+import os
+import threading
+import time
+
+_enabled = False
+_spans = []
+_lock = threading.Lock()
+_local = threading.local()
+
+
+class Span(object):
+    """A timed phase, and the phases it is nested in on its thread."""
+
+    def __init__(self, name, category, path, thread, start, args):
+        self.name = name
+        self.category = category
+        self.path = path
+        self.thread = thread
+        self.start = start
+        self.end = None
+        self.args = args
+
+    @property
+    def duration(self):
+        return (self.end or time.time()) - self.start
+
+
+def enable():
+    global _enabled
+    _enabled = True
+
+def enabled():
+    return _enabled
+
+def spans():
+    with _lock:
+        return list(_spans)
+
+@contextlib.contextmanager
+def phase(name, category="phase", **args):
+    """Time the enclosed block as a phase with the given name."""
+    if not _enabled:
+        yield
+        return
+    stack = getattr(_local, "stack", None)
+    if stack is None:
+        stack = _local.stack = []
+    span = Span(name, category, tuple(stack) + ( name, ), threading.get_ident(), time.time(), args)
+    stack.append(name)
+    try:
+        yield span
+    finally:
+        span.end = time.time()
+        stack.pop()
+        with _lock:
+            _spans.append(span)
+
+def inherit(function):
+    """Wrap a function to run on another thread, nested in the phases that
+    are open on this thread."""
+    if not _enabled:
+        return function
+    parent = list(getattr(_local, "stack", None) or [])
+    def wrapper(*args, **kwargs):
+        previous = getattr(_local, "stack", None)
+        _local.stack = list(parent)
+        try:
+            return function(*args, **kwargs)
+        finally:
+            _local.stack = previous
+    return wrapper
+
+
+####  Reports  #################################################################
+
+def summary(width=30):
+    """Return the lines of a flame-style summary: the total time and count of
+    every phase, nested under the phases it ran in."""
+    recorded = spans()
+    if not recorded:
+        return []
+    wall = max(span.end for span in recorded) - min(span.start for span in recorded)
+    totals = {}
+    for span in recorded:
+        total, count = totals.get(span.path, ( 0.0, 0 ))
+        totals[span.path] = ( total + span.duration, count + 1 )
+    label = max(2 * (len(path) - 1) + len(path[-1]) for path in totals)
+    lines = [ "Profile (wall time {:.1f}s):".format(wall) ]
+
+    def visit(parent):
+        children = [ path for path in totals if path[:-1] == parent ]
+        for path in sorted(children, key=lambda path: -totals[path][0]):
+            total, count = totals[path]
+            share = total / wall if wall else 0
+            lines.append("  {}{}  {:>8.2f}s {:>6.1f}%  {:>4}x  {}".format(
+                "  " * (len(path) - 1), path[-1].ljust(label - 2 * (len(path) - 1)),
+                total, 100 * share, count, "#" * max(1, int(round(min(share, 1) * width)))
+            ))
+            visit(path)
+
+    visit(())
+    return lines
+
+def write_chrome_trace(path):
+    """Write the spans in the Chrome trace event format."""
+    events = []
+    for span in spans():
+        events.append({
+            "name": span.name,
+            "cat": span.category,
+            "ph": "X",
+            "ts": int(span.start * 1e6),
+            "dur": int(span.duration * 1e6),
+            "pid": os.getpid(),
+            "tid": span.thread,
+            "args": { key: str(value) for key, value in span.args.items() }
+        })
+    with open(path, "w") as file:
+        json.dump({ "traceEvents": events, "displayTimeUnit": "ms" }, file)
@@ -5,71 +5,220 @@ Common utility functions.
 """
 
 # Standard packages
+import collections
+import contextlib
 import io
 import json
-import multiprocessing
 import os
 import re
 import shlex
 import subprocess
+import sys
+import threading
 
 # Proprietary packages
+from ctb import config
 from ctb import patterns
+from ctb import trace
 
 
 def env(variable):
     """Shorthand for accessing environment variables."""
     return os.environ.get(variable)
 
+def state_dir():
+    """Directory of the local ctb state files."""
+    path = os.path.join(env("BASEDIR"), ".ctb")
+    if not os.path.isdir(path):
+        os.makedirs(path)
+    return path
+
+# Pending .env changes of the current envfile_transaction(), if any.
+_transaction = {
+    "depth": 0,
+    "appended": {}
+}
+_transaction_lock = threading.RLock()
+
+def _write_envfile(appended=None):
+    envfile = config.envfile(env("ENVFILE"))
+    envfile.sync(os.environ)
+    for variable, value in (appended or {}).items():
+        envfile.set(variable, value)
+    return envfile.flush()
+
 def update_envfile():
-    """Update the .env file with current applicable environment variables."""
-    updated = []
-    with open(env("ENVFILE"), "r") as file:
-        for line in file:
-            line = re.sub(patterns.NEWLINE, "", line)
-            matches = re.findall(patterns.ENV_VAR, line)
-            if len(matches) > 0:
-                variable, old_value = matches[0]
-                updated.append("{}={}".format(variable, env(variable)))
-            else:
-                updated.append(line)
-    with open(env("ENVFILE"), "w") as file:
-        file.write("\n".join(updated))
-
-def expandvars(s):
-    """Expand environment variables in a string like Bash (e.g. $VARIABLE)."""
-    return re.sub(patterns.EXPAND_VARS, "", os.path.expandvars(s))
+    """Update the .env file with current applicable environment variables.
+    Inside envfile_transaction(), the update is deferred to the end of it."""
+    with _transaction_lock:
+        if _transaction["depth"] > 0:
+            return False
+        return _write_envfile()
+
+def setenv(variable, value, append=True):
+    """Set an environment variable and persist it to the .env file, appending
+    it to the file if it is missing there and append is True."""
+    with _transaction_lock:
+        os.environ[variable] = value
+        appended = { variable: value } if append else {}
+        if _transaction["depth"] > 0:
+            _transaction["appended"].update(appended)
+            return False
+        return _write_envfile(appended)
+
+@contextlib.contextmanager
+def envfile_transaction():
+    """Collect .env updates made in the block and write them once at the end.
+
+    The file is written atomically, and only if a value changed. Pending
+    changes are written even if the block raises an exception, so that values
+    such as a newly created deployment ID are never lost."""
+    with _transaction_lock:
+        _transaction["depth"] += 1
+    try:
+        yield
+    finally:
+        with _transaction_lock:
+            _transaction["depth"] -= 1
+            if _transaction["depth"] == 0:
+                appended = _transaction["appended"]
+                _transaction["appended"] = {}
+                _write_envfile(appended)
+
+def expandvars(s, context=None):
+    """Expand variables in a string like Bash (e.g. $VARIABLE).
+
+    Variables are looked up in the given context first, and then in the
+    environment. Variables that are defined in neither are removed."""
+    if context is None:
+        return re.sub(patterns.EXPAND_VARS, "", os.path.expandvars(s))
+    lookup = collections.ChainMap(context, os.environ)
+    def replace(match):
+        value = lookup.get(match.group(1) or match.group(2))
+        return match.group(0) if value is None else value
+    return re.sub(patterns.EXPAND_VARS, "", re.sub(patterns.VARIABLE, replace, s))
 
 def load_file(filepath):
     """Read a file."""
     with io.open(filepath, mode="r", encoding="utf-8") as file:
         return file.read()
 
-def load_template(filepath):
+def load_template(filepath, context=None):
     """Read a file and populate its variables."""
-    return expandvars(load_file(filepath).strip()).encode("utf-8")
+    return expandvars(load_file(filepath).strip(), context)
 
-def load_template_json(filepath):
+def load_template_json(filepath, context=None):
     """Read a file containing a JSON template, populate its variables, and
     convert it to a JSON object."""
-    return json.loads(load_template(filepath))
+    return json.loads(load_template(filepath, context))
 
-def cmd(command, stdout=True):
-    """Execute a shell command."""
+def cmd(command, stdout=True, input=None):
+    """Execute a shell command, optionally writing the given text to its
+    standard input."""
     args = shlex.split(expandvars(command))
-    if stdout:
-        return subprocess.call(args)
-    p = subprocess.Popen(args, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-    out, err = p.communicate()
-    exitcode = p.returncode
-    return exitcode, out, err
-
-def parallel_tasks(function, tasks, num_processes=4):
-    pool = multiprocessing.Pool(processes=num_processes)
+    stdin = subprocess.PIPE if input is not None else None
+    data = input.encode("utf-8") if input is not None else None
+    # Trace the program and its subcommand only: the other arguments can
+    # carry credentials.
+    name = " ".join([ os.path.basename(args[0]) ] + [ arg for arg in args[1:2] if re.match(r"^[a-z][a-z-]*$", arg) ])
+    with trace.phase(name, "subprocess"):
+        if stdout and output_prefix_active():
+            # Relay the output line by line, so that it gets the prefix.
+            p = subprocess.Popen(args, stdin=stdin, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+            if data is not None:
+                p.stdin.write(data)
+                p.stdin.close()
+            for line in p.stdout:
+                sys.stdout.write(line.decode("utf-8", "replace"))
+            return p.wait()
+        if stdout:
+            p = subprocess.Popen(args, stdin=stdin)
+            p.communicate(data)
+            return p.returncode
+        p = subprocess.Popen(args, stdin=stdin, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        out, err = p.communicate(data)
+        exitcode = p.returncode
+        return exitcode, out, err
+
+# Output prefix of the current thread, if any.
+_output = threading.local()
+
+class PrefixedStream(object):
+    """Wrap a stream to prefix the lines that each thread writes with the
+    prefix of that thread, if any. Prefixed lines are written whole, so that
+    the output of concurrent threads does not interleave within a line."""
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.lock = threading.Lock()
+
+    def write(self, text):
+        prefix = getattr(_output, "prefix", None)
+        if not prefix:
+            with self.lock:
+                return self.stream.write(text)
+        lines = (_output.partial + text).split("\n")
+        _output.partial = lines.pop()
+        if lines:
+            with self.lock:
+                self.stream.write("".join("{}{}\n".format(prefix, line) for line in lines))
+        return len(text)
+
+    def flush(self):
+        self.stream.flush()
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+def output_prefix_active():
+    return bool(getattr(_output, "prefix", None))
+
+@contextlib.contextmanager
+def output_prefix(prefix):
+    """Prefix the lines that this thread prints in the block, including the
+    output of cmd(), e.g. with the name of a concurrent stage."""
+    with _transaction_lock:
+        if not isinstance(sys.stdout, PrefixedStream):
+            sys.stdout = PrefixedStream(sys.stdout)
+    previous = getattr(_output, "prefix", None), getattr(_output, "partial", "")
+    _output.prefix, _output.partial = prefix, ""
+    try:
+        yield
+    finally:
+        if _output.partial:
+            sys.stdout.write("\n")
+        sys.stdout.flush()
+        _output.prefix, _output.partial = previous
+
+def concurrency():
+    """Maximum number of concurrent I/O tasks (CTB_CONCURRENCY)."""
+    return int(env("CTB_CONCURRENCY") or 8)
+
+def parallel_tasks(function, tasks, max_workers=None, timeout=None):
+    """Run a function over I/O-bound tasks on a bounded thread pool, and
+    return the results in the order of the tasks.
+
+    Every task runs to completion unless a timeout (in seconds) is given for
+    the whole batch. When it passes, the tasks that have not started are
+    cancelled, and concurrent.futures.TimeoutError is raised. Tasks that are
+    running can't be interrupted, and finish in the background."""
+    tasks = list(tasks)
+    if not tasks:
+        return []
+    max_workers = min(max_workers or concurrency(), len(tasks))
+    # Imported here, so that commands without parallel tasks don't load it.
+    import concurrent.futures
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers)
+    futures = []
     try:
-        result = pool.map_async(function, tasks).get(60)
-    except KeyboardInterrupt:
-        pool.terminate()
-    else:
-        pool.close()
-    pool.join()
+        futures = [ executor.submit(trace.inherit(function), task) for task in tasks ]
+        done, pending = concurrent.futures.wait(futures, timeout)
+        if pending:
+            raise concurrent.futures.TimeoutError("{} of {} tasks did not finish in {}s".format(len(pending), len(futures), timeout))
+        return [ future.result() for future in futures ]
+    except BaseException:
+        for future in futures:
+            future.cancel()
+        raise
+    finally:
+        executor.shutdown(wait=False)
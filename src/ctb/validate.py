@@ -11,18 +11,21 @@ import sys
 from termcolor import colored
 
 # Proprietary packages
-from ctb.utils import cmd, env
+from ctb import k8s
+from ctb.utils import env
 
 
 def kubectl_context():
-    exitcode, out, err = cmd("kubectl config current-context", False)
-    current_context = out.strip()
+    try:
+        current_context, error = k8s.current_context(), None
+    except Exception as e:
+        current_context, error = "", str(e)
     required_context = "gke_{}_{}_ctb-{}".format(env("GCP_PROJECT_NAME"), env("GCP_REGION_NAME"), env("DEPLOYMENT_NAME"))
     if not current_context.startswith("gke_"):
         print("")
         print(colored("Error: kubectl doesn't appear to be set up correctly.", "yellow", attrs=["bold",]))
         print("")
-        print(colored("Ran this command:", "yellow", attrs=["bold",]))
+        print(colored("Read the current context of this command:", "yellow", attrs=["bold",]))
         print("")
         print(colored("  kubectl config current-context", "yellow"))
         print("")
@@ -32,7 +35,7 @@ def kubectl_context():
         print("")
         print(colored("Received this instead:", "yellow", attrs=["bold",]))
         print("")
-        print(colored(current_context if out else err, "yellow"))
+        print(colored(current_context or error, "yellow"))
         sys.exit(1)
     if current_context != required_context:
         print("")
@@ -0,0 +1,129 @@
+#!/usr/bin/python
+# coding: utf-8
+"""
+Wait for readiness conditions.
+
+Conditions are polled together by a single scheduler. Each one backs off
+exponentially, with jitter, between polls and has its own deadline. When
+several conditions are due at once, their checks run concurrently.
+
+Only transient errors (network errors, Kubernetes API errors, and failed
+commands) mean "not ready yet". Any other exception is a bug, and is raised
+at once rather than retried until the deadline.
+"""
+
+# Standard packages
+import concurrent.futures
+import random
+import subprocess
+import sys
+import time
+
+# Third-party packages
+import requests
+
+# Proprietary packages
+from ctb import k8s
+from ctb import trace
+
+# Errors that a check may raise while a resource is not ready yet.
+TRANSIENT_ERRORS = ( requests.exceptions.RequestException, k8s.ApiError, subprocess.CalledProcessError )
+
+
+class Timeout(Exception):
+    """Raised when conditions are not ready by their deadlines."""
+
+
+class Condition(object):
+    """A named readiness check.
+
+    The check returns a truthy value once ready (e.g. True or an IP address)
+    and a falsy value otherwise. The given transient errors count as "not
+    ready yet"; other exceptions are raised."""
+
+    def __init__(self, name, check, timeout=600, interval=1, max_interval=30, factor=1.6, transient=TRANSIENT_ERRORS):
+        self.name = name
+        self.check = check
+        self.transient = transient
+        self.timeout = timeout
+        self.interval = interval
+        self.max_interval = max_interval
+        self.factor = factor
+        self.value = None
+        self.error = None
+        self.ready = False
+
+    def backoff(self):
+        """Return the delay before the next poll, and grow the interval."""
+        delay = self.interval * random.uniform(0.5, 1.0)
+        self.interval = min(self.interval * self.factor, self.max_interval)
+        return delay
+
+
+def until(*conditions, **kwargs):
+    """Poll conditions until all of them are ready, and return their values
+    keyed by name. Raise Timeout if any condition misses its deadline, and
+    raise the errors of checks that are not transient.
+
+    Progress is written to the given stream (stdout by default)."""
+    stream = kwargs.get("stream", sys.stdout)
+    start = time.time()
+    pending = { condition.name: condition for condition in conditions }
+    due = { condition.name: start for condition in conditions }
+    results = {}
+    label = len(conditions) > 1
+
+    def progress(text):
+        if stream:
+            stream.write(text)
+            stream.flush()
+
+    def poll(condition):
+        try:
+            return condition.check(), None
+        except condition.transient as e:
+            return None, e
+
+    progress("...")
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=max(len(conditions), 1))
+    try:
+        with trace.phase("wait {}".format(", ".join(sorted(pending))), "wait"):
+            while pending:
+                now = time.time()
+                polling = [ pending[name] for name in sorted(pending) if due[name] <= now ]
+                futures = [ executor.submit(trace.inherit(poll), condition) for condition in polling ]
+                became_ready = False
+                for condition, future in zip(polling, futures):
+                    try:
+                        value, error = future.result()
+                    except Exception:
+                        progress("failed.\n")
+                        raise
+                    condition.error = error
+                    if value:
+                        condition.ready = True
+                        condition.value = value
+                        results[condition.name] = value
+                        del pending[condition.name]
+                        became_ready = True
+                        detail = "ready." if value is True else "ready: {}".format(value)
+                        progress("{}{}\n".format("{} ".format(condition.name) if label else "", detail))
+                        if pending:
+                            progress("...")
+                    else:
+                        due[condition.name] = time.time() + condition.backoff()
+                now = time.time()
+                late = [ condition for condition in pending.values() if now - start > condition.timeout ]
+                if late:
+                    progress("timed out.\n")
+                    raise Timeout("Not ready in time: {}".format(", ".join(
+                        "{}{}".format(condition.name, " (last error: {})".format(condition.error) if condition.error else "")
+                        for condition in late
+                    )))
+                if pending:
+                    if polling and not became_ready:
+                        progress(".")
+                    time.sleep(max(0, min(due[name] for name in pending) - time.time()))
+    finally:
+        executor.shutdown(wait=False)
+    return results
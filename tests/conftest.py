@@ -0,0 +1,21 @@
+# coding: utf-8
+"""
+Make the ctb package importable from the source tree, with an empty .env
+file in a temporary BASEDIR, so that the tests never read or write the .env
+file of the checkout.
+"""
+
+# Standard packages
+import atexit
+import os
+import shutil
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src"))
+
+_basedir = tempfile.mkdtemp(prefix="ctb-tests-")
+atexit.register(shutil.rmtree, _basedir, True)
+open(os.path.join(_basedir, ".env"), "w").close()
+os.environ["BASEDIR"] = _basedir
+os.environ["ENVFILE"] = os.path.join(_basedir, ".env")
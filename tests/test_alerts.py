@@ -0,0 +1,116 @@
+# coding: utf-8
+
+# Standard packages
+import copy
+
+# Third-party packages
+import pytest
+
+# Proprietary packages
+from ctb import alerts
+
+
+PAYLOAD = {
+    "name": "High Latency - frontend",
+    "alertTypeId": "apm.transaction_duration",
+    "consumer": "apm",
+    "enabled": False,
+    "schedule": { "interval": "10s" },
+    "throttle": "5m",
+    "params": { "threshold": "500", "serviceName": "frontend" },
+    "actions": [ { "id": "slack", "group": "threshold_met", "params": { "message": "Latency" } } ],
+    "tags": [ "apm", "ctb.hash:0123456789ab" ]
+}
+
+
+class Response(object):
+
+    def __init__(self, status_code, body):
+        self.status_code = status_code
+        self.body = body
+        self.content = str(body).encode("utf-8")
+
+    def json(self):
+        return self.body
+
+
+class Kibana(object):
+    """A Kibana API that serves alerts from _find, a page at a time."""
+
+    def __init__(self, saved_alerts, errors=None):
+        self.saved_alerts = saved_alerts
+        self.errors = list(errors or [])
+        self.requests = []
+
+    def get(self, url, params=None):
+        self.requests.append(( url, params ))
+        if self.errors:
+            status_code = self.errors.pop(0)
+            return Response(status_code, { "statusCode": status_code })
+        page, per_page = params["page"], params["per_page"]
+        data = self.saved_alerts[(page - 1) * per_page:page * per_page]
+        return Response(200, { "page": page, "per_page": per_page, "total": len(self.saved_alerts), "data": data })
+
+
+@pytest.fixture
+def kibana(monkeypatch):
+    monkeypatch.setattr(alerts.wait.Condition, "backoff", lambda self: 0)
+    def install(saved_alerts, errors=None):
+        kibana = Kibana(saved_alerts, errors)
+        monkeypatch.setattr(alerts.http, "kibana", lambda: kibana)
+        return kibana
+    return install
+
+def test_inventory_indexes_every_page(kibana):
+    saved_alerts = [
+        { "id": alerts.kibana_alert_id("latency", "frontend"), "name": "Renamed in Kibana" },
+        { "id": alerts.kibana_alert_id("error-rate", "cartservice"), "name": "High Error Rate - cartService" },
+        { "id": "3", "name": "High Latency - frontend" }
+    ] + [ { "id": "other-{}".format(n), "name": "Other {}".format(n) } for n in range(150) ]
+    api = kibana(saved_alerts)
+    index = alerts.inventory()
+    assert index[( "latency", "frontend" )]["name"] == "Renamed in Kibana"
+    assert index[( "error-rate", "cartservice" )]["name"] == "High Error Rate - cartService"
+    assert len(index) == 2
+    assert [ params["page"] for url, params in api.requests ] == [ 1, 2 ]
+
+def test_find_all_retries_a_failed_page(kibana):
+    api = kibana([ { "id": "1" } ], errors=[ 503, 429 ])
+    assert alerts.find_all() == [ { "id": "1" } ]
+    assert len(api.requests) == 3
+
+def test_find_all_raises_client_errors(kibana):
+    api = kibana([ { "id": "1" } ], errors=[ 403 ])
+    with pytest.raises(Exception, match="403"):
+        alerts.find_all()
+    assert len(api.requests) == 1
+
+def test_payload_hash_ignores_key_order():
+    assert alerts.payload_hash({ "a": 1, "b": [ 1, 2 ] }) == alerts.payload_hash({ "b": [ 1, 2 ], "a": 1 })
+    assert alerts.payload_hash({ "a": 1 }) != alerts.payload_hash({ "a": 2 })
+
+def test_saved_hash_reads_the_hash_tag():
+    assert alerts.saved_hash({ "tags": [ "apm", alerts.HASH_TAG_PREFIX + "abc" ] }) == "abc"
+    assert alerts.saved_hash({ "tags": [ "apm" ] }) is None
+    assert alerts.saved_hash({}) is None
+
+def saved(payload):
+    """Return a saved alert as Kibana returns it for a payload."""
+    saved_alert = copy.deepcopy(payload)
+    saved_alert.update({ "id": "1", "enabled": True, "muteAll": False, "notifyWhen": "onThrottleInterval" })
+    saved_alert["params"]["threshold"] = 500
+    saved_alert["actions"][0]["actionTypeId"] = ".slack"
+    return saved_alert
+
+def test_saved_alert_matches_its_payload():
+    assert not alerts.drifted(PAYLOAD, saved(PAYLOAD))
+
+def test_edited_params_are_drift():
+    saved_alert = saved(PAYLOAD)
+    saved_alert["params"]["threshold"] = 900
+    assert alerts.drifted(PAYLOAD, saved_alert)
+
+def test_edited_actions_are_drift():
+    saved_alert = saved(PAYLOAD)
+    saved_alert["actions"].append({ "id": "email", "group": "threshold_met", "params": {} })
+    assert alerts.drifted(PAYLOAD, saved_alert)
@@ -0,0 +1,38 @@
+# coding: utf-8
+
+# Standard packages
+import json
+import re
+
+# Third-party packages
+import pytest
+
+# Proprietary packages
+from ctb import builds
+
+
+@pytest.fixture
+def skaffold(monkeypatch, tmp_path):
+    """Run a fake skaffold build that reports the given images as built."""
+    monkeypatch.setenv("BASEDIR", str(tmp_path))
+    monkeypatch.setattr(builds, "default_repo", lambda: "gcr.io/project")
+    def serve(built):
+        def cmd(command, stdout=True, input=None):
+            output = re.search(r"--file-output='([^']+)'", command).group(1)
+            with open(output, "w") as file:
+                json.dump({ "builds": [ { "imageName": image, "tag": "gcr.io/project/{}:abc".format(image) } for image in built ] }, file)
+            return 0
+        monkeypatch.setattr(builds, "cmd", cmd)
+    return serve
+
+def test_skaffold_build_returns_the_tags(skaffold):
+    skaffold([ "frontend", "cartservice" ])
+    assert builds.skaffold_build("stable", [ "frontend" ]) == {
+        "frontend": "gcr.io/project/frontend:abc",
+        "cartservice": "gcr.io/project/cartservice:abc"
+    }
+
+def test_skaffold_build_fails_on_unbuilt_images(skaffold):
+    skaffold([ "frontend" ])
+    with pytest.raises(Exception, match="skaffold build did not build cartservice for the 'stable' profile"):
+        builds.skaffold_build("stable", [ "frontend", "cartservice" ])
@@ -0,0 +1,98 @@
+# coding: utf-8
+
+# Standard packages
+import os
+
+# Third-party packages
+import pytest
+
+# Proprietary packages
+from ctb import cache
+
+
+@pytest.fixture(autouse=True)
+def clean(monkeypatch, tmp_path):
+    monkeypatch.setenv("BASEDIR", str(tmp_path))
+    monkeypatch.delenv("CTB_PROBE_CACHE", raising=False)
+    monkeypatch.setenv("PROBE_URL", "https://a")
+    cache.invalidate()
+    yield
+    cache.invalidate()
+
+def counted(name="probe", **kwargs):
+    """Return a cached probe that counts its calls, and the calls."""
+    calls = []
+    def probe(*args):
+        calls.append(args)
+        return len(calls)
+    probe.__name__ = name
+    return cache.cached(**kwargs)(probe), calls
+
+def test_results_are_cached_for_their_ttl(monkeypatch):
+    now = [ 1000.0 ]
+    monkeypatch.setattr(cache.time, "time", lambda: now[0])
+    probe, calls = counted(ttl=10)
+    assert probe() == 1
+    now[0] += 9
+    assert probe() == 1
+    now[0] += 2
+    assert probe() == 2
+
+def test_arguments_are_part_of_the_key():
+    probe, calls = counted(ttl=10)
+    probe("kibana")
+    probe("elasticsearch")
+    probe("kibana")
+    assert calls == [ ( "kibana", ), ( "elasticsearch", ) ]
+
+def test_scope_variables_are_part_of_the_key(monkeypatch):
+    probe, calls = counted(ttl=10, scope=( "PROBE_URL", ))
+    probe()
+    monkeypatch.setenv("PROBE_URL", "https://b")
+    probe()
+    assert len(calls) == 2
+
+def test_negative_results_are_not_cached_by_default():
+    results = [ False, True ]
+    @cache.cached(ttl=10)
+    def probe():
+        return results.pop(0)
+    assert probe() is False
+    assert probe() is True
+
+def test_negative_results_are_cached_on_request():
+    results = [ False, True ]
+    @cache.cached(ttl=10, negative=True)
+    def probe():
+        return results.pop(0)
+    assert probe() is False
+    assert probe() is False
+
+def test_invalidate_forgets_one_probe():
+    first, first_calls = counted("first", ttl=10)
+    second, second_calls = counted("second", ttl=10)
+    first()
+    second()
+    first.invalidate()
+    first()
+    second()
+    assert len(first_calls) == 2
+    assert len(second_calls) == 1
+
+def test_disk_cache_is_shared_and_keeps_no_secrets(monkeypatch):
+    monkeypatch.setenv("CTB_PROBE_CACHE", "disk")
+    monkeypatch.setenv("PROBE_PASSWORD", "hunter2")
+    probe, calls = counted(ttl=10, scope=( "PROBE_PASSWORD", ))
+    probe()
+    # Another invocation starts with an empty memory cache.
+    cache._entries.clear()
+    assert probe() == 1
+    assert len(calls) == 1
+    with open(cache.disk_path()) as file:
+        assert "hunter2" not in file.read()
+
+def test_disk_cache_skips_probes_that_opt_out(monkeypatch):
+    monkeypatch.setenv("CTB_PROBE_CACHE", "disk")
+    probe, calls = counted(ttl=10, disk=False)
+    probe()
+    assert not os.path.exists(cache.disk_path())
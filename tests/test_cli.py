@@ -0,0 +1,62 @@
+# coding: utf-8
+
+# Standard packages
+import importlib
+
+# Third-party packages
+import pytest
+
+# Proprietary packages
+import ctb
+from ctb import cli
+
+
+SCENARIOS = ( "stable", "slow-query", "traffic-spike" )
+
+COMMAND = cli.Command(
+    "diff", "ctb.commands.diff", None,
+    arguments=[
+        cli.Argument("scenario", choices=lambda: SCENARIOS, required=True),
+        cli.Argument("scenario_to", choices=lambda: SCENARIOS, default="stable")
+    ],
+    flags=[ cli.Flag("quiet", "-q", "--quiet") ]
+)
+
+MANY = cli.Command(
+    "setup", "ctb.commands.setup", None,
+    arguments=[ cli.Argument("targets", choices=( "ess", "gke" ), many=True) ],
+    flags=[ cli.Flag("dev", "-d", "--dev") ]
+)
+
+
+def test_parse_arguments_defaults_and_flags():
+    assert COMMAND.parse([ "slow-query" ]) == { "scenario": "slow-query", "scenario_to": "stable", "quiet": False }
+    assert COMMAND.parse([ "-q", "slow-query", "traffic-spike" ]) == { "scenario": "slow-query", "scenario_to": "traffic-spike", "quiet": True }
+
+def test_parse_many():
+    assert MANY.parse([]) == { "targets": [], "dev": False }
+    assert MANY.parse([ "gke", "--dev", "ess" ]) == { "targets": [ "gke", "ess" ], "dev": True }
+
+@pytest.mark.parametrize("argv, message", [
+    ( [], "Missing argument" ),
+    ( [ "nope" ], "Invalid scenario" ),
+    ( [ "stable", "--loud" ], "Unknown option" ),
+    ( [ "stable", "slow-query", "extra" ], "Unexpected arguments" )
+])
+def test_parse_rejects_bad_command_lines(argv, message):
+    with pytest.raises(cli.UsageError, match=message):
+        COMMAND.parse(argv)
+
+def test_complete_commands_arguments_and_flags():
+    commands = [ COMMAND, MANY ]
+    assert cli.complete(commands, [ "" ], 1) == [ "diff", "setup" ]
+    assert cli.complete(commands, [ "diff", "" ], 2) == sorted(SCENARIOS)
+    assert cli.complete(commands, [ "diff", "stable", "" ], 3) == sorted(SCENARIOS)
+    assert cli.complete(commands, [ "diff", "stable", "slow-query", "" ], 4) == []
+    assert cli.complete(commands, [ "diff", "-" ], 2) == [ "--quiet", "-q" ]
+    assert cli.complete(commands, [ "setup", "ess", "" ], 3) == [ "ess", "gke" ]
+    assert cli.complete(commands, [ "unknown", "" ], 2) == []
+
+def test_every_command_module_has_a_runner():
+    for command in ctb.COMMANDS:
+        assert callable(getattr(importlib.import_module(command.module), "run")), command.name
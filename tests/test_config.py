@@ -0,0 +1,63 @@
+# coding: utf-8
+
+# Standard packages
+import os
+
+# Proprietary packages
+from ctb import config
+
+
+def write(tmp_path, text):
+    path = tmp_path / ".env"
+    path.write_text(text)
+    return str(path)
+
+def test_parses_variables_once(tmp_path):
+    envfile = config.EnvFile(write(tmp_path, "# Comment\nA=1\n\nB=two words\nEMPTY=\n"))
+    assert envfile.get("A") == "1"
+    assert envfile.get("B") == "two words"
+    assert "EMPTY" in envfile
+    assert not envfile.is_set("EMPTY")
+    assert envfile.is_set("A")
+    assert envfile.get("MISSING") is None
+
+def test_set_updates_in_place_and_preserves_layout(tmp_path):
+    path = write(tmp_path, "# Comment\nA=1\n\nB=2\n")
+    envfile = config.EnvFile(path)
+    assert envfile.set("A", "10")
+    assert envfile.flush()
+    with open(path) as file:
+        assert file.read() == "# Comment\nA=10\n\nB=2\n"
+
+def test_set_appends_missing_variables(tmp_path):
+    path = write(tmp_path, "A=1")
+    envfile = config.EnvFile(path)
+    envfile.set("C", "3")
+    envfile.flush()
+    with open(path) as file:
+        assert file.read() == "A=1\nC=3\n"
+
+def test_flush_skips_unchanged_files(tmp_path):
+    path = write(tmp_path, "A=1\n")
+    envfile = config.EnvFile(path)
+    assert not envfile.set("A", "1")
+    before = os.stat(path).st_mtime_ns
+    assert not envfile.flush()
+    assert os.stat(path).st_mtime_ns == before
+
+def test_flush_replaces_the_file_atomically(tmp_path):
+    path = write(tmp_path, "A=1\n")
+    os.chmod(path, 0o600)
+    envfile = config.EnvFile(path)
+    envfile.set("A", "2")
+    envfile.flush()
+    # The file keeps its mode, and no temporary file is left behind.
+    assert os.stat(path).st_mode & 0o777 == 0o600
+    assert sorted(os.listdir(str(tmp_path))) == [ ".env" ]
+    assert config.EnvFile(path).get("A") == "2"
+
+def test_sync_copies_values_of_defined_variables(tmp_path):
+    envfile = config.EnvFile(write(tmp_path, "A=1\nB=2\n"))
+    assert envfile.sync({ "A": "1", "B": "20", "C": "30" })
+    assert envfile.get("B") == "20"
+    assert "C" not in envfile
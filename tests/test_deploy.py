@@ -0,0 +1,138 @@
+# coding: utf-8
+
+# Standard packages
+import copy
+import json
+
+# Third-party packages
+import pytest
+
+# Proprietary packages
+from ctb import deploy
+from ctb import k8s
+
+
+OBJECTS = [
+    {
+        "apiVersion": "apps/v1",
+        "kind": "Deployment",
+        "metadata": { "name": "frontend" },
+        "spec": { "template": { "spec": { "containers": [ { "name": "server", "image": "frontend" } ] } } }
+    },
+    {
+        "apiVersion": "v1",
+        "kind": "Service",
+        "metadata": { "name": "frontend", "namespace": "default" },
+        "spec": { "ports": [ { "port": 80 } ] }
+    },
+    {
+        "apiVersion": "rbac.authorization.k8s.io/v1",
+        "kind": "ClusterRole",
+        "metadata": { "name": "metricbeat" }
+    }
+]
+
+
+class Config(object):
+    namespace = "default"
+
+
+@pytest.fixture
+def artifacts(monkeypatch, tmp_path):
+    monkeypatch.setenv("DEPLOYMENT_NAME", "test")
+    monkeypatch.setattr(deploy, "objects", lambda scenario: copy.deepcopy(OBJECTS))
+    monkeypatch.setattr(k8s, "config", lambda: Config())
+    path = tmp_path / "artifacts.json"
+    path.write_text(json.dumps({ "builds": [ { "imageName": "frontend", "tag": "gcr.io/project/frontend:abc" } ] }))
+    return str(path)
+
+def live(rendered, **overrides):
+    """Return a fake k8s.objects() serving the rendered objects as live, with
+    the given content hashes overridden by key."""
+    def objects(kind, label_selector=None, api_version=None, **kwargs):
+        assert label_selector == "skaffold.dev/run-id=ctb-test"
+        items = []
+        for name, obj in rendered.items():
+            if obj["kind"] == kind and name not in overrides.get("missing", ()):
+                obj = copy.deepcopy(obj)
+                if name in overrides.get("stale", ()):
+                    obj["metadata"]["annotations"][deploy.HASH_ANNOTATION] = "stale"
+                items.append(k8s.typed(obj))
+        return items
+    return objects
+
+def test_changes_compares_hashes_by_key():
+    assert deploy.changes({ "a": "1", "b": "2", "c": "3" }, { "a": "1", "b": "0" }) == [ "b", "c" ]
+
+def test_hashes_are_stable_and_content_based():
+    first = deploy.hashes(OBJECTS)
+    assert first == deploy.hashes(copy.deepcopy(OBJECTS))
+    changed = copy.deepcopy(OBJECTS)
+    changed[1]["spec"]["ports"][0]["port"] = 8080
+    assert deploy.changes(deploy.hashes(changed), first) == [ "Service/default/frontend" ]
+
+def test_render_sets_images_labels_namespaces_and_hashes(artifacts):
+    rendered = deploy.render("stable", artifacts)
+    assert sorted(rendered) == [ "ClusterRole//metricbeat", "Deployment/default/frontend", "Service/default/frontend" ]
+    deployment = rendered["Deployment/default/frontend"]
+    assert deployment["spec"]["template"]["spec"]["containers"][0]["image"] == "gcr.io/project/frontend:abc"
+    assert deployment["metadata"]["labels"][deploy.RUN_ID_LABEL] == "ctb-test"
+    assert "namespace" not in rendered["ClusterRole//metricbeat"]["metadata"]
+    # The annotation is the hash of the object without it.
+    for obj in rendered.values():
+        obj = copy.deepcopy(obj)
+        digest = obj["metadata"]["annotations"].pop(deploy.HASH_ANNOTATION)
+        if not obj["metadata"]["annotations"]:
+            del obj["metadata"]["annotations"]
+        assert digest == deploy.object_hash(obj)
+
+def test_plan_returns_nothing_when_the_cluster_is_up_to_date(monkeypatch, artifacts):
+    monkeypatch.setattr(k8s, "objects", live(deploy.render("stable", artifacts)))
+    assert deploy.plan("stable", artifacts) == []
+
+def test_plan_returns_stale_and_missing_objects(monkeypatch, artifacts):
+    rendered = deploy.render("stable", artifacts)
+    monkeypatch.setattr(k8s, "objects", live(rendered, stale=( "Service/default/frontend", ), missing=( "ClusterRole//metricbeat", )))
+    assert [ deploy.key(obj) for obj in deploy.plan("stable", artifacts) ] == [ "ClusterRole//metricbeat", "Service/default/frontend" ]
+
+def test_plan_applies_everything_to_a_new_cluster(monkeypatch, artifacts):
+    monkeypatch.setattr(k8s, "objects", lambda kind, **kwargs: [])
+    assert len(deploy.plan("stable", artifacts)) == len(OBJECTS)
+
+def test_an_unchanged_second_run_applies_nothing(monkeypatch, artifacts):
+    cluster = {}
+    def objects(kind, label_selector=None, api_version=None, **kwargs):
+        return [ k8s.typed(copy.deepcopy(obj)) for obj in cluster.values() if obj["kind"] == kind ]
+    def apply(obj):
+        cluster[deploy.key(obj)] = copy.deepcopy(obj)
+    monkeypatch.setattr(k8s, "objects", objects)
+    monkeypatch.setattr(k8s, "apply", apply)
+    deploy.apply(deploy.plan("stable", artifacts), "stable")
+    assert len(cluster) == len(OBJECTS)
+    assert deploy.plan("stable", artifacts) == []
+    # A change to one object plans that object only.
+    changed = copy.deepcopy(OBJECTS)
+    changed[1]["spec"]["ports"][0]["port"] = 8080
+    monkeypatch.setattr(deploy, "objects", lambda scenario: copy.deepcopy(changed))
+    assert [ deploy.key(obj) for obj in deploy.plan("stable", artifacts) ] == [ "Service/default/frontend" ]
+
+def test_apply_adopts_objects_that_skaffold_created(monkeypatch, artifacts):
+    rendered = deploy.render("stable", artifacts)
+    skaffold = copy.deepcopy(rendered["Deployment/default/frontend"])
+    skaffold["metadata"]["annotations"] = { "kubectl.kubernetes.io/last-applied-configuration": "{}" }
+    skaffold["metadata"]["managedFields"] = [ { "manager": "kubectl-client-side-apply", "operation": "Update", "fieldsV1": {} } ]
+    monkeypatch.setattr(k8s, "objects", lambda kind, **kwargs: [ k8s.typed(skaffold) ] if kind == "Deployment" else [])
+    calls = []
+    monkeypatch.setattr(k8s, "adopt", lambda obj, api_version=None: calls.append(( "adopt", obj.name )) or True)
+    monkeypatch.setattr(k8s, "apply", lambda obj: calls.append(( "apply", obj["metadata"]["name"] )))
+    deploy.apply([ rendered["Deployment/default/frontend"] ], "stable")
+    assert calls == [ ( "adopt", "frontend" ), ( "apply", "frontend" ) ]
+
+def test_apply_reports_the_failing_object(monkeypatch, artifacts):
+    def apply(obj):
+        raise k8s.ApiError(422, "invalid")
+    monkeypatch.setattr(k8s, "apply", apply)
+    monkeypatch.setattr(k8s, "objects", lambda kind, **kwargs: [])
+    objects = list(deploy.render("stable", artifacts).values())
+    with pytest.raises(Exception, match="Failed to apply Deployment/default/frontend for the 'stable' scenario: 422 invalid"):
+        deploy.apply(objects, "stable")
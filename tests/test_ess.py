@@ -0,0 +1,82 @@
+# coding: utf-8
+
+# Third-party packages
+import pytest
+
+# Proprietary packages
+from ctb import ess
+from ctb import http
+
+
+DEPLOYMENT = {
+    "id": "abc",
+    "name": "ctb-test",
+    "resources": {
+        "elasticsearch": [ {
+            "ref_id": "main-elasticsearch",
+            "info": {
+                "status": "started",
+                "plan_info": { "healthy": True, "current": { "plan": {} } },
+                "metadata": { "service_url": "https://es", "cloud_id": "ctb:abc" }
+            }
+        } ],
+        "kibana": [ { "ref_id": "main-kibana", "info": { "metadata": { "service_url": "https://kibana" } } } ],
+        "apm": [ { "ref_id": "main-apm", "info": { "plan_info": { "healthy": True } } } ]
+    }
+}
+
+
+class Response(object):
+
+    def __init__(self, status_code, body=None):
+        self.status_code = status_code
+        self.body = body
+
+    def json(self):
+        return self.body
+
+
+class Session(object):
+    """An ESS API that answers every request with the given response."""
+
+    def __init__(self, response):
+        self.response = response
+        self.requests = []
+
+    def get(self, url, params=None):
+        self.requests.append(url)
+        return self.response
+
+
+@pytest.fixture
+def session(monkeypatch):
+    monkeypatch.setenv("ELASTIC_CLOUD_DEPLOYMENT_ID", "abc")
+    def serve(response):
+        session = Session(response)
+        monkeypatch.setattr(http, "ess", lambda: session)
+        ess.deployment.invalidate()
+        return session
+    yield serve
+    ess.deployment.invalidate()
+
+def test_deployment_describes_every_component(session):
+    requests = session(Response(200, DEPLOYMENT)).requests
+    deployment = ess.deployment()
+    assert requests == [ "/deployments/abc" ]
+    assert deployment.status() == "started"
+    assert deployment.healthy("elasticsearch")
+    assert not deployment.healthy("apm")
+    assert deployment.cloud_id() == "ctb:abc"
+    assert deployment.endpoint("kibana") == "https://kibana"
+    assert deployment.endpoints() is None
+
+@pytest.mark.parametrize("status_code", [ 404, 410 ])
+def test_missing_deployments_are_none(session, status_code):
+    session(Response(status_code))
+    assert ess.deployment() is None
+
+@pytest.mark.parametrize("status_code", [ 401, 503 ])
+def test_other_errors_raise(session, status_code):
+    session(Response(status_code))
+    with pytest.raises(Exception):
+        ess.deployment()
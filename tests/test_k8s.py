@@ -0,0 +1,149 @@
+# coding: utf-8
+
+# Standard packages
+import json
+
+# Third-party packages
+import pytest
+
+# Proprietary packages
+from ctb import k8s
+
+
+def deployment(generation=2, **status):
+    return k8s.typed({
+        "kind": "Deployment",
+        "metadata": { "name": "frontend", "namespace": "default", "generation": generation },
+        "spec": { "replicas": 2 },
+        "status": status
+    })
+
+def test_typed_wraps_objects_in_the_class_of_their_kind():
+    assert isinstance(k8s.typed({ "kind": "Deployment" }), k8s.Deployment)
+    service = k8s.typed({ "metadata": { "name": "frontend" } }, "Service")
+    assert isinstance(service, k8s.Service)
+    assert service.kind == "Service"
+    assert type(k8s.typed({ "kind": "ConfigMap" })) is k8s.Object
+
+def test_path_of_namespaced_and_cluster_kinds():
+    assert k8s.path("Deployment", "default", "frontend") == "/apis/apps/v1/namespaces/default/deployments/frontend"
+    assert k8s.path("Service") == "/api/v1/services"
+
+def test_deployment_is_available_once_rolled_out():
+    assert deployment(observedGeneration=2, replicas=2, updatedReplicas=2, availableReplicas=2).is_available()
+
+def test_deployment_is_not_available_before_its_generation_is_observed():
+    assert not deployment(observedGeneration=1, replicas=2, updatedReplicas=2, availableReplicas=2).is_available()
+
+def test_deployment_is_not_available_while_old_replicas_remain():
+    # Mid-rollout with a surge: one old and one updated replica, both available.
+    assert not deployment(observedGeneration=2, replicas=3, updatedReplicas=2, availableReplicas=2).is_available()
+    assert not deployment(observedGeneration=2, replicas=2, updatedReplicas=1, availableReplicas=1).is_available()
+
+def test_deployment_is_not_available_until_updated_replicas_are():
+    assert not deployment(observedGeneration=2, replicas=2, updatedReplicas=2, availableReplicas=1).is_available()
+
+def test_api_errors_carry_the_status():
+    error = k8s.ApiError(403, "forbidden")
+    assert error.status == 403
+    assert str(error) == "403 forbidden"
+
+@pytest.mark.parametrize("status", [ 401, 403, 404 ])
+def test_follow_raises_client_errors(monkeypatch, status):
+    def query(kind, label_selector=None):
+        raise k8s.ApiError(status, "denied")
+    monkeypatch.setattr(k8s, "query", query)
+    with pytest.raises(k8s.ApiError, match=str(status)):
+        k8s.follow("Deployment", lambda event, obj: None)
+
+def test_follow_lists_again_when_the_watch_expires(monkeypatch):
+    handled = []
+    def query(kind, label_selector=None):
+        return { "metadata": { "resourceVersion": "1" }, "items": [] }
+    def watch(kind, label_selector=None, resource_version=None, timeout=None):
+        if not handled:
+            raise k8s.ApiError(410, "Gone")
+        yield "MODIFIED", k8s.typed({ "metadata": { "name": "frontend", "resourceVersion": "2" } }, kind)
+    monkeypatch.setattr(k8s, "query", query)
+    monkeypatch.setattr(k8s, "watch", watch)
+    monkeypatch.setattr(k8s.time, "sleep", lambda seconds: handled.append(( "relisted", None )))
+    k8s.follow("Deployment", lambda event, obj: handled.append(( event, obj.name )), done=lambda: ( "MODIFIED", "frontend" ) in handled)
+    assert handled == [ ( "relisted", None ), ( "MODIFIED", "frontend" ) ]
+
+def test_follow_backs_off_while_listing_fails(monkeypatch):
+    delays = []
+    errors = [ k8s.ApiError(500, "down") ] * 3
+    handled = []
+    def query(kind, label_selector=None):
+        if errors:
+            raise errors.pop()
+        return { "metadata": { "resourceVersion": "1" }, "items": [ { "metadata": { "name": "frontend" } } ] }
+    monkeypatch.setattr(k8s, "query", query)
+    monkeypatch.setattr(k8s.time, "sleep", delays.append)
+    k8s.follow("Deployment", lambda event, obj: handled.append(( event, obj.name )), done=lambda: bool(handled))
+    assert delays == [ 1, 2, 4 ]
+    assert handled == [ ( "ADDED", "frontend" ) ]
+
+class Client(object):
+    """An API server that accepts every patch, and records them."""
+
+    def __init__(self):
+        self.patches = []
+
+    def patch(self, url, params=None, headers=None, data=None):
+        self.patches.append(( url, headers["Content-Type"], json.loads(data) ))
+        return Response(200, {})
+
+
+class Response(object):
+
+    def __init__(self, status_code, body):
+        self.status_code = status_code
+        self.body = body
+
+    def json(self):
+        return self.body
+
+
+def managed(*entries):
+    return k8s.typed({
+        "kind": "Deployment",
+        "metadata": { "name": "frontend", "namespace": "default", "resourceVersion": "7", "managedFields": list(entries) }
+    })
+
+def test_adopt_transfers_client_side_apply_fields(monkeypatch):
+    client = Client()
+    monkeypatch.setattr(k8s, "client", lambda: client)
+    obj = managed(
+        { "manager": "kubectl-client-side-apply", "operation": "Update", "apiVersion": "apps/v1", "fieldsType": "FieldsV1",
+          "fieldsV1": { "f:metadata": { "f:annotations": { "f:kubectl.kubernetes.io/last-applied-configuration": {} } }, "f:spec": { "f:paused": {} } } },
+        { "manager": "ctb", "operation": "Apply", "apiVersion": "apps/v1", "fieldsType": "FieldsV1",
+          "fieldsV1": { "f:spec": { "f:replicas": {} } } },
+        { "manager": "kube-controller-manager", "operation": "Update", "subresource": "status", "fieldsV1": { "f:status": {} } }
+    )
+    assert k8s.adopt(obj)
+    [ ( url, content_type, patch ) ] = client.patches
+    assert url == "/apis/apps/v1/namespaces/default/deployments/frontend"
+    assert content_type == "application/json-patch+json"
+    assert patch[0] == { "op": "test", "path": "/metadata/resourceVersion", "value": "7" }
+    managers = { entry["manager"]: entry for entry in patch[1]["value"] }
+    assert sorted(managers) == [ "ctb", "kube-controller-manager" ]
+    assert managers["ctb"]["fieldsV1"] == {
+        "f:metadata": { "f:annotations": { "f:kubectl.kubernetes.io/last-applied-configuration": {} } },
+        "f:spec": { "f:paused": {}, "f:replicas": {} }
+    }
+    # The live object is left as it was read.
+    assert len(obj.metadata["managedFields"]) == 3
+
+def test_adopt_creates_the_field_manager(monkeypatch):
+    client = Client()
+    monkeypatch.setattr(k8s, "client", lambda: client)
+    assert k8s.adopt(managed({ "manager": "before-first-apply", "operation": "Update", "fieldsV1": { "f:spec": {} } }))
+    [ entry ] = client.patches[0][2][1]["value"]
+    assert ( entry["manager"], entry["operation"], entry["apiVersion"], entry["fieldsV1"] ) == ( "ctb", "Apply", "apps/v1", { "f:spec": {} } )
+
+def test_adopt_leaves_server_side_applied_objects(monkeypatch):
+    client = Client()
+    monkeypatch.setattr(k8s, "client", lambda: client)
+    assert not k8s.adopt(managed({ "manager": "ctb", "operation": "Apply", "fieldsV1": {} }))
+    assert client.patches == []
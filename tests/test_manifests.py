@@ -0,0 +1,108 @@
+# coding: utf-8
+
+# Standard packages
+import os
+
+# Third-party packages
+import pytest
+
+# Proprietary packages
+from ctb import manifests
+
+
+SKAFFOLD = """
+profiles:
+- name: stable
+  deploy:
+    kubectl:
+      manifests:
+      - hipstershop/stable/*.yaml
+"""
+
+FRONTEND = """
+apiVersion: apps/v1
+kind: Deployment
+metadata:
+  name: frontend
+spec:
+  template:
+    spec:
+      containers:
+      - name: server
+        image: frontend
+---
+apiVersion: v1
+kind: Service
+metadata:
+  name: frontend
+"""
+
+SCENARIO = """
+apiVersion: v1
+kind: ConfigMap
+metadata:
+  name: flags
+  namespace: default
+"""
+
+
+@pytest.fixture
+def basedir(monkeypatch, tmp_path):
+    """A BASEDIR with a skaffold profile and a scenario, and a counter of the
+    files parsed."""
+    monkeypatch.setenv("BASEDIR", str(tmp_path))
+    monkeypatch.setattr(manifests, "_index", None)
+    (tmp_path / "skaffold.yaml").write_text(SKAFFOLD)
+    (tmp_path / "hipstershop" / "stable").mkdir(parents=True)
+    (tmp_path / "hipstershop" / "stable" / "frontend.yaml").write_text(FRONTEND)
+    scenario = tmp_path / "hipstershop" / "scenarios" / "latency" / "kubernetes-manifests"
+    scenario.mkdir(parents=True)
+    (scenario / "flags.yaml").write_text(SCENARIO)
+    parsed = []
+    parse = manifests.parse
+    def counted(relpath):
+        parsed.append(relpath)
+        return parse(relpath)
+    monkeypatch.setattr(manifests, "parse", counted)
+    return tmp_path, parsed
+
+def test_index_records_the_objects_of_every_manifest(basedir):
+    index = manifests.index()
+    assert index.scenarios() == [ "stable" ]
+    assert [ ( obj["kind"], obj["name"], obj["images"] ) for obj in index.profile_objects("stable") ] == [
+        ( "Deployment", "frontend", [ "frontend" ] ),
+        ( "Service", "frontend", [] )
+    ]
+    assert [ obj["name"] for obj in index.objects(scenario="latency") ] == [ "flags" ]
+    assert [ obj["name"] for obj in index.objects(kind="Service") ] == [ "frontend" ]
+    with pytest.raises(Exception, match="Unknown scenario: missing"):
+        index.profile_objects("missing")
+
+def test_index_parses_only_changed_files(monkeypatch, basedir):
+    tmp_path, parsed = basedir
+    manifests.index()
+    assert len(parsed) == 2
+    # A new process reads the cache and parses nothing.
+    monkeypatch.setattr(manifests, "_index", None)
+    manifests.index()
+    assert len(parsed) == 2
+    path = tmp_path / "hipstershop" / "stable" / "frontend.yaml"
+    path.write_text(FRONTEND.replace("name: frontend\nspec", "name: web\nspec"))
+    os.utime(path, ns=( 0, 0 ))
+    index = manifests.index()
+    assert parsed[2:] == [ os.path.join("hipstershop", "stable", "frontend.yaml") ]
+    assert index.profile_objects("stable")[0]["name"] == "web"
+
+def test_index_forgets_removed_files(basedir):
+    tmp_path, parsed = basedir
+    manifests.index()
+    os.remove(tmp_path / "hipstershop" / "scenarios" / "latency" / "kubernetes-manifests" / "flags.yaml")
+    assert manifests.index().objects(scenario="latency") == []
+
+def test_index_rejects_values_that_json_cant_represent(basedir):
+    tmp_path, parsed = basedir
+    (tmp_path / "hipstershop" / "stable" / "frontend.yaml").write_text(FRONTEND + "data:\n  released: 2021-04-01\n")
+    with pytest.raises(Exception, match="frontend.yaml has a value that JSON can't represent"):
+        manifests.index()
+    assert manifests._index is None
+    assert not os.path.exists(manifests.cache_path())
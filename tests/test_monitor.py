@@ -0,0 +1,40 @@
+# coding: utf-8
+
+# Standard packages
+import time
+
+# Proprietary packages
+from ctb import monitor
+
+
+class Clock(object):
+    """A time module that stops the engine when the loop first reads it."""
+
+    def __init__(self, engine):
+        self.engine = engine
+
+    def time(self):
+        self.engine.stop()
+        return time.time()
+
+
+def test_loop_exits_when_stopped_before_submitting(monkeypatch):
+    source = monitor.Source("cluster", lambda: "ok")
+    engine = monitor.Engine([ source ])
+    monkeypatch.setattr(monitor, "time", Clock(engine))
+    engine.loop()
+    assert not source.polling
+    assert engine.stopped.is_set()
+
+def test_engine_polls_sources_until_stopped():
+    engine = monitor.Engine([ monitor.Source("cluster", lambda: "ok"), monitor.Source("alerts", lambda: 1 / 0) ]).start()
+    assert engine.changed.wait(5)
+    deadline = time.time() + 5
+    while time.time() < deadline and None in [ source.updated for source in engine.sources.values() ]:
+        time.sleep(0.01)
+    engine.stop()
+    engine.thread.join(5)
+    assert not engine.thread.is_alive()
+    snapshot = engine.snapshot()
+    assert snapshot["cluster"] == ( "ok", None )
+    assert isinstance(snapshot["alerts"][1], ZeroDivisionError)
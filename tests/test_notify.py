@@ -0,0 +1,99 @@
+# coding: utf-8
+
+# Standard packages
+import threading
+
+# Third-party packages
+import pytest
+import requests
+
+# Proprietary packages
+from ctb import http
+from ctb import notify
+
+
+class Response(object):
+
+    def __init__(self, status_code, headers=None):
+        self.status_code = status_code
+        self.headers = headers or {}
+        self.text = ""
+
+
+class Client(object):
+    """A webhook that answers with the given status codes (or raises the
+    given errors) in turn, then 200, and records the payloads posted."""
+
+    def __init__(self, status_codes=()):
+        self.status_codes = list(status_codes)
+        self.posted = []
+        self.lock = threading.Lock()
+
+    def post(self, url=None, json=None, timeout=None):
+        with self.lock:
+            self.posted.append(json["text"])
+            status_code = self.status_codes.pop(0) if self.status_codes else 200
+        if isinstance(status_code, Exception):
+            raise status_code
+        return Response(status_code)
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(notify.time, "sleep", lambda seconds: None)
+    def serve(*status_codes):
+        client = Client(status_codes)
+        monkeypatch.setattr(http, "client", lambda: client)
+        return client
+    yield serve
+    notify.flush(timeout=5)
+
+def test_messages_are_delivered_in_order(client):
+    client = client()
+    for text in [ "a", "b", "c" ]:
+        notify.slack(text, url="https://hooks.slack.com/x")
+    assert notify.flush(timeout=5)
+    assert client.posted == [ "a", "b", "c" ]
+
+def test_server_errors_are_retried(client):
+    client = client(503, 500)
+    notify.slack("a", url="https://hooks.slack.com/x")
+    assert notify.flush(timeout=5)
+    assert client.posted == [ "a", "a", "a" ]
+
+def test_client_errors_are_not_retried(client, capsys):
+    client = client(404)
+    notify.slack("a", url="https://hooks.slack.com/x")
+    notify.slack("b", url="https://hooks.slack.com/x")
+    assert notify.flush(timeout=5)
+    assert client.posted == [ "a", "b" ]
+    assert "Slack notification failed: 404" in capsys.readouterr().err
+
+def test_connection_errors_are_retried(client):
+    client = client(requests.exceptions.ConnectionError("refused"))
+    notify.slack("a", url="https://hooks.slack.com/x")
+    assert notify.flush(timeout=5)
+    assert client.posted == [ "a", "a" ]
+
+def test_read_timeouts_are_not_retried(client, capsys):
+    client = client(requests.exceptions.ReadTimeout("slow"))
+    notify.slack("a", url="https://hooks.slack.com/x")
+    assert notify.flush(timeout=5)
+    assert client.posted == [ "a" ]
+    assert "Slack notification failed: slow" in capsys.readouterr().err
+
+def test_messages_without_a_webhook_are_skipped(monkeypatch, client, capsys):
+    client = client()
+    monkeypatch.delenv("SLACK_WEBHOOK_URL", raising=False)
+    notify.slack("a")
+    assert notify.flush(timeout=5)
+    assert client.posted == []
+    assert "SLACK_WEBHOOK_URL is not set" in capsys.readouterr().err
+
+def test_unexpected_errors_do_not_stop_the_worker(monkeypatch, client, capsys):
+    client = client(TypeError("bug"))
+    notify.slack("a", url="https://hooks.slack.com/x")
+    notify.slack("b", url="https://hooks.slack.com/x")
+    assert notify.flush(timeout=5)
+    assert client.posted == [ "a", "b" ]
+    assert "Slack notification failed: bug" in capsys.readouterr().err
@@ -0,0 +1,82 @@
+# coding: utf-8
+
+# Third-party packages
+import pytest
+
+# Proprietary packages
+from ctb import k8s
+from ctb import rollout
+
+
+def workload(kind, name, available):
+    count = 1 if available else 0
+    status = { "observedGeneration": 1, "replicas": 1, "updatedReplicas": count, "availableReplicas": count,
+               "desiredNumberScheduled": 1, "updatedNumberScheduled": count, "numberAvailable": count }
+    return {
+        "kind": kind,
+        "metadata": { "name": name, "namespace": "default", "generation": 1, "resourceVersion": "1" },
+        "spec": { "replicas": 1 },
+        "status": status
+    }
+
+def manifest(kind, name):
+    return { "kind": kind, "metadata": { "name": name, "namespace": "default" } }
+
+
+@pytest.fixture
+def cluster(monkeypatch):
+    """Serve the listings and watch events of each kind, keyed by kind. Each
+    listing is a list of items or an error, and the last one is served again."""
+    monkeypatch.setenv("DEPLOYMENT_NAME", "test")
+    monkeypatch.setattr(rollout.time, "sleep", lambda seconds: None)
+    listings = {}
+    events = {}
+    def query(kind, namespace=None, label_selector=None, field_selector=None):
+        assert label_selector == "skaffold.dev/run-id=ctb-test"
+        listing = listings[kind].pop(0) if len(listings[kind]) > 1 else listings[kind][0]
+        if isinstance(listing, Exception):
+            raise listing
+        return { "metadata": { "resourceVersion": "1" }, "items": listing }
+    def watch(kind, label_selector=None, resource_version=None, timeout=None, **kwargs):
+        for raw in events.pop(kind, []):
+            yield "MODIFIED", k8s.typed(raw)
+    monkeypatch.setattr(k8s, "query", query)
+    monkeypatch.setattr(k8s, "watch", watch)
+    return listings, events
+
+def test_track_returns_when_the_listing_is_ready(cluster):
+    listings, events = cluster
+    listings["Deployment"] = [ [ workload("Deployment", "frontend", True) ] ]
+    ready = rollout.track([ manifest("Deployment", "frontend"), manifest("Service", "frontend") ], deadline=5)
+    assert list(ready) == [ "Deployment/default/frontend" ]
+    assert ready["Deployment/default/frontend"] is not None
+
+def test_track_follows_the_watch_of_each_kind(cluster):
+    listings, events = cluster
+    listings["Deployment"] = [ [ workload("Deployment", "frontend", False) ] ]
+    listings["DaemonSet"] = [ [ workload("DaemonSet", "metricbeat", False) ] ]
+    events["Deployment"] = [ workload("Deployment", "frontend", True) ]
+    events["DaemonSet"] = [ workload("DaemonSet", "metricbeat", True) ]
+    ready = rollout.track([ manifest("Deployment", "frontend"), manifest("DaemonSet", "metricbeat") ], deadline=5)
+    assert all(ready.values())
+
+def test_track_lists_again_after_an_error(cluster):
+    listings, events = cluster
+    listings["Deployment"] = [ k8s.ApiError(410, "Gone"), [ workload("Deployment", "frontend", True) ] ]
+    assert rollout.track([ manifest("Deployment", "frontend") ], deadline=5)["Deployment/default/frontend"] is not None
+
+def test_track_raises_errors_that_retrying_does_not_fix(cluster):
+    listings, events = cluster
+    listings["Deployment"] = [ k8s.ApiError(403, "forbidden") ]
+    with pytest.raises(k8s.ApiError, match="403 forbidden"):
+        rollout.track([ manifest("Deployment", "frontend") ], deadline=5)
+
+def test_track_gives_up_at_the_deadline(cluster):
+    listings, events = cluster
+    listings["Deployment"] = [ [ workload("Deployment", "frontend", False) ] ]
+    assert rollout.track([ manifest("Deployment", "frontend") ], deadline=0.2) == { "Deployment/default/frontend": None }
+
+def test_table_lists_ready_workloads_first():
+    lines = rollout.table({ "Deployment/default/a": None, "Deployment/default/b": 130.0 }, 100.0)
+    assert lines[0].startswith("Deployment/default/b  0:30  ")
+    assert lines[1] == "Deployment/default/a  not ready"
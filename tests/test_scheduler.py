@@ -0,0 +1,77 @@
+# coding: utf-8
+
+# Standard packages
+import threading
+import time
+
+# Third-party packages
+import pytest
+
+# Proprietary packages
+from ctb import scheduler
+from ctb.scheduler import Task
+
+
+def test_order_puts_dependencies_first():
+    tasks = [
+        Task("c", None, depends=( "a", "b" )),
+        Task("b", None, depends=( "a", )),
+        Task("a", None)
+    ]
+    assert [ task.name for task in scheduler.order(tasks) ] == [ "a", "b", "c" ]
+
+def test_order_rejects_cycles():
+    tasks = [ Task("a", None, depends=( "b", )), Task("b", None, depends=( "a", )) ]
+    with pytest.raises(ValueError, match="cycle"):
+        scheduler.order(tasks)
+
+def test_order_rejects_unknown_dependencies():
+    with pytest.raises(ValueError, match="unknown task 'b'"):
+        scheduler.order([ Task("a", None, depends=( "b", )) ])
+
+def test_order_rejects_duplicates():
+    with pytest.raises(ValueError, match="Duplicate"):
+        scheduler.order([ Task("a", None), Task("a", None) ])
+
+def test_run_passes_dependency_results():
+    futures = scheduler.run([
+        Task("a", lambda: 2),
+        Task("b", lambda: 3),
+        Task("sum", lambda a, b: a + b, depends=( "a", "b" ))
+    ])
+    assert futures["sum"].result(timeout=5) == 5
+
+def test_run_starts_independent_tasks_concurrently():
+    barrier = threading.Barrier(2, timeout=5)
+    futures = scheduler.run([ Task("a", barrier.wait), Task("b", barrier.wait) ], max_workers=2)
+    futures["a"].result(timeout=5)
+    futures["b"].result(timeout=5)
+
+def test_run_starts_a_task_after_its_dependencies():
+    events = []
+    def work(name):
+        def function(*args):
+            events.append("start " + name)
+            time.sleep(0.05)
+            events.append("end " + name)
+            return name
+        return function
+    tasks = [ Task("a", work("a")), Task("b", work("b"), depends=( "a", )) ]
+    scheduler.run(tasks)["b"].result(timeout=5)
+    assert events == [ "start a", "end a", "start b", "end b" ]
+
+def test_run_propagates_exceptions_to_dependents():
+    def fail():
+        raise RuntimeError("boom")
+    futures = scheduler.run([ Task("a", fail), Task("b", lambda a: a, depends=( "a", )) ])
+    with pytest.raises(RuntimeError, match="boom"):
+        futures["b"].result(timeout=5)
+
+def test_timeline_lists_tasks_that_ran():
+    tasks = [ Task("a", None), Task("b", None), Task("skipped", None) ]
+    tasks[0].started, tasks[0].finished = 100.0, 130.0
+    tasks[1].started, tasks[1].finished = 110.0, 190.0
+    lines = scheduler.timeline(tasks, width=8)
+    assert len(lines) == 2
+    assert lines[0].startswith("a  0:00 - 0:30")
+    assert lines[1].startswith("b  0:10 - 1:30")
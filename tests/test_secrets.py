@@ -0,0 +1,53 @@
+# coding: utf-8
+
+# Standard packages
+import base64
+
+# Third-party packages
+import pytest
+
+# Proprietary packages
+from ctb import k8s
+from ctb import secrets
+
+
+VALUES = { "ELASTIC_APM_SECRET_TOKEN": "token" }
+
+
+@pytest.fixture
+def cluster(monkeypatch):
+    """Serve the live Secrets from a dict of content hashes keyed by
+    namespace, and record the objects applied."""
+    live = {}
+    applied = []
+    def query(kind, namespace=None, label_selector=None, field_selector=None, api_version=None):
+        assert ( kind, field_selector ) == ( "Secret", "metadata.name=ctb-secrets" )
+        return { "items": [
+            { "metadata": { "name": secrets.NAME, "namespace": namespace, "annotations": { secrets.HASH_ANNOTATION: digest } } }
+            for namespace, digest in live.items()
+        ] }
+    monkeypatch.setattr(secrets, "data", lambda: dict(VALUES))
+    monkeypatch.setattr(k8s, "query", query)
+    monkeypatch.setattr(k8s, "apply", applied.append)
+    return live, applied
+
+def test_ensure_writes_nothing_when_the_hashes_match(cluster):
+    live, applied = cluster
+    for namespace in secrets.NAMESPACES:
+        live[namespace] = secrets.content_hash(VALUES)
+    assert secrets.ensure() == []
+    assert applied == []
+
+def test_ensure_applies_once_per_stale_namespace(cluster):
+    live, applied = cluster
+    live["default"] = secrets.content_hash(VALUES)
+    live["kube-system"] = "stale"
+    assert secrets.ensure() == [ "kube-system" ]
+    assert [ secret["metadata"]["namespace"] for secret in applied ] == [ "kube-system" ]
+
+def test_ensure_creates_missing_secrets(cluster):
+    live, applied = cluster
+    assert secrets.ensure() == list(secrets.NAMESPACES)
+    secret = applied[0]
+    assert secret["metadata"]["annotations"][secrets.HASH_ANNOTATION] == secrets.content_hash(VALUES)
+    assert base64.b64decode(secret["data"]["ELASTIC_APM_SECRET_TOKEN"]) == b"token"
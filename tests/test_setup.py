@@ -0,0 +1,66 @@
+# coding: utf-8
+
+# Standard packages
+import importlib
+import sys
+
+# Third-party packages
+import pytest
+
+# Proprietary packages
+import ctb
+import ctb.commands
+
+
+def load_setup(monkeypatch, calls, failing=()):
+    """Import the setup command as the CLI dispatches it, in a clean state
+    where no other command module was imported, with its stages stubbed."""
+    for name in list(sys.modules):
+        if name.startswith("ctb.commands."):
+            monkeypatch.delitem(sys.modules, name)
+            monkeypatch.delattr(ctb.commands, name.rsplit(".", 1)[1], raising=False)
+    setup = importlib.import_module("ctb.commands.setup")
+    def stage(name):
+        def function(*args, **kwargs):
+            calls.append(name)
+            if name in failing:
+                raise setup.SetupError("{} failed".format(name))
+        return function
+    monkeypatch.setattr(setup, "validate_setup_ess", lambda: None)
+    monkeypatch.setattr(setup, "validate_setup_gke", lambda: None)
+    monkeypatch.setattr(setup, "run_setup_ess", stage("ess"))
+    monkeypatch.setattr(setup, "run_setup_gke", stage("gke"))
+    monkeypatch.setattr(setup, "run_setup_stable", stage("stable"))
+    monkeypatch.setattr(setup.ctb.commands.endpoints, "run", stage("endpoints"))
+    return setup
+
+def run_setup(argv):
+    command = next(command for command in ctb.COMMANDS if command.name == "setup")
+    command.run(command.parse(argv))
+
+def test_setup_runs_every_stage_then_lists_endpoints(monkeypatch, capsys):
+    calls = []
+    load_setup(monkeypatch, calls)
+    run_setup([])
+    assert sorted(calls[:2]) == [ "ess", "gke" ]
+    assert calls[2:] == [ "stable", "endpoints" ]
+    assert "Timeline:" in capsys.readouterr().out
+
+def test_setup_reports_a_failed_stage_once(monkeypatch, capsys):
+    calls = []
+    load_setup(monkeypatch, calls, failing=( "ess", ))
+    with pytest.raises(SystemExit) as exit:
+        run_setup([])
+    assert exit.value.code == 1
+    # GKE still ran to the end; the stable deploy and the endpoints did not.
+    assert sorted(calls) == [ "ess", "gke" ]
+    out = capsys.readouterr().out
+    assert out.count("failed:") == 1
+    assert "the 'ess' stage failed: ess failed" in out
+
+def test_setup_prefixes_the_output_of_each_stage(monkeypatch, capsys):
+    calls = []
+    setup = load_setup(monkeypatch, calls)
+    monkeypatch.setattr(setup, "run_setup_ess", lambda dev: print("creating deployment"))
+    run_setup([ "ess" ])
+    assert "[ess] creating deployment\n" in capsys.readouterr().out
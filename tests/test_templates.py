@@ -0,0 +1,44 @@
+# coding: utf-8
+
+# Third-party packages
+import pytest
+
+# Proprietary packages
+from ctb import templates
+
+
+@pytest.fixture
+def files(monkeypatch, tmp_path):
+    """Write template files under a temporary BASEDIR."""
+    monkeypatch.setenv("BASEDIR", str(tmp_path))
+    (tmp_path / "elasticsearch").mkdir()
+    templates.clear()
+    def write(name, text):
+        (tmp_path / "elasticsearch" / name).write_text(text)
+    yield write
+    templates.clear()
+
+def test_render_follows_expandvars(files):
+    files("message.md", "$SERVICE_NAME is slow (${THRESHOLD}, \\$ESCAPED, ${UNDEFINED}, $UNDEFINED).")
+    assert templates.render("message.md", { "SERVICE_NAME": "frontend" }) == "frontend is slow (${THRESHOLD}, \\$ESCAPED, ${UNDEFINED}, )."
+
+def test_files_are_read_once(files):
+    files("message.md", "$SERVICE_NAME")
+    assert templates.render("message.md", { "SERVICE_NAME": "a" }) == "a"
+    files("message.md", "changed $SERVICE_NAME")
+    assert templates.render("message.md", { "SERVICE_NAME": "b" }) == "b"
+
+def test_a_changed_context_variable_renders_again(files):
+    files("alert.json", '{ "name": "$SERVICE_NAME", "threshold": "$THRESHOLD" }')
+    first = templates.render_json("alert.json", { "SERVICE_NAME": "frontend", "THRESHOLD": "500", "OTHER": "x" })
+    # Variables that the template does not use are not part of the key.
+    assert templates.render_json("alert.json", { "SERVICE_NAME": "frontend", "THRESHOLD": "500", "OTHER": "y" }) == first
+    assert templates.render_json("alert.json", { "SERVICE_NAME": "frontend", "THRESHOLD": "900" }) == { "name": "frontend", "threshold": "900" }
+
+def test_mutated_results_do_not_leak_into_the_cache(files):
+    files("alert.json", '{ "actions": [ { "group": "fired" } ], "tags": [ "$SERVICE_NAME" ] }')
+    context = { "SERVICE_NAME": "frontend" }
+    payload = templates.render_json("alert.json", context)
+    payload["actions"][0]["group"] = "changed"
+    payload["tags"].append("ctb.hash:123")
+    assert templates.render_json("alert.json", context) == { "actions": [ { "group": "fired" } ], "tags": [ "frontend" ] }
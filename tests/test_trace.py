@@ -0,0 +1,85 @@
+# coding: utf-8
+
+# Standard packages
+import json
+import os
+import threading
+
+# Third-party packages
+import pytest
+import requests
+
+# Proprietary packages
+from ctb import http
+from ctb import trace
+from ctb import utils
+
+
+@pytest.fixture
+def enabled(monkeypatch):
+    monkeypatch.setattr(trace, "_enabled", False)
+    monkeypatch.setattr(trace, "_spans", [])
+    trace.enable()
+
+def run_in_thread(function):
+    thread = threading.Thread(target=function)
+    thread.start()
+    thread.join()
+
+def test_disabled_phases_record_nothing(monkeypatch):
+    monkeypatch.setattr(trace, "_enabled", False)
+    monkeypatch.setattr(trace, "_spans", [])
+    with trace.phase("start"):
+        pass
+    assert trace.spans() == []
+
+def test_phases_nest_across_inherited_threads(enabled):
+    def deploy():
+        with trace.phase("apply"):
+            pass
+    with trace.phase("start"):
+        run_in_thread(trace.inherit(deploy))
+        # Threads that do not inherit start at the top level.
+        run_in_thread(deploy)
+    assert sorted(span.path for span in trace.spans()) == [ ( "apply", ), ( "start", ), ( "start", "apply" ) ]
+
+def test_summary_is_a_tree_of_totals(enabled):
+    with trace.phase("start"):
+        for _ in range(2):
+            with trace.phase("apply"):
+                pass
+    lines = trace.summary()
+    assert lines[0].startswith("Profile (wall time ")
+    assert lines[1].split()[0] == "start"
+    assert lines[2].startswith("    apply")
+    assert lines[2].split()[3] == "2x"
+
+def test_chrome_trace_has_one_complete_event_per_span(enabled, tmp_path):
+    with trace.phase("request", category="http", url="https://example.com"):
+        pass
+    path = str(tmp_path / "trace.json")
+    trace.write_chrome_trace(path)
+    with open(path) as file:
+        document = json.load(file)
+    assert document["displayTimeUnit"] == "ms"
+    [ event ] = document["traceEvents"]
+    assert event["name"] == "request"
+    assert event["cat"] == "http"
+    assert event["ph"] == "X"
+    assert event["pid"] == os.getpid()
+    assert event["tid"] == threading.get_ident()
+    assert isinstance(event["ts"], int) and event["dur"] >= 0
+    assert event["args"] == { "url": "https://example.com" }
+
+def test_absolute_urls_are_traced_without_their_path(monkeypatch, enabled):
+    monkeypatch.setattr(requests.Session, "request", lambda self, method, url, *args, **kwargs: None)
+    session = http.Session("https://es.example.com")
+    session.request("GET", "/_cluster/health")
+    session.request("POST", "https://hooks.slack.com/services/T000/B000/SECRET")
+    assert [ span.args["url"] for span in trace.spans() ] == [ "https://es.example.com/_cluster/health", "https://hooks.slack.com/..." ]
+
+def test_commands_are_traced_without_their_arguments(enabled):
+    utils.cmd("true run --token=SECRET", stdout=False)
+    [ span ] = trace.spans()
+    assert span.name == "true run"
+    assert "SECRET" not in json.dumps(span.args)
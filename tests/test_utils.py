@@ -0,0 +1,97 @@
+# coding: utf-8
+
+# Standard packages
+import concurrent.futures
+import threading
+import time
+
+# Third-party packages
+import pytest
+
+# Proprietary packages
+from ctb import config
+from ctb import utils
+
+
+@pytest.fixture
+def envfile(monkeypatch, tmp_path):
+    """Return a .env file, and the list of the results of its flushes."""
+    path = tmp_path / ".env"
+    path.write_text("A=1\n")
+    monkeypatch.setenv("ENVFILE", str(path))
+    # setenv() sets the variables in os.environ too; restore them after.
+    monkeypatch.setenv("A", "1")
+    monkeypatch.delenv("B", raising=False)
+    monkeypatch.setitem(config._envfiles, str(path), config.EnvFile(str(path)))
+    flushes = []
+    flush = config.EnvFile.flush
+    def counted_flush(self):
+        flushes.append(flush(self))
+        return flushes[-1]
+    monkeypatch.setattr(config.EnvFile, "flush", counted_flush)
+    return path, flushes
+
+def test_envfile_transaction_writes_once(envfile):
+    path, flushes = envfile
+    with utils.envfile_transaction():
+        utils.setenv("A", "2")
+        utils.setenv("B", "3")
+        assert path.read_text() == "A=1\n"
+    assert path.read_text() == "A=2\nB=3\n"
+    assert flushes == [ True ]
+
+def test_envfile_transaction_writes_pending_changes_on_errors(envfile):
+    path, flushes = envfile
+    with pytest.raises(RuntimeError):
+        with utils.envfile_transaction():
+            utils.setenv("B", "3")
+            raise RuntimeError("setup failed")
+    assert path.read_text() == "A=1\nB=3\n"
+
+def test_setenv_outside_a_transaction_writes_at_once(envfile):
+    path, flushes = envfile
+    utils.setenv("A", "2")
+    assert path.read_text() == "A=2\n"
+    utils.setenv("A", "2")
+    assert flushes == [ True, False ]
+
+def test_parallel_tasks_keeps_the_order_of_tasks():
+    assert utils.parallel_tasks(lambda n: n * 2, [ 3, 1, 2 ]) == [ 6, 2, 4 ]
+
+def test_parallel_tasks_timeout_applies_to_the_batch():
+    started = time.time()
+    with pytest.raises(concurrent.futures.TimeoutError):
+        utils.parallel_tasks(time.sleep, [ 0.3 ] * 4, max_workers=4, timeout=0.1)
+    assert time.time() - started < 0.3
+
+def test_parallel_tasks_is_bounded():
+    running = []
+    peak = []
+    lock = threading.Lock()
+    def task(n):
+        with lock:
+            running.append(n)
+            peak.append(len(running))
+        time.sleep(0.02)
+        with lock:
+            running.remove(n)
+    utils.parallel_tasks(task, range(10), max_workers=3)
+    assert max(peak) == 3
+
+def test_expandvars_reads_the_context_before_the_environment(monkeypatch):
+    monkeypatch.setenv("SERVICE_NAME", "from-env")
+    monkeypatch.setenv("KIBANA_URL", "https://kibana")
+    monkeypatch.delenv("UNDEFINED", raising=False)
+    text = "$SERVICE_NAME ${THRESHOLD} $KIBANA_URL $UNDEFINED."
+    assert utils.expandvars(text, { "SERVICE_NAME": "frontend", "THRESHOLD": "500" }) == "frontend 500 https://kibana ."
+
+def test_output_prefix_applies_to_its_thread_only(capsys):
+    def stage():
+        with utils.output_prefix("[gke] "):
+            print("creating", end="")
+            print(" cluster")
+    thread = threading.Thread(target=stage)
+    thread.start()
+    thread.join()
+    print("main")
+    assert capsys.readouterr().out == "[gke] creating cluster\nmain\n"
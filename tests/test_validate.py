@@ -0,0 +1,44 @@
+# coding: utf-8
+
+# Third-party packages
+import pytest
+import requests
+
+# Proprietary packages
+from ctb import k8s
+from ctb.commands import validate
+
+
+def workload(kind, name, desired, ready):
+    return k8s.typed({
+        "kind": kind,
+        "metadata": { "name": name },
+        "spec": { "replicas": desired },
+        "status": { "readyReplicas": ready }
+    })
+
+@pytest.fixture
+def services(monkeypatch):
+    monkeypatch.setenv("DEPLOYMENT_NAME", "test")
+    monkeypatch.setattr(validate, "expected_services", lambda: [ "cartservice", "frontend" ])
+
+def test_microservices_report_their_replicas(monkeypatch, services):
+    def objects(kind, label_selector=None):
+        return [ workload("Deployment", "frontend", 2, 1) ] if kind == "Deployment" else []
+    monkeypatch.setattr(k8s, "objects", objects)
+    assert validate.run_validate_microservices() == {
+        "cartservice": { "desired": 0, "ready": 0 },
+        "frontend": { "desired": 2, "ready": 1 }
+    }
+
+@pytest.mark.parametrize("error", [ k8s.ApiError(403, "forbidden"), requests.exceptions.ConnectionError("refused") ])
+def test_microservices_are_unknown_when_the_cluster_fails(monkeypatch, services, error):
+    def objects(kind, label_selector=None):
+        raise error
+    monkeypatch.setattr(k8s, "objects", objects)
+    services = validate.run_validate_microservices()
+    assert sorted(services) == [ "cartservice", "frontend" ]
+    lines = validate.microservices_lines(services)
+    assert len(lines) == 4
+    assert "error: {}".format(error) in lines[1]
+    assert all("n/a" in line for line in lines[2:])
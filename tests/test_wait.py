@@ -0,0 +1,58 @@
+# coding: utf-8
+
+# Standard packages
+import io
+import subprocess
+
+# Third-party packages
+import pytest
+import requests
+
+# Proprietary packages
+from ctb import wait
+
+
+def until(*conditions):
+    return wait.until(*conditions, stream=io.StringIO())
+
+def test_returns_the_values_of_ready_conditions():
+    assert until(wait.Condition("a", lambda: "10.0.0.1"), wait.Condition("b", lambda: True)) == { "a": "10.0.0.1", "b": True }
+
+def test_polls_until_ready():
+    values = iter([ None, False, "ready" ])
+    assert until(wait.Condition("a", lambda: next(values), interval=0.01)) == { "a": "ready" }
+
+def test_retries_transient_errors():
+    errors = [ requests.exceptions.ConnectionError("down"), subprocess.CalledProcessError(1, "gcloud") ]
+    def check():
+        if errors:
+            raise errors.pop(0)
+        return True
+    assert until(wait.Condition("a", check, interval=0.01)) == { "a": True }
+
+def test_raises_other_errors_at_once():
+    calls = []
+    def check():
+        calls.append(1)
+        raise TypeError("bug")
+    with pytest.raises(TypeError, match="bug"):
+        until(wait.Condition("a", check, interval=0.01, timeout=60))
+    assert len(calls) == 1
+
+def test_raises_timeout_with_the_last_error():
+    def check():
+        raise requests.exceptions.ConnectionError("down")
+    with pytest.raises(wait.Timeout, match=r"a \(last error: down\)"):
+        until(wait.Condition("a", check, interval=0.01, timeout=0.05))
+
+def test_each_condition_has_its_own_deadline():
+    with pytest.raises(wait.Timeout) as error:
+        until(wait.Condition("slow", lambda: False, interval=0.01, timeout=0.05), wait.Condition("fast", lambda: True))
+    assert "slow" in str(error.value)
+    assert "fast" not in str(error.value)
+
+def test_backoff_grows_with_jitter_up_to_the_maximum():
+    condition = wait.Condition("a", None, interval=1, max_interval=4, factor=2)
+    delays = [ condition.backoff() for _ in range(5) ]
+    for delay, interval in zip(delays, [ 1, 2, 4, 4, 4 ]):
+        assert interval * 0.5 <= delay <= interval